@@ -9,8 +9,21 @@ Created on Mon Aug  4 21:28:35 2025
 import streamlit as st
 import pandas as pd
 import numpy as np
-from opened_data_loader import load_freeze_thaw_data_by_season, get_available_seasons
-from opened_coordinate_matcher import find_nearest_location
+from collections import deque
+from opened_data_loader import dataset_version
+from opened_dataset import load_dataset
+from opened_station_panel import (find_station_row, station_for_season_row, station_statistics,
+                                  VARIABILITY_LOW_MAX, VARIABILITY_MODERATE_MAX)
+from opened_coordinate_matcher import find_nearest_location_in_state, haversine_distance
+from opened_spatial_index import state_row_range
+from opened_window_statistics import season_window_statistics
+from opened_bootstrap import bootstrap_confidence_intervals, BOOTSTRAP_CONFIDENCE
+from opened_trend_analysis import TREND_ALPHA, TREND_MIN_SEASONS
+from opened_site_comparison import compare_sites
+from opened_region_statistics import region_statistics
+from opened_aggregate_pyramid import load_or_build_aggregate_pyramid, query_pyramid
+from opened_query_cache import QUERY_CACHE, query_cache_key, cache_get, cache_put, cache_stats
+from opened_instrumentation import query_timer, stage, timing_enabled, RECENT_RECORDS
 
 # Set page configuration
 st.set_page_config(
@@ -19,132 +32,83 @@ st.set_page_config(
     layout="centered"
 )
 
-def clean_county_name(county):
-    """Remove numbers from county names (e.g., Jefferson5 -> Jefferson)"""
-    if pd.isna(county):
-        return county
-    # Remove trailing numbers
-    import re
-    cleaned = re.sub(r'\d+$', '', str(county)).strip()
-    return cleaned if cleaned else str(county)
+@st.cache_resource(max_entries=1)
+def get_shared_dataset(version):
+    """
+    Read-only dataset shared by every session of this server process.
+    Reloaded only when the season workbooks change (a new version).
+    """
+    return load_dataset()
+
+# Dataset of this script run. Streamlit runs the script in a fresh module on
+# every rerun, so the workbooks are checked (a glob and a stat per workbook)
+# once per rerun rather than at every get_dataset() call.
+_run_dataset = None
+
+def get_dataset():
+    """The shared dataset for the current season workbooks"""
+    global _run_dataset
+    if _run_dataset is None:
+        _run_dataset = get_shared_dataset(dataset_version())
+    return _run_dataset
+
+@st.cache_resource(max_entries=1)
+def get_shared_aggregate_pyramid(version):
+    """State, county and tile aggregates for the map, built once per dataset version"""
+    dataset = get_dataset()
+    return load_or_build_aggregate_pyramid(list(dataset['seasons']), dataset['panel'])
+
+def get_aggregate_pyramid():
+    """The shared aggregate pyramid for the current season workbooks"""
+    return get_shared_aggregate_pyramid(get_dataset()['version'])
+
+def session_timing_records():
+    """Timing records of this browser session's queries, newest last"""
+    if 'timing_records' not in st.session_state:
+        st.session_state['timing_records'] = deque(maxlen=RECENT_RECORDS)
+    return st.session_state['timing_records']
 
-@st.cache_data
 def get_states_for_latest_season():
     """Get available states from the most recent season"""
     try:
-        seasons = get_available_seasons()
-        if not seasons:
-            return []
-        
-        latest_season = seasons[-1]  # Most recent season
-        data = load_freeze_thaw_data_by_season(latest_season)
-        if data.empty:
-            return []
-        
-        # Clean and get unique states
-        states = data['State'].dropna().astype(str).str.strip()
-        unique_states = states.unique()
-        clean_states = [state for state in unique_states if state and state.strip()]
-        return sorted(list(set(clean_states)))
+        return list(get_dataset()['states'])
     except Exception as e:
         st.error(f"Error loading states: {str(e)}")
         return []
 
-def calculate_comprehensive_statistics(location_data, all_seasons):
-    """Calculate statistics for all years and last 5 years for a specific location"""
+def calculate_comprehensive_statistics(location_data, all_seasons, station_id=None):
+    """
+    Calculate statistics for all years and last 5 years for a specific location.
+    Pass station_id when it is known; otherwise the station is resolved from
+    the location's State, County and coordinates.
+    """
     try:
-        location_stats = []
-        
-        # Get data for all seasons for this location
-        for season in all_seasons:
-            try:
-                season_data = load_freeze_thaw_data_by_season(season)
-                if season_data.empty:
-                    continue
-                
-                # Clean county names in season data
-                season_data['County_Clean'] = season_data['County'].apply(clean_county_name)
-                location_county_clean = clean_county_name(location_data['County'])
-                
-                # Find matching record by State and cleaned County
-                exact_match = season_data[
-                    (season_data['State'].str.strip().str.upper() == location_data['State'].strip().upper()) &
-                    (season_data['County_Clean'].str.strip().str.upper() == location_county_clean.strip().upper())
-                ]
-                
-                if not exact_match.empty:
-                    # If multiple matches, find the one with closest coordinates
-                    if len(exact_match) > 1:
-                        distances = []
-                        for idx, row in exact_match.iterrows():
-                            lat_diff = abs(row['Latitude'] - location_data['Latitude'])
-                            lon_diff = abs(row['Longitude'] - location_data['Longitude'])
-                            distance = (lat_diff**2 + lon_diff**2)**0.5
-                            distances.append(distance)
-                        
-                        closest_idx = exact_match.index[np.argmin(distances)]
-                        record = exact_match.loc[closest_idx]
-                    else:
-                        record = exact_match.iloc[0]
-                    
-                    location_stats.append({
-                        'Season': season,
-                        'Total_Cycles': record['Total_Freeze_Thaw_Cycles'],
-                        'Damaging_Cycles': record['Damaging_Freeze_Thaw_Cycles']
-                    })
-                    
-            except Exception as e:
-                continue
-        
-        if not location_stats:
-            return None
-        
-        # Convert to DataFrame and sort by season (most recent first)
-        stats_df = pd.DataFrame(location_stats)
-        stats_df = stats_df.sort_values('Season', ascending=False)
-        
-        # Get data arrays
-        total_cycles = stats_df['Total_Cycles'].values
-        damaging_cycles = stats_df['Damaging_Cycles'].values
-        
-        # ALL YEARS STATISTICS (up to 24 seasons)
-        total_all_avg = float(np.mean(total_cycles)) if len(total_cycles) > 0 else 0
-        damaging_all_avg = float(np.mean(damaging_cycles)) if len(damaging_cycles) > 0 else 0
-        
-        total_all_cov = float((np.std(total_cycles) / np.mean(total_cycles) * 100)) if len(total_cycles) > 1 and np.mean(total_cycles) > 0 else 0
-        damaging_all_cov = float((np.std(damaging_cycles) / np.mean(damaging_cycles) * 100)) if len(damaging_cycles) > 1 and np.mean(damaging_cycles) > 0 else 0
-        
-        # LAST 5 YEARS STATISTICS
-        recent_total = total_cycles[:5] if len(total_cycles) >= 5 else total_cycles
-        recent_damaging = damaging_cycles[:5] if len(damaging_cycles) >= 5 else damaging_cycles
-        
-        total_5yr_avg = float(np.mean(recent_total)) if len(recent_total) > 0 else 0
-        damaging_5yr_avg = float(np.mean(recent_damaging)) if len(recent_damaging) > 0 else 0
-        
-        total_5yr_cov = float((np.std(recent_total) / np.mean(recent_total) * 100)) if len(recent_total) > 1 and np.mean(recent_total) > 0 else 0
-        damaging_5yr_cov = float((np.std(recent_damaging) / np.mean(recent_damaging) * 100)) if len(recent_damaging) > 1 and np.mean(recent_damaging) > 0 else 0
-        
-        return {
-            'data': stats_df,
-            'total_all_avg': total_all_avg,
-            'damaging_all_avg': damaging_all_avg,
-            'total_all_cov': total_all_cov,
-            'damaging_all_cov': damaging_all_cov,
-            'total_5yr_avg': total_5yr_avg,
-            'damaging_5yr_avg': damaging_5yr_avg,
-            'total_5yr_cov': total_5yr_cov,
-            'damaging_5yr_cov': damaging_5yr_cov,
-            'years_available': len(total_cycles)
-        }
+        dataset = get_dataset()
+        panel = dataset['panel']
+        
+        if station_id is None:
+            station_id = find_station_row(panel, location_data)
+        stats = station_statistics(panel, station_id, dataset['summary'])
+        if stats is not None:
+            # Bootstrap uncertainty of the averages and COVs
+            stats['confidence_intervals'] = bootstrap_confidence_intervals(panel, [station_id]).iloc[0]
+        return stats
     except Exception as e:
         st.error(f"Error calculating statistics: {str(e)}")
         return None
 
+def show_confidence_interval(stats, key, unit=""):
+    """Caption with the bootstrap confidence interval of one statistic, when available"""
+    intervals = stats.get('confidence_intervals')
+    if intervals is None or np.isnan(intervals[f'{key}_low']):
+        return
+    st.caption(f"{BOOTSTRAP_CONFIDENCE:.0%} CI: {intervals[f'{key}_low']:.1f}{unit} – {intervals[f'{key}_high']:.1f}{unit}")
+
 def get_variability_category(cov):
     """Categorize variability based on COV"""
-    if cov < 15:
+    if cov < VARIABILITY_LOW_MAX:
         return "Low", "🟢"
-    elif cov <= 40:
+    elif cov <= VARIABILITY_MODERATE_MAX:
         return "Moderate", "🟡"
     else:
         return "High", "🔴"
@@ -154,7 +118,7 @@ def main():
     st.markdown("Enter location coordinates to analyze freeze-thaw cycle data with 24-year and 5-year statistical summaries.")
     
     # Get all available seasons
-    all_seasons = get_available_seasons()
+    all_seasons = list(get_dataset()['seasons'])
     if not all_seasons:
         st.error("No freeze-thaw data files found. Please add Excel files to the project.")
         return
@@ -202,156 +166,477 @@ def main():
             help="Enter longitude in decimal degrees"
         )
     
+    # Optional season range for a custom statistics section
+    season_window = st.select_slider(
+        "Custom season window",
+        options=all_seasons,
+        value=(all_seasons[0], all_seasons[-1]),
+        help="Also report statistics for this range of seasons (leave at the full range to skip)"
+    )
+    
     # Search button
     if st.button("Analyze Freeze-Thaw Data", type="primary"):
-        # Validate inputs
-        if not state:
-            st.error("Please select a state.")
-            return
+        with query_timer('analyze', session_timing_records(), state=state, latitude=latitude, longitude=longitude):
+            analyze_location(state, latitude, longitude, all_seasons, season_window)
+    
+    show_site_comparison(available_states)
+    show_aggregate_map()
+    show_region_statistics()
+    show_trend_table()
+    show_reject_report()
+    show_timing_panel()
+
+def analyze_location(state, latitude, longitude, all_seasons, season_window=None):
+    """Run and display the analysis for one location query"""
+    # Validate inputs
+    if not state:
+        st.error("Please select a state.")
+        return
+    
+    if latitude is None or longitude is None:
+        st.error("Please enter both latitude and longitude values.")
+        return
+    
+    # Data from the most recent season for location search (shared, not copied)
+    dataset = get_dataset()
+    latest_season = all_seasons[-1]
+    search_data = dataset['season_data'][latest_season]
+    if search_data.empty:
+        st.error("No data available for location search.")
+        return
+    
+    # Repeated and nearby queries reuse the matched station and its statistics
+    cache_key = query_cache_key(QUERY_CACHE, state, latitude, longitude, dataset['version'])
+    cached = cache_get(QUERY_CACHE, cache_key)
+    
+    if cached is None:
+        # Rows of the selected state (exact name) in the precomputed partition
+        partition = dataset['state_partition']
+        with stage('state_filter'):
+            state_start, state_end = state_row_range(partition, state)
         
-        if latitude is None or longitude is None:
-            st.error("Please enter both latitude and longitude values.")
+        if state_start == state_end:
+            st.error(f"No data found for state: {state}")
+            st.info("Available states in database:")
+            st.write(", ".join(dataset['states']))
             return
+    
+    # Find nearest location: one nationwide search, preferring stations of the selected state
+    try:
+        if cached is None:
+            nearest_location, distance, in_state = find_nearest_location_in_state(
+                latitude, longitude, search_data, partition, state)
+        else:
+            nearest_location, in_state = cached['nearest_location'], cached['in_state']
+            distance = haversine_distance(latitude, longitude,
+                                          nearest_location['Latitude'], nearest_location['Longitude'])
         
-        # Load data from the most recent season for location search
-        latest_season = all_seasons[-1]
-        search_data = load_freeze_thaw_data_by_season(latest_season)
-        if search_data.empty:
-            st.error("No data available for location search.")
+        if nearest_location is None:
+            st.warning(
+                f"No monitoring stations found within 50 km of the specified coordinates in or around {state}. "
+                "Try searching with coordinates closer to populated areas."
+            )
+            
+            # Show available locations in the state
+            st.subheader(f"Available monitoring stations in {state}:")
+            state_data = search_data.iloc[partition['order'][state_start:state_end]]
+            display_data = state_data[['County_Clean', 'Latitude', 'Longitude', 'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']]
+            display_data = display_data.rename(columns={'County_Clean': 'County'})
+            st.dataframe(display_data, use_container_width=True)
             return
         
-        # Filter data by state first
-        state_data = search_data[search_data['State'].str.contains(state, case=False, na=False)]
+        # Clean county name for display
+        clean_county = nearest_location['County_Clean']
         
-        if state_data.empty:
-            st.error(f"No data found for state: {state}")
-            available_states_list = sorted(search_data['State'].unique())
-            st.info("Available states in database:")
-            st.write(", ".join(available_states_list))
-            return
+        # Display results
+        st.success(f"✅ Nearest monitoring station found!")
+        if not in_state:
+            st.info(f"No monitoring station in {state} is within 50 km; "
+                    f"showing the nearest station across the border in {nearest_location['State']}.")
         
-        # Find nearest location
-        try:
-            nearest_location, distance = find_nearest_location(latitude, longitude, state_data)
-            
-            if nearest_location is None:
-                st.warning(
-                    f"No monitoring stations found within 50 km of the specified coordinates in {state}. "
-                    "Try searching with coordinates closer to populated areas."
-                )
-                
-                # Show available locations in the state
-                st.subheader(f"Available monitoring stations in {state}:")
-                display_data = state_data[['County', 'Latitude', 'Longitude', 'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']].copy()
-                display_data['County'] = display_data['County'].apply(clean_county_name)
-                st.dataframe(display_data, use_container_width=True)
-                return
-            
-            # Clean county name for display
-            clean_county = clean_county_name(nearest_location['County'])
-            
-            # Display results
-            st.success(f"✅ Nearest monitoring station found!")
-            
-            # Location information
-            st.subheader("📍 Station Details")
-            
-            info_col1, info_col2 = st.columns(2)
-            
-            with info_col1:
-                st.metric("County", clean_county)
-                st.metric("State", nearest_location['State'])
-                st.metric("Distance", f"{distance:.2f} km")
-            
-            with info_col2:
-                st.metric("Station Latitude", f"{nearest_location['Latitude']:.6f}")
-                st.metric("Station Longitude", f"{nearest_location['Longitude']:.6f}")
-                st.metric("Available Seasons", len(all_seasons))
-            
-            # Calculate comprehensive statistics
-            st.subheader("📊 Statistical Analysis")
-            
+        # Location information
+        st.subheader("📍 Station Details")
+        
+        info_col1, info_col2 = st.columns(2)
+        
+        with info_col1:
+            st.metric("County", clean_county)
+            st.metric("State", nearest_location['State'])
+            st.metric("Distance", f"{distance:.2f} km")
+        
+        with info_col2:
+            st.metric("Station Latitude", f"{nearest_location['Latitude']:.6f}")
+            st.metric("Station Longitude", f"{nearest_location['Longitude']:.6f}")
+            st.metric("Available Seasons", len(all_seasons))
+        
+        # Calculate comprehensive statistics
+        st.subheader("📊 Statistical Analysis")
+        
+        if cached is None:
             with st.spinner("Calculating historical statistics..."):
-                stats = calculate_comprehensive_statistics(nearest_location, all_seasons)
-            
-            if stats is None:
-                st.warning("Unable to calculate historical statistics for this location.")
-                return
-            
-            # Display statistical summary - LAST 5 YEARS FIRST
-            st.markdown("### 📊 Last 5 Years Analysis")
-            recent_col1, recent_col2 = st.columns(2)
-            
-            with recent_col1:
-                st.markdown("**Total Freeze-Thaw Cycles (Last 5 Years)**")
-                st.metric("Average", f"{stats['total_5yr_avg']:.1f}")
-                
-                total_5yr_var_cat, total_5yr_var_icon = get_variability_category(stats['total_5yr_cov'])
-                st.metric("COV", f"{stats['total_5yr_cov']:.1f}%")
-                st.markdown(f"{total_5yr_var_icon} **{total_5yr_var_cat} Variability**")
-            
-            with recent_col2:
-                st.markdown("**Damaging Freeze-Thaw Cycles (Last 5 Years)**")
-                st.metric("Average", f"{stats['damaging_5yr_avg']:.1f}")
-                
-                damaging_5yr_var_cat, damaging_5yr_var_icon = get_variability_category(stats['damaging_5yr_cov'])
-                st.metric("COV", f"{stats['damaging_5yr_cov']:.1f}%")
-                st.markdown(f"{damaging_5yr_var_icon} **{damaging_5yr_var_cat} Variability**")
-            
-            # 24-YEAR ANALYSIS SECTION
-            st.markdown("### 📈 24-Year Analysis (All Available Data)")
-            all_col1, all_col2 = st.columns(2)
-            
-            with all_col1:
-                st.markdown("**Total Freeze-Thaw Cycles (24 Years)**")
-                st.metric("Average", f"{stats['total_all_avg']:.1f}")
-                
-                total_all_var_cat, total_all_var_icon = get_variability_category(stats['total_all_cov'])
-                st.metric("COV", f"{stats['total_all_cov']:.1f}%")
-                st.markdown(f"{total_all_var_icon} **{total_all_var_cat} Variability**")
-            
-            with all_col2:
-                st.markdown("**Damaging Freeze-Thaw Cycles (24 Years)**")
-                st.metric("Average", f"{stats['damaging_all_avg']:.1f}")
-                
-                damaging_all_var_cat, damaging_all_var_icon = get_variability_category(stats['damaging_all_cov'])
-                st.metric("COV", f"{stats['damaging_all_cov']:.1f}%")
-                st.markdown(f"{damaging_all_var_icon} **{damaging_all_var_cat} Variability**")
-            
-            # Historical Data Table - Last 5 Years Only
-            st.markdown("### 📋 Historical Data Summary (Last 5 Years)")
-            
-            # Format the data for display - show only last 5 years
-            display_stats = stats['data'].head(5).copy()
-            display_stats['Total_Cycles'] = display_stats['Total_Cycles'].round(1)
-            display_stats['Damaging_Cycles'] = display_stats['Damaging_Cycles'].round(1)
-            
-            # Rename columns for better display
-            display_stats = display_stats.rename(columns={
-                'Season': 'Season',
-                'Total_Cycles': 'Total Cycles',
-                'Damaging_Cycles': 'Damaging Cycles'
-            })
+                # Station ID of the matched row in the latest season
+                station_id = station_for_season_row(
+                    dataset['panel'], latest_season,
+                    search_data.index.get_loc(nearest_location.name)
+                )
+                stats = calculate_comprehensive_statistics(nearest_location, all_seasons, station_id)
+            if stats is not None:
+                cache_put(QUERY_CACHE, cache_key,
+                          {'nearest_location': nearest_location, 'in_state': in_state,
+                           'station_id': station_id, 'stats': stats})
+        else:
+            station_id, stats = cached['station_id'], cached['stats']
+        
+        if stats is None:
+            st.warning("Unable to calculate historical statistics for this location.")
+            return
+        
+        # Display statistical summary - LAST 5 YEARS FIRST
+        st.markdown("### 📊 Last 5 Years Analysis")
+        recent_col1, recent_col2 = st.columns(2)
+        
+        with recent_col1:
+            st.markdown("**Total Freeze-Thaw Cycles (Last 5 Years)**")
+            st.metric("Average", f"{stats['total_5yr_avg']:.1f}")
+            show_confidence_interval(stats, 'total_5yr_avg')
             
-            st.dataframe(display_stats, use_container_width=True)
+            total_5yr_var_cat, total_5yr_var_icon = get_variability_category(stats['total_5yr_cov'])
+            st.metric("COV", f"{stats['total_5yr_cov']:.1f}%")
+            show_confidence_interval(stats, 'total_5yr_cov', '%')
+            st.markdown(f"{total_5yr_var_icon} **{total_5yr_var_cat} Variability**")
+        
+        with recent_col2:
+            st.markdown("**Damaging Freeze-Thaw Cycles (Last 5 Years)**")
+            st.metric("Average", f"{stats['damaging_5yr_avg']:.1f}")
+            show_confidence_interval(stats, 'damaging_5yr_avg')
             
-            # COV Interpretation Guide
-            st.markdown("### 📖 Coefficient of Variation (COV) Guide")
-            st.markdown("""
-            **COV measures the relative variability of freeze-thaw cycles:**
-            - 🟢 **Low Variability (COV < 15%)**: Consistent
-            - 🟡 **Moderate Variability (15% ≤ COV ≤ 40%)**: Some fluctuation 
-            - 🔴 **High Variability (COV > 40%)**: Highly variable
+            damaging_5yr_var_cat, damaging_5yr_var_icon = get_variability_category(stats['damaging_5yr_cov'])
+            st.metric("COV", f"{stats['damaging_5yr_cov']:.1f}%")
+            show_confidence_interval(stats, 'damaging_5yr_cov', '%')
+            st.markdown(f"{damaging_5yr_var_icon} **{damaging_5yr_var_cat} Variability**")
+        
+        # 24-YEAR ANALYSIS SECTION
+        st.markdown("### 📈 24-Year Analysis (All Available Data)")
+        all_col1, all_col2 = st.columns(2)
+        
+        with all_col1:
+            st.markdown("**Total Freeze-Thaw Cycles (24 Years)**")
+            st.metric("Average", f"{stats['total_all_avg']:.1f}")
+            show_confidence_interval(stats, 'total_all_avg')
             
-            - **Each season represents a winter period from September to April.**
-            - **Total Freeze-Thaw Cycles**: Represents all freezing events that the concrete experienced during the monitoring period, regardless of the moisture condition.
-            - **Damaging Freeze-Thaw Cycles**: Refers to the subset of freeze-thaw cycles during which the Degree of Saturation (DOS) exceeded the critical threshold of 80%, making the concrete susceptible to freeze-thaw damage.
+            total_all_var_cat, total_all_var_icon = get_variability_category(stats['total_all_cov'])
+            st.metric("COV", f"{stats['total_all_cov']:.1f}%")
+            show_confidence_interval(stats, 'total_all_cov', '%')
+            st.markdown(f"{total_all_var_icon} **{total_all_var_cat} Variability**")
+        
+        with all_col2:
+            st.markdown("**Damaging Freeze-Thaw Cycles (24 Years)**")
+            st.metric("Average", f"{stats['damaging_all_avg']:.1f}")
+            show_confidence_interval(stats, 'damaging_all_avg')
             
-            *Note: Results are based on the nearest available monitoring station and may not reflect exact conditions at your specific location.*
-            """)
+            damaging_all_var_cat, damaging_all_var_icon = get_variability_category(stats['damaging_all_cov'])
+            st.metric("COV", f"{stats['damaging_all_cov']:.1f}%")
+            show_confidence_interval(stats, 'damaging_all_cov', '%')
+            st.markdown(f"{damaging_all_var_icon} **{damaging_all_var_cat} Variability**")
+        
+        # CUSTOM SEASON WINDOW SECTION
+        if season_window and station_id is not None and tuple(season_window) != (all_seasons[0], all_seasons[-1]):
+            show_window_statistics(dataset, station_id, *season_window)
+        
+        # TREND SECTION
+        if station_id is not None:
+            show_trend_statistics(dataset, station_id)
+        
+        # Historical Data Table - Last 5 Years Only
+        st.markdown("### 📋 Historical Data Summary (Last 5 Years)")
+        
+        # Format the data for display - show only last 5 years
+        display_stats = stats['data'].head(5).copy()
+        display_stats['Total_Cycles'] = display_stats['Total_Cycles'].round(1)
+        display_stats['Damaging_Cycles'] = display_stats['Damaging_Cycles'].round(1)
+        
+        # Rename columns for better display
+        display_stats = display_stats.rename(columns={
+            'Season': 'Season',
+            'Total_Cycles': 'Total Cycles',
+            'Damaging_Cycles': 'Damaging Cycles'
+        })
+        
+        st.dataframe(display_stats, use_container_width=True)
+        
+        # COV Interpretation Guide
+        st.markdown("### 📖 Coefficient of Variation (COV) Guide")
+        st.markdown("""
+        **COV measures the relative variability of freeze-thaw cycles:**
+        - 🟢 **Low Variability (COV < 15%)**: Consistent
+        - 🟡 **Moderate Variability (15% ≤ COV ≤ 40%)**: Some fluctuation 
+        - 🔴 **High Variability (COV > 40%)**: Highly variable
+        - **CI**: Bootstrap confidence interval from resampling the station's seasons
+        
+        - **Each season represents a winter period from September to April.**
+        - **Total Freeze-Thaw Cycles**: Represents all freezing events that the concrete experienced during the monitoring period, regardless of the moisture condition.
+        - **Damaging Freeze-Thaw Cycles**: Refers to the subset of freeze-thaw cycles during which the Degree of Saturation (DOS) exceeded the critical threshold of 80%, making the concrete susceptible to freeze-thaw damage.
+        
+        *Note: Results are based on the nearest available monitoring station and may not reflect exact conditions at your specific location.*
+        """)
+        
+    except Exception as e:
+        st.error(f"Error during analysis: {str(e)}")
+
+def show_window_statistics(dataset, station_id, first_season, last_season):
+    """Averages and COVs of one station over a custom range of seasons"""
+    window_stats = season_window_statistics(dataset['panel'], first_season, last_season,
+                                            dataset['season_prefix_sums']).loc[station_id]
+    
+    st.markdown(f"### 📅 Custom Window ({first_season} to {last_season})")
+    if window_stats['years_in_window'] == 0:
+        st.info("This station has no data in the selected seasons.")
+        return
+    st.caption(f"{int(window_stats['years_in_window'])} seasons with data in the window")
+    
+    window_col1, window_col2 = st.columns(2)
+    for column, measure, label in [(window_col1, 'total', 'Total'), (window_col2, 'damaging', 'Damaging')]:
+        with column:
+            st.markdown(f"**{label} Freeze-Thaw Cycles**")
+            st.metric("Average", f"{window_stats[f'{measure}_avg']:.1f}")
             
-        except Exception as e:
-            st.error(f"Error during analysis: {str(e)}")
+            var_cat, var_icon = get_variability_category(window_stats[f'{measure}_cov'])
+            st.metric("COV", f"{window_stats[f'{measure}_cov']:.1f}%")
+            st.markdown(f"{var_icon} **{var_cat} Variability**")
+
+TREND_ICONS = {'Increasing': '📈', 'Decreasing': '📉', 'No trend': '➖'}
+
+def show_trend_statistics(dataset, station_id):
+    """Mann-Kendall trend and Sen's slope of one station's Total and Damaging cycles"""
+    trend = dataset['station_trends'].loc[station_id]
+    
+    st.markdown("### 📈 Trend Analysis (Mann-Kendall)")
+    if trend['total_trend'] == '':
+        st.info(f"At least {TREND_MIN_SEASONS} seasons of data are needed to test for a trend.")
+        return
+    
+    trend_col1, trend_col2 = st.columns(2)
+    for column, measure, label in [(trend_col1, 'total', 'Total'), (trend_col2, 'damaging', 'Damaging')]:
+        with column:
+            st.markdown(f"**{label} Freeze-Thaw Cycles**")
+            st.metric("Sen's Slope", f"{trend[f'{measure}_sen_slope']:+.2f} cycles/season")
+            st.metric("p-value", f"{trend[f'{measure}_p_value']:.3f}")
+            st.markdown(f"{TREND_ICONS[trend[f'{measure}_trend']]} **{trend[f'{measure}_trend']}** "
+                        f"(Mann-Kendall S = {trend[f'{measure}_mk_s']:.0f}, Z = {trend[f'{measure}_mk_z']:.2f})")
+    st.caption(f"A trend is reported when the two-sided p-value is below {TREND_ALPHA}.")
+
+def show_site_comparison(available_states):
+    """Side-by-side statistics of several candidate sites, matched in one batch"""
+    with st.expander("🆚 Compare Sites"):
+        st.markdown("Add one row per candidate site; all sites are matched and summarized together.")
+        default_state = "Colorado" if "Colorado" in available_states else available_states[0]
+        sites = st.data_editor(
+            pd.DataFrame({'site_id': ["Site 1"], 'state': [default_state],
+                          'lat': [39.84657], 'lon': [-104.65623]}),
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                'site_id': st.column_config.TextColumn("Site"),
+                'state': st.column_config.SelectboxColumn("State", options=available_states, required=True),
+                'lat': st.column_config.NumberColumn("Latitude", min_value=-90.0, max_value=90.0, format="%.6f"),
+                'lon': st.column_config.NumberColumn("Longitude", min_value=-180.0, max_value=180.0, format="%.6f")
+            },
+            key="comparison_sites"
+        )
+        
+        if not st.button("Compare Sites"):
+            return
+        sites = sites.dropna(subset=['state', 'lat', 'lon'])
+        if sites.empty:
+            st.error("Please enter at least one site with a state, latitude and longitude.")
+            return
+        
+        with query_timer('compare', session_timing_records(), sites=len(sites)):
+            comparison = compare_sites(sites, get_dataset())['table']
+        
+        unmatched = comparison['station_id'].isna().sum()
+        if unmatched:
+            st.warning(f"{unmatched} site(s) have no monitoring station within 50 km.")
+        
+        display_table = comparison.drop(columns=['station_id', 'in_state']).round(
+            {'distance_km': 2, 'total_5yr_avg': 1, 'total_5yr_cov': 1, 'damaging_5yr_avg': 1, 'damaging_5yr_cov': 1,
+             'total_all_avg': 1, 'total_all_cov': 1, 'damaging_all_avg': 1, 'damaging_all_cov': 1})
+        st.dataframe(display_table, use_container_width=True, hide_index=True)
+        st.download_button("Download comparison (CSV)", comparison.to_csv(index=False),
+                           file_name="site_comparison.csv", mime="text/csv")
+
+MAP_LAYERS = {"Grid tiles": 'tile', "Counties": 'county', "States": 'state'}
+
+def map_colors(values):
+    """Blue (lowest) to red (highest) hex color per value; grey for missing values"""
+    values = np.asarray(values, dtype=float)
+    low, high = np.nanmin(values, initial=np.inf), np.nanmax(values, initial=-np.inf)
+    scale = np.clip((values - low) / (high - low) if high > low else np.zeros(len(values)), 0, 1)
+    red = np.round(255 * scale).astype(int)
+    blue = 255 - red
+    return [f"#{r:02x}40{b:02x}" if not np.isnan(value) else "#999999"
+            for r, b, value in zip(red, blue, values)]
+
+def show_aggregate_map():
+    """Map of average cycles per tile, county or state, drawn from the pre-aggregated pyramid"""
+    with st.expander("🗺️ Freeze-Thaw Map"):
+        panel = get_dataset()['panel']
+        if len(panel['Latitude']) == 0:
+            st.info("No stations to map.")
+            return
+        
+        map_col1, map_col2 = st.columns(2)
+        with map_col1:
+            layer = MAP_LAYERS[st.radio("Aggregate by", list(MAP_LAYERS), horizontal=True)]
+        with map_col2:
+            measure = st.radio("Cycles", ["Total", "Damaging"], horizontal=True).lower()
+        
+        lat_extent = (float(np.floor(np.min(panel['Latitude']))), float(np.ceil(np.max(panel['Latitude']))))
+        lon_extent = (float(np.floor(np.min(panel['Longitude']))), float(np.ceil(np.max(panel['Longitude']))))
+        lat_min, lat_max = st.slider("Latitude range", -90.0, 90.0, lat_extent, step=0.5)
+        lon_min, lon_max = st.slider("Longitude range", -180.0, 180.0, lon_extent, step=0.5)
+        
+        aggregates = query_pyramid(get_aggregate_pyramid(), layer, lat_min, lat_max, lon_min, lon_max)
+        aggregates = aggregates.loc[aggregates[f'{measure}_count'] > 0].copy()
+        if aggregates.empty:
+            st.info("No stations in the selected area.")
+            return
+        
+        aggregates['color'] = map_colors(aggregates[f'{measure}_mean'])
+        if layer == 'tile':
+            aggregates['size'] = aggregates['tile_deg'] * 111_000 / 2
+            st.caption(f"{len(aggregates)} tiles of {aggregates['tile_deg'].iloc[0]:g}° "
+                       f"(blue = fewest, red = most {measure} cycles per season)")
+        else:
+            aggregates['size'] = 15_000 if layer == 'county' else 60_000
+            st.caption(f"{len(aggregates)} {'counties' if layer == 'county' else 'states'} at their station centroids "
+                       f"(blue = fewest, red = most {measure} cycles per season)")
+        st.map(aggregates, latitude='latitude', longitude='longitude', size='size', color='color')
+        
+        table_columns = [column for column in ['State', 'County', 'lat_min', 'lon_min', 'tile_deg']
+                         if column in aggregates.columns]
+        st.dataframe(aggregates[table_columns + ['stations', f'{measure}_mean', f'{measure}_cov']].round(
+            {f'{measure}_mean': 1, f'{measure}_cov': 1}), use_container_width=True, hide_index=True)
+
+def parse_polygon(text):
+    """Polygon vertex arrays from 'latitude, longitude' lines"""
+    vertices = [[float(value) for value in line.replace(';', ',').split(',')]
+                for line in text.strip().splitlines() if line.strip()]
+    if len(vertices) < 3 or any(len(vertex) != 2 for vertex in vertices):
+        raise ValueError("Enter at least 3 vertices as 'latitude, longitude', one per line")
+    vertices = np.array(vertices)
+    return vertices[:, 0], vertices[:, 1]
+
+def show_region_statistics():
+    """Area-level statistics of every station inside a box, circle or polygon"""
+    with st.expander("📐 Region Statistics"):
+        region_type = st.radio("Region", ["Bounding box", "Radius", "Polygon"], horizontal=True)
+        region = {}
+        
+        if region_type == "Bounding box":
+            box_col1, box_col2 = st.columns(2)
+            with box_col1:
+                lat_min = st.number_input("Minimum latitude", -90.0, 90.0, 39.0, format="%.6f", key="region_lat_min")
+                lon_min = st.number_input("Minimum longitude", -180.0, 180.0, -106.0, format="%.6f", key="region_lon_min")
+            with box_col2:
+                lat_max = st.number_input("Maximum latitude", -90.0, 90.0, 41.0, format="%.6f", key="region_lat_max")
+                lon_max = st.number_input("Maximum longitude", -180.0, 180.0, -104.0, format="%.6f", key="region_lon_max")
+            region['bbox'] = (lat_min, lat_max, lon_min, lon_max)
+        elif region_type == "Radius":
+            radius_col1, radius_col2, radius_col3 = st.columns(3)
+            with radius_col1:
+                center_lat = st.number_input("Center latitude", -90.0, 90.0, 39.84657, format="%.6f", key="region_lat")
+            with radius_col2:
+                center_lon = st.number_input("Center longitude", -180.0, 180.0, -104.65623, format="%.6f", key="region_lon")
+            with radius_col3:
+                radius_km = st.number_input("Radius (km)", 0.0, 5000.0, 100.0, key="region_radius")
+            region['center'], region['radius_km'] = (center_lat, center_lon), radius_km
+        else:
+            polygon_text = st.text_area("Polygon vertices (latitude, longitude per line)",
+                                        "41.0, -109.05\n41.0, -102.05\n37.0, -102.05\n37.0, -109.05",
+                                        key="region_polygon")
+        
+        if not st.button("Calculate Region Statistics"):
+            return
+        
+        try:
+            if region_type == "Polygon":
+                region['polygon'] = parse_polygon(polygon_text)
+            dataset = get_dataset()
+            with query_timer('region', session_timing_records(), region=region_type):
+                stations, area = region_statistics(dataset['summary'], dataset['station_buckets'], **region)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        
+        if area['stations'] == 0:
+            st.info("No monitoring stations inside this region.")
+            return
+        st.caption(f"{int(area['stations'])} stations; every station-season value in the region is pooled")
+        
+        for window, title in [('5yr', "Last 5 Years"), ('all', "All Years")]:
+            st.markdown(f"**{title}**")
+            region_col1, region_col2 = st.columns(2)
+            for column, measure, label in [(region_col1, 'total', 'Total'), (region_col2, 'damaging', 'Damaging')]:
+                with column:
+                    st.metric(f"{label} Average", f"{area[f'{measure}_{window}_avg']:.1f}")
+                    var_cat, var_icon = get_variability_category(area[f'{measure}_{window}_cov'])
+                    st.metric(f"{label} COV", f"{area[f'{measure}_{window}_cov']:.1f}%")
+                    st.markdown(f"{var_icon} **{var_cat} Variability**")
+        
+        st.dataframe(stations[['State', 'County', 'Latitude', 'Longitude', 'years_available',
+                               'total_5yr_avg', 'total_5yr_cov', 'damaging_5yr_avg', 'damaging_5yr_cov',
+                               'total_all_avg', 'total_all_cov', 'damaging_all_avg', 'damaging_all_cov']].round(1),
+                     use_container_width=True)
+
+def show_trend_table():
+    """Trend test results of every station, with a CSV download"""
+    with st.expander("📈 Trends at All Stations"):
+        trends = get_dataset()['station_trends'].round({
+            'total_mk_z': 3, 'damaging_mk_z': 3, 'total_p_value': 4, 'damaging_p_value': 4,
+            'total_sen_slope': 3, 'damaging_sen_slope': 3
+        })
+        st.dataframe(trends, use_container_width=True)
+        st.download_button("Download trends (CSV)", trends.to_csv(), file_name="station_trends.csv",
+                           mime="text/csv")
+
+def show_reject_report():
+    """Workbook rows that were dropped while cleaning, per season and reason"""
+    rejects = get_dataset()['rejects']
+    with st.expander(f"🧹 Rows Dropped While Cleaning ({len(rejects)})"):
+        if rejects.empty:
+            st.markdown("Every workbook row passed validation.")
+            return
+        st.dataframe(rejects.groupby(['season', 'reason']).size().rename('rows').reset_index(),
+                     use_container_width=True, hide_index=True)
+        st.caption("Rows are 0-based data rows of each workbook (the header row is not counted).")
+        st.dataframe(rejects, use_container_width=True, hide_index=True)
+
+def show_timing_panel():
+    """Sidebar breakdown of this session's last query stage timings (when FREEZE_THAW_TIMING is set)"""
+    records = session_timing_records()
+    if not timing_enabled() or not records:
+        return
+    
+    record = records[-1]
+    st.sidebar.subheader("⏱️ Last Query Timing")
+    st.sidebar.metric("Total", f"{record['total_ms']:.1f} ms")
+    
+    stage_rows = [{'Stage': name, 'Calls': times['calls'], 'Self (ms)': round(times['self_ms'], 2),
+                   'Total (ms)': round(times['total_ms'], 2)}
+                  for name, times in record['stages'].items()]
+    stage_rows.append({'Stage': '(untimed)', 'Calls': 1, 'Self (ms)': round(record['untimed_ms'], 2),
+                       'Total (ms)': round(record['untimed_ms'], 2)})
+    st.sidebar.dataframe(pd.DataFrame(stage_rows), use_container_width=True, hide_index=True)
+    query_cache = cache_stats(QUERY_CACHE)
+    st.sidebar.caption(f"Query cache: {query_cache['entries']}/{query_cache['max_entries']} entries, "
+                       f"{query_cache['hits']} hits, {query_cache['misses']} misses "
+                       f"({query_cache['hit_rate']:.0%} hit rate)")
+    
+    if record['counters']:
+        st.sidebar.json(record['counters'])
+    if 'profile' in record:
+        st.sidebar.caption(f"Profile saved to {record['profile']}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
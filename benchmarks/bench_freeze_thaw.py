@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 14:05:52 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Benchmarks for the loader, matcher and statistics on synthetic data.
+#
+#   python benchmarks/bench_freeze_thaw.py --output bench.json
+#   python benchmarks/bench_freeze_thaw.py --scales 1000,10000 --compare bench.json
+#
+# Every benchmark runs in a fresh process so its peak RSS is its own. Worker
+# processes it starts (parallel ingest) are reported separately as the peak
+# RSS of the largest worker.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYNTHETIC_STATES = ['Colorado', 'Idaho', 'Illinois', 'Iowa', 'Kansas', 'Minnesota', 'Missouri',
+                    'Nebraska', 'New York', 'North Dakota', 'Oklahoma', 'Oregon', 'Pennsylvania',
+                    'Wisconsin']
+
+# Benchmarks that need the .xlsx workbooks; the others use the columnar files
+WORKBOOK_BENCHMARKS = ['ingest_workbooks', 'ingest_workbooks_parallel', 'ingest_cache_hit']
+COLUMNAR_BENCHMARKS = ['panel_build', 'index_build', 'nearest_single_scan', 'nearest_single_indexed',
+                       'grid_build', 'nearest_single_grid', 'nearest_batch', 'statistics_summary', 'statistics_single', 'store_open']
+
+def synthetic_seasons(n_stations, n_seasons, seed=0):
+    """
+    Synthetic season DataFrames in the workbook layout: stations spread over
+    the continental US, a few percent missing each season, damaging <= total
+    """
+    rng = np.random.default_rng(seed)
+    latitudes = rng.uniform(30, 49, n_stations).round(6)
+    longitudes = rng.uniform(-124, -70, n_stations).round(6)
+    states = np.array(SYNTHETIC_STATES)[((longitudes + 124) / 54 * len(SYNTHETIC_STATES)).astype(int)]
+    # No trailing digits, so clean_county_name keeps every county distinct
+    counties = np.char.add(np.char.add('County', np.arange(n_stations).astype(str)), 'A')
+    base_cycles = rng.uniform(5, 150, n_stations)
+
+    seasons = [f'{year}-{year + 1}' for year in range(2024 - n_seasons, 2024)]
+    frames = {}
+    for season in seasons:
+        present = rng.random(n_stations) > 0.03
+        total = np.maximum(0, np.round(base_cycles * rng.normal(1, 0.25, n_stations)))[present]
+        damaging = np.minimum(total, np.round(total * rng.uniform(0.3, 1.0, present.sum())))
+        frames[season] = pd.DataFrame({
+            'State': states[present],
+            'County': counties[present],
+            'Latitude': latitudes[present],
+            'Longitude': longitudes[present],
+            'Total Freeze Thaw Cycles': total.astype(int),
+            'Damaging Freeze Thaw Cycles': damaging.astype(int)
+        })
+    return frames
+
+def generate_dataset(data_dir, n_stations, n_seasons, write_workbooks):
+    """Write season workbooks (optional) and one .npz columnar file per season"""
+    os.makedirs(os.path.join(data_dir, 'columnar'), exist_ok=True)
+    for season, frame in synthetic_seasons(n_stations, n_seasons).items():
+        if write_workbooks:
+            frame.to_excel(os.path.join(data_dir, f'Predicted Freeze-Thaw Cycles ({season}).xlsx'), index=False)
+        columns = {}
+        for column in frame.columns:
+            values = frame[column].to_numpy()
+            columns[column] = values.astype(str) if values.dtype == object else values
+        np.savez(os.path.join(data_dir, 'columnar', f'{season}.npz'), **columns)
+
+def _load_columnar_frames(data_dir):
+    """Season DataFrames from the .npz columnar files, with the loader's column names"""
+    columnar_dir = os.path.join(data_dir, 'columnar')
+    seasons = sorted(name[:-4] for name in os.listdir(columnar_dir) if name.endswith('.npz'))
+    frames = []
+    for season in seasons:
+        with np.load(os.path.join(columnar_dir, f'{season}.npz')) as columns:
+            frame = pd.DataFrame({name: columns[name] for name in columns.files})
+        frames.append(frame.rename(columns={'Total Freeze Thaw Cycles': 'Total_Freeze_Thaw_Cycles',
+                                            'Damaging Freeze Thaw Cycles': 'Damaging_Freeze_Thaw_Cycles'}))
+    return seasons, frames
+
+def _query_points(n_queries, seed=1):
+    """Random query coordinates over the synthetic data extent"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(30, 49, n_queries), rng.uniform(-124, -70, n_queries)
+
+def _run_benchmark(benchmark, data_dir, n_queries, connection):
+    """Child process: run one benchmark and send back wall time, its peak RSS and that of its workers"""
+    import resource
+
+    os.chdir(data_dir)
+    os.environ['FREEZE_THAW_CACHE_DIR'] = os.path.join(data_dir, 'cache')
+    sys.path.insert(0, REPO_DIR)
+
+    import opened_data_loader
+    import opened_station_panel
+    import opened_coordinate_matcher
+    import opened_spatial_index
+    import opened_station_store
+
+    details = {}
+    try:
+        if benchmark in ['ingest_workbooks', 'ingest_workbooks_parallel']:
+            shutil.rmtree(opened_data_loader.CACHE_DIR, ignore_errors=True)
+            workers = 1 if benchmark == 'ingest_workbooks' else None
+            start = time.perf_counter()
+            _, timings = opened_data_loader.load_all_seasons(workers=workers)
+            wall = time.perf_counter() - start
+            details['files'] = len(timings)
+        elif benchmark == 'ingest_cache_hit':
+            opened_data_loader.load_all_seasons()
+            start = time.perf_counter()
+            _, timings = opened_data_loader.load_all_seasons()
+            wall = time.perf_counter() - start
+            details['sources'] = sorted(set(timing['source'] for timing in timings))
+        else:
+            seasons, frames = _load_columnar_frames(data_dir)
+            start = time.perf_counter()
+            panel = opened_station_panel.build_panel_from_frames(seasons, frames)
+            wall = time.perf_counter() - start
+            latest = pd.DataFrame({'Latitude': panel['Latitude'], 'Longitude': panel['Longitude']})
+            query_lats, query_lons = _query_points(n_queries)
+
+            if benchmark == 'index_build':
+                start = time.perf_counter()
+                opened_spatial_index.build_station_index(latest['Latitude'], latest['Longitude'])
+                wall = time.perf_counter() - start
+            elif benchmark == 'grid_build':
+                start = time.perf_counter()
+                grid = opened_spatial_index.build_nearest_grid(latest['Latitude'], latest['Longitude'])
+                wall = time.perf_counter() - start
+                details['cells'] = grid['nearest'].size
+            elif benchmark in ['nearest_single_scan', 'nearest_single_indexed', 'nearest_single_grid']:
+                use_index = benchmark == 'nearest_single_indexed'
+                use_grid = benchmark == 'nearest_single_grid'
+                if use_index:
+                    opened_spatial_index.load_or_build_station_index(latest['Latitude'].to_numpy(),
+                                                                     latest['Longitude'].to_numpy())
+                if use_grid:
+                    opened_spatial_index.load_or_build_nearest_grid(latest['Latitude'].to_numpy(),
+                                                                    latest['Longitude'].to_numpy())
+                n_single = min(n_queries, 200)
+                start = time.perf_counter()
+                for query_lat, query_lon in zip(query_lats[:n_single], query_lons[:n_single]):
+                    opened_coordinate_matcher.find_nearest_locations(query_lat, query_lon, latest,
+                                                                     use_index=use_index, use_grid=use_grid)
+                wall = (time.perf_counter() - start) / n_single
+                details['per_query'] = True
+            elif benchmark == 'nearest_batch':
+                start = time.perf_counter()
+                opened_coordinate_matcher.find_nearest_locations(query_lats, query_lons, latest)
+                wall = time.perf_counter() - start
+                details['queries'] = n_queries
+            elif benchmark == 'statistics_summary':
+                start = time.perf_counter()
+                opened_station_panel.compute_station_summary(panel)
+                wall = time.perf_counter() - start
+            elif benchmark == 'statistics_single':
+                rows = np.linspace(0, len(panel['State']) - 1, 100).astype(int)
+                start = time.perf_counter()
+                for row in rows:
+                    opened_station_panel.station_statistics(panel, row)
+                wall = (time.perf_counter() - start) / len(rows)
+                details['per_query'] = True
+            elif benchmark == 'store_open':
+                store_path = os.path.join(data_dir, 'cache', opened_station_store.STORE_FILE)
+                opened_station_store.write_station_store(store_path, panel, frames)
+                start = time.perf_counter()
+                store = opened_station_store.open_station_store(store_path)
+                # Sum one column so its pages are actually read, not just mapped
+                np.sum(store['Latitude'])
+                wall = time.perf_counter() - start
+                details['store_mb'] = os.path.getsize(store_path) / 1e6
+
+        # ru_maxrss is in KB; RUSAGE_CHILDREN covers the largest finished worker
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        workers_peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        connection.send({'wall_seconds': wall, 'peak_rss_mb': peak_rss_mb,
+                         'workers_peak_rss_mb': workers_peak_rss_mb, **details})
+    except Exception as e:
+        connection.send({'error': f'{type(e).__name__}: {str(e)}'})
+    finally:
+        connection.close()
+
+def run_in_subprocess(benchmark, data_dir, n_queries):
+    """Run one benchmark in a fresh spawned process"""
+    context = multiprocessing.get_context('spawn')
+    parent_end, child_end = context.Pipe(duplex=False)
+    process = context.Process(target=_run_benchmark, args=(benchmark, data_dir, n_queries, child_end))
+    process.start()
+    child_end.close()
+    try:
+        result = parent_end.recv()
+    except EOFError:
+        result = {'error': f'benchmark process exited with code {process.exitcode}'}
+    process.join()
+    return result
+
+def environment_info():
+    """Interpreter, library and host details stored with the results"""
+    try:
+        commit = subprocess.check_output(['git', '-C', REPO_DIR, 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def compare_results(current, previous, threshold):
+    """
+    Print wall time, peak RSS and worker peak RSS ratios against a previous run
+
+    Returns:
+    - List of (benchmark key, metric, ratio) entries slower/larger than threshold
+    """
+    def keyed(results):
+        return {(r['benchmark'], r['stations'], r['seasons']): r for r in results['results'] if 'error' not in r}
+
+    previous_results = keyed(previous)
+    regressions = []
+    print(f"{'benchmark':<26}{'stations':>10}{'seasons':>8}{'time x':>10}{'rss x':>9}{'workers x':>11}")
+    for key, result in keyed(current).items():
+        if key not in previous_results:
+            continue
+        old = previous_results[key]
+        time_ratio = result['wall_seconds'] / old['wall_seconds'] if old['wall_seconds'] > 0 else float('nan')
+        rss_ratio = result['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] > 0 else float('nan')
+        # Results written before worker RSS was recorded have no baseline for it
+        old_workers = old.get('workers_peak_rss_mb', 0)
+        workers_ratio = result['workers_peak_rss_mb'] / old_workers if old_workers > 0 else float('nan')
+        flag = ''
+        if time_ratio > threshold:
+            regressions.append((key, 'wall_seconds', time_ratio))
+            flag += ' SLOWER'
+        if rss_ratio > threshold:
+            regressions.append((key, 'peak_rss_mb', rss_ratio))
+            flag += ' LARGER'
+        if workers_ratio > threshold:
+            regressions.append((key, 'workers_peak_rss_mb', workers_ratio))
+            flag += ' WORKERS LARGER'
+        print(f"{key[0]:<26}{key[1]:>10}{key[2]:>8}{time_ratio:>10.2f}{rss_ratio:>9.2f}{workers_ratio:>11.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the freeze-thaw loader, matcher and statistics.")
+    parser.add_argument('--scales', default='1000,10000,100000,1000000',
+                        help="Comma-separated station counts (default: 1000,10000,100000,1000000)")
+    parser.add_argument('--seasons', type=int, default=5, help="Seasons per dataset (default: 5)")
+    parser.add_argument('--queries', type=int, default=10000,
+                        help="Query points for the batch nearest-station benchmark (default: 10000)")
+    parser.add_argument('--max-workbook-stations', type=int, default=10000,
+                        help="Largest scale that also gets .xlsx workbooks and ingest benchmarks "
+                             "(default: 10000; writing large workbooks is slow)")
+    parser.add_argument('--benchmarks', default=None,
+                        help="Comma-separated subset of benchmarks to run (default: all)")
+    parser.add_argument('--data-dir', default=None,
+                        help="Keep the synthetic data here instead of a temporary directory")
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Previous JSON results to compare with")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Ratio over the previous run reported as a regression (default: 1.25)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Exit with status 1 when a regression is found")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    selected = args.benchmarks.split(',') if args.benchmarks else WORKBOOK_BENCHMARKS + COLUMNAR_BENCHMARKS
+    base_dir = args.data_dir or tempfile.mkdtemp(prefix='freeze_thaw_bench_')
+
+    results = {'environment': environment_info(), 'results': []}
+    try:
+        for n_stations in scales:
+            data_dir = os.path.join(base_dir, f'{n_stations}_stations_{args.seasons}_seasons')
+            write_workbooks = n_stations <= args.max_workbook_stations
+            if not os.path.isdir(os.path.join(data_dir, 'columnar')):
+                print(f"Generating {n_stations} stations x {args.seasons} seasons...")
+                generate_dataset(data_dir, n_stations, args.seasons, write_workbooks)
+
+            for benchmark in selected:
+                if benchmark in WORKBOOK_BENCHMARKS and not write_workbooks:
+                    continue
+                result = run_in_subprocess(benchmark, data_dir, args.queries)
+                result = {'benchmark': benchmark, 'stations': n_stations, 'seasons': args.seasons, **result}
+                results['results'].append(result)
+                if 'error' in result:
+                    print(f"{benchmark:<26}{n_stations:>10}  ERROR {result['error']}")
+                else:
+                    print(f"{benchmark:<26}{n_stations:>10}{result['wall_seconds']:>12.6f} s"
+                          f"{result['peak_rss_mb']:>10.1f} MB{result['workers_peak_rss_mb']:>10.1f} MB workers")
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to '{args.output}'")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as previous_file:
+            previous = json.load(previous_file)
+        regressions = compare_results(results, previous, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 01:58:13 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Pre-aggregated freeze-thaw statistics for maps: per state, per county and
+# per grid tile at several zoom levels. Each group keeps the count, sum and
+# sum of squares of its station-season values, so a coarser tile is the sum
+# of its four children and the finest level is the only one built from the
+# stations. Only counts (int32) and means / COVs (float32) are stored.
+#
+# Tiles are indexed by (row, col) = floor((lat + 90) / deg), floor((lon + 180) / deg);
+# level L has tiles of PYRAMID_FINEST_DEG * 2 ** L degrees, finest first, and
+# within a level tiles are sorted by row, then col.
+import os
+import numpy as np
+import pandas as pd
+import opened_data_loader
+from opened_station_panel import load_station_panel
+from opened_data_loader import dataset_version
+
+PYRAMID_FILE = 'aggregate_pyramid.npz'
+PYRAMID_FINEST_DEG = 0.25
+PYRAMID_LEVELS = 6
+
+# Tiles returned at most when choose_tile_level picks a level for a view
+PYRAMID_MAX_TILES = 2000
+
+PYRAMID_MEASURES = ['total', 'damaging']
+
+# Part of the pyramid cache key with the tile levels and measures; bump it
+# whenever the stored columns or their computation change
+PYRAMID_FORMAT_VERSION = 1
+
+def _station_moments(panel):
+    """Per-station season count, sum and sum of squares of each measure (NaN seasons skipped)"""
+    moments = {}
+    for measure in PYRAMID_MEASURES:
+        values = np.asarray(panel[measure], dtype=float)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        moments[f'{measure}_count'] = present.sum(axis=1).astype(float)
+        moments[f'{measure}_sum'] = filled.sum(axis=1)
+        moments[f'{measure}_sum_sq'] = (filled ** 2).sum(axis=1)
+    return moments
+
+def _sum_groups(codes, n_groups, moments, latitudes, longitudes):
+    """Sum per-station moments (including the station count) and coordinates into n_groups groups"""
+    sums = {name: np.bincount(codes, weights=values, minlength=n_groups) for name, values in moments.items()}
+    sums['latitude_sum'] = np.bincount(codes, weights=latitudes, minlength=n_groups)
+    sums['longitude_sum'] = np.bincount(codes, weights=longitudes, minlength=n_groups)
+    return sums
+
+def _group_statistics(prefix, sums):
+    """Compact stored columns of a layer: station and value counts, centroid, mean and COV (%)"""
+    stations = sums['stations']
+    safe_stations = np.maximum(stations, 1)
+    columns = {
+        f'{prefix}_stations': stations.astype(np.int32),
+        f'{prefix}_latitude': (sums['latitude_sum'] / safe_stations).astype(np.float32),
+        f'{prefix}_longitude': (sums['longitude_sum'] / safe_stations).astype(np.float32)
+    }
+    for measure in PYRAMID_MEASURES:
+        counts = sums[f'{measure}_count']
+        safe_counts = np.maximum(counts, 1)
+        mean = sums[f'{measure}_sum'] / safe_counts
+        std = np.sqrt(np.maximum(sums[f'{measure}_sum_sq'] / safe_counts - mean ** 2, 0))
+        cov = np.where((counts > 1) & (mean > 0), std / np.where(mean > 0, mean, 1) * 100, 0.0)
+        columns[f'{prefix}_{measure}_count'] = counts.astype(np.int32)
+        columns[f'{prefix}_{measure}_mean'] = np.where(counts > 0, mean, np.nan).astype(np.float32)
+        columns[f'{prefix}_{measure}_cov'] = cov.astype(np.float32)
+    return columns
+
+def build_aggregate_pyramid(panel):
+    """
+    Aggregate a station x season panel by state, county and grid tile
+
+    Returns:
+    - Dictionary of arrays:
+      - 'state_names'; 'county_states' and 'county_names' (cleaned county)
+      - 'tile_deg' (tile size per level), 'tile_offsets' (start of each
+        level in the tile arrays, plus the end), 'tile_row' and 'tile_col'
+      - For each layer (state, county, tile): '{layer}_stations',
+        '{layer}_latitude' / '{layer}_longitude' (station centroid) and, for
+        total and damaging, '{layer}_{m}_count' (station-season values),
+        '{layer}_{m}_mean' and '{layer}_{m}_cov' over those values
+    """
+    latitudes = np.asarray(panel['Latitude'], dtype=float)
+    longitudes = np.asarray(panel['Longitude'], dtype=float)
+    moments = _station_moments(panel)
+    moments['stations'] = np.ones(len(latitudes))
+    pyramid = {}
+
+    states = np.char.upper(np.char.strip(np.asarray(panel['State'], dtype=str)))
+    state_names, state_codes = np.unique(states, return_inverse=True)
+    pyramid['state_names'] = state_names
+    pyramid.update(_group_statistics('state', _sum_groups(state_codes, len(state_names), moments,
+                                                          latitudes, longitudes)))
+
+    counties = np.asarray(panel['County_Clean'], dtype=str)
+    county_keys, county_codes = np.unique(np.char.add(np.char.add(states, '|'), counties), return_inverse=True)
+    county_states, county_names = zip(*(key.split('|', 1) for key in county_keys)) if len(county_keys) else ((), ())
+    pyramid['county_states'] = np.asarray(county_states, dtype=str)
+    pyramid['county_names'] = np.asarray(county_names, dtype=str)
+    pyramid.update(_group_statistics('county', _sum_groups(county_codes, len(county_keys), moments,
+                                                           latitudes, longitudes)))
+
+    # Finest tiles from the stations, then each level from the one below
+    tile_deg = PYRAMID_FINEST_DEG * 2.0 ** np.arange(PYRAMID_LEVELS)
+    rows = np.floor((latitudes + 90) / tile_deg[0]).astype(np.int64)
+    cols = np.floor((longitudes + 180) / tile_deg[0]).astype(np.int64)
+    member_sums = {**moments, 'latitude_sum': latitudes, 'longitude_sum': longitudes}
+
+    level_rows, level_cols, level_columns = [], [], []
+    for level in range(PYRAMID_LEVELS):
+        if level > 0:
+            rows, cols = rows // 2, cols // 2
+        n_cols = int(360 / tile_deg[level]) + 1
+        keys, codes = np.unique(rows * n_cols + cols, return_inverse=True)
+        member_sums = {name: np.bincount(codes, weights=values, minlength=len(keys))
+                       for name, values in member_sums.items()}
+        rows, cols = keys // n_cols, keys % n_cols
+        level_rows.append(rows)
+        level_cols.append(cols)
+        level_columns.append(_group_statistics('tile', member_sums))
+
+    pyramid['tile_deg'] = tile_deg
+    pyramid['tile_offsets'] = np.concatenate([[0], np.cumsum([len(rows) for rows in level_rows])]).astype(np.int64)
+    pyramid['tile_row'] = np.concatenate(level_rows).astype(np.int32)
+    pyramid['tile_col'] = np.concatenate(level_cols).astype(np.int32)
+    for name in level_columns[0]:
+        pyramid[name] = np.concatenate([columns[name] for columns in level_columns])
+    return pyramid
+
+def load_or_build_aggregate_pyramid(seasons=None, panel=None):
+    """
+    Aggregate pyramid of the current season workbooks, persisted as
+    CACHE_DIR/aggregate_pyramid.npz and rebuilt only when a workbook,
+    PYRAMID_FORMAT_VERSION, the tile levels or the measures change
+    """
+    if seasons is None:
+        seasons = opened_data_loader.get_available_seasons()
+    signature = (f'{dataset_version(seasons)}|format={PYRAMID_FORMAT_VERSION}|'
+                 f'finest_deg={PYRAMID_FINEST_DEG:g}|levels={PYRAMID_LEVELS}|measures={",".join(PYRAMID_MEASURES)}')
+    pyramid_path = os.path.join(opened_data_loader.CACHE_DIR, PYRAMID_FILE)
+
+    try:
+        with np.load(pyramid_path, allow_pickle=False) as cached:
+            if str(cached['signature']) == signature:
+                return {name: cached[name] for name in cached.files if name != 'signature'}
+    except (OSError, KeyError, ValueError):
+        pass
+
+    if panel is None:
+        panel = load_station_panel(seasons)
+    pyramid = build_aggregate_pyramid(panel)
+    try:
+        os.makedirs(opened_data_loader.CACHE_DIR, exist_ok=True)
+        temp_path = f'{pyramid_path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, signature=np.array(signature), **pyramid)
+        os.replace(temp_path, pyramid_path)
+    except OSError as e:
+        print(f"Warning: Could not write aggregate pyramid cache: {str(e)}")
+    return pyramid
+
+def _layer_frame(pyramid, layer, rows):
+    """DataFrame of the stored statistics of some groups of a layer (float32 values widened to float)"""
+    frame = pd.DataFrame({
+        'latitude': pyramid[f'{layer}_latitude'][rows].astype(float),
+        'longitude': pyramid[f'{layer}_longitude'][rows].astype(float),
+        'stations': pyramid[f'{layer}_stations'][rows]
+    })
+    for measure in PYRAMID_MEASURES:
+        frame[f'{measure}_count'] = pyramid[f'{layer}_{measure}_count'][rows]
+        frame[f'{measure}_mean'] = pyramid[f'{layer}_{measure}_mean'][rows].astype(float)
+        frame[f'{measure}_cov'] = pyramid[f'{layer}_{measure}_cov'][rows].astype(float)
+    return frame
+
+def choose_tile_level(pyramid, lat_min, lat_max, lon_min, lon_max, max_tiles=PYRAMID_MAX_TILES):
+    """Finest tile level whose tile grid over the box has at most max_tiles cells"""
+    for level, deg in enumerate(pyramid['tile_deg']):
+        n_tiles = (np.floor(lat_max / deg) - np.floor(lat_min / deg) + 1) * \
+                  (np.floor(lon_max / deg) - np.floor(lon_min / deg) + 1)
+        if n_tiles <= max_tiles:
+            return level
+    return len(pyramid['tile_deg']) - 1
+
+def query_pyramid(pyramid, layer, lat_min, lat_max, lon_min, lon_max, level=None):
+    """
+    Pre-aggregated statistics inside a bounding box
+
+    Parameters:
+    - pyramid: build_aggregate_pyramid / load_or_build_aggregate_pyramid result
+    - layer: 'state', 'county' or 'tile'
+    - lat_min, lat_max, lon_min, lon_max: Bounding box in decimal degrees
+    - level: Tile level (default: choose_tile_level for the box)
+
+    Returns:
+    - DataFrame with the group's name (State, County) or tile bounds
+      (lat_min, lat_max, lon_min, lon_max, tile_deg), the station centroid
+      (latitude, longitude), stations and the count, mean and cov of total
+      and damaging cycles. States and counties are selected by centroid;
+      tiles by overlap with the box.
+    """
+    if layer in ['state', 'county']:
+        latitudes = pyramid[f'{layer}_latitude']
+        longitudes = pyramid[f'{layer}_longitude']
+        rows = np.flatnonzero((latitudes >= lat_min) & (latitudes <= lat_max) &
+                              (longitudes >= lon_min) & (longitudes <= lon_max))
+        names = {'State': pyramid['state_names'][rows]} if layer == 'state' else \
+                {'State': pyramid['county_states'][rows], 'County': pyramid['county_names'][rows]}
+        return pd.concat([pd.DataFrame(names), _layer_frame(pyramid, layer, rows)], axis=1)
+
+    if layer != 'tile':
+        raise ValueError(f"Unknown pyramid layer '{layer}'")
+    if level is None:
+        level = choose_tile_level(pyramid, lat_min, lat_max, lon_min, lon_max)
+
+    deg = pyramid['tile_deg'][level]
+    start, end = pyramid['tile_offsets'][level], pyramid['tile_offsets'][level + 1]
+    row_min, row_max = np.floor((lat_min + 90) / deg), np.floor((lat_max + 90) / deg)
+    col_min, col_max = np.floor((lon_min + 180) / deg), np.floor((lon_max + 180) / deg)
+
+    # Tiles are sorted by row: narrow to the box's rows, then filter columns
+    level_rows = pyramid['tile_row'][start:end]
+    first, last = np.searchsorted(level_rows, [row_min, row_max + 1])
+    cols = pyramid['tile_col'][start + first:start + last]
+    rows = start + first + np.flatnonzero((cols >= col_min) & (cols <= col_max))
+
+    tile_rows = pyramid['tile_row'][rows].astype(float)
+    tile_cols = pyramid['tile_col'][rows].astype(float)
+    bounds = pd.DataFrame({
+        'lat_min': tile_rows * deg - 90, 'lat_max': (tile_rows + 1) * deg - 90,
+        'lon_min': tile_cols * deg - 180, 'lon_max': (tile_cols + 1) * deg - 180,
+        'tile_deg': np.full(len(rows), deg)
+    })
+    return pd.concat([bounds, _layer_frame(pyramid, 'tile', rows)], axis=1)
\ No newline at end of file
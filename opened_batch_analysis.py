@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 11:20:05 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import opened_data_loader
+from opened_station_store import STORE_FILE, load_station_store, open_station_store, store_season_frame, store_summary
+from opened_spatial_index import build_state_partition
+from opened_coordinate_matcher import find_nearest_locations_in_state
+
+STATISTIC_COLUMNS = ['total_5yr_avg', 'total_5yr_cov', 'damaging_5yr_avg', 'damaging_5yr_cov',
+                     'total_all_avg', 'total_all_cov', 'damaging_all_avg', 'damaging_all_cov',
+                     'years_available']
+
+OUTPUT_COLUMNS = ['site_id', 'state', 'lat', 'lon', 'station_state', 'station_county',
+                  'station_latitude', 'station_longitude', 'distance_km', 'in_state'] + STATISTIC_COLUMNS
+
+# Stations shared by the functions below (load_batch_stations); set once per
+# worker process from the memory-mapped station store
+_STATIONS = None
+
+def build_station_table(summary):
+    """
+    Station coordinates with their 5-year and all-years statistics,
+    i.e. what the app would report for each station
+
+    Parameters:
+    - summary: Rows of the station summary table (load_station_summary)
+      for the stations sites may be matched to
+
+    Returns:
+    - DataFrame with State, County, Latitude, Longitude and STATISTIC_COLUMNS
+    """
+    return summary[['State', 'County', 'Latitude', 'Longitude'] + STATISTIC_COLUMNS].reset_index(drop=True)
+
+def load_batch_stations(store):
+    """
+    What sites are matched against, from a station store
+
+    Returns:
+    - Dictionary with 'search_data' (the latest season's rows, searched like
+      the app does), 'partition' (build_state_partition of those rows),
+      'row_station' (station ID of each row) and 'station_table'
+      (build_station_table of every station, indexed by station ID)
+    """
+    seasons = store['seasons']
+    if len(seasons):
+        search_data = store_season_frame(store, seasons[-1])
+        row_station = store['row_station'][store['row_offsets'][-2]:store['row_offsets'][-1]]
+    else:
+        search_data = pd.DataFrame({'State': [], 'Latitude': [], 'Longitude': []})
+        row_station = np.empty(0, dtype=np.int32)
+
+    return {
+        'search_data': search_data,
+        'partition': build_state_partition(search_data['State'].astype(str).to_numpy(),
+                                           search_data['Latitude'].to_numpy(dtype=float),
+                                           search_data['Longitude'].to_numpy(dtype=float)),
+        'row_station': row_station,
+        'station_table': build_station_table(store_summary(store))
+    }
+
+def _init_worker(store_path):
+    """Process pool initializer: map the station store read-only and prepare the stations once"""
+    global _STATIONS
+    _STATIONS = load_batch_stations(open_station_store(store_path))
+
+def analyze_sites(sites, stations=None, max_distance_km=50):
+    """
+    Match a batch of sites to their nearest station, preferring the site's
+    state like the app (find_nearest_locations_in_state), and attach that
+    station's statistics. A site whose state has no station in range gets
+    the nearest station across the border, with in_state False.
+
+    Parameters:
+    - sites: DataFrame with site_id, state, lat and lon columns
+    - stations: Output of load_batch_stations (default: the worker's stations)
+    - max_distance_km: Maximum matching distance (default 50 km)
+
+    Returns:
+    - DataFrame with OUTPUT_COLUMNS; station columns are empty for unmatched
+      sites, and years_available is a nullable integer (Int64)
+    """
+    if stations is None:
+        stations = _STATIONS
+
+    station_ids = np.full(len(sites), -1, dtype=np.int64)
+    distances = np.full(len(sites), np.nan)
+    in_state = np.zeros(len(sites), dtype=bool)
+
+    if len(sites) and not stations['search_data'].empty:
+        positions, distances, in_state = find_nearest_locations_in_state(
+            sites['lat'].to_numpy(dtype=float), sites['lon'].to_numpy(dtype=float),
+            sites['state'].astype(str).to_numpy(), stations['search_data'], stations['partition'],
+            max_distance_km)
+        matched = positions >= 0
+        station_ids[matched] = stations['row_station'][positions[matched]]
+
+    # Station rows for matched sites; unmatched sites get empty (NaN) rows
+    matched = np.flatnonzero(station_ids >= 0)
+    matched_stations = stations['station_table'].iloc[station_ids[matched]].set_axis(matched).reindex(
+        np.arange(len(sites)))
+
+    result = pd.DataFrame({
+        'site_id': sites['site_id'].to_numpy(),
+        'state': sites['state'].to_numpy(),
+        'lat': sites['lat'].to_numpy(),
+        'lon': sites['lon'].to_numpy(),
+        'station_state': matched_stations['State'].to_numpy(),
+        'station_county': matched_stations['County'].to_numpy(),
+        'station_latitude': matched_stations['Latitude'].to_numpy(),
+        'station_longitude': matched_stations['Longitude'].to_numpy(),
+        'distance_km': distances,
+        'in_state': in_state,
+        **{column: matched_stations[column].to_numpy() for column in STATISTIC_COLUMNS}
+    })
+    # The reindex above turns the counts into floats; keep them integers
+    result['years_available'] = result['years_available'].astype('Int64')
+    return result
+
+def parquet_output_schema(result):
+    """
+    Arrow schema of OUTPUT_COLUMNS. Types are fixed so that a chunk without
+    any matched site (all-empty station columns) is written with the same
+    schema as the others; site_id keeps the type it has in the first chunk.
+    """
+    import pyarrow as pa
+
+    site_id_type = pa.Array.from_pandas(result['site_id']).type
+    if pa.types.is_null(site_id_type):
+        site_id_type = pa.string()
+    types = {
+        'site_id': site_id_type,
+        'state': pa.string(),
+        'station_state': pa.string(),
+        'station_county': pa.string(),
+        'in_state': pa.bool_(),
+        'years_available': pa.int64()
+    }
+    return pa.schema([(column, types.get(column, pa.float64())) for column in OUTPUT_COLUMNS])
+
+def _analyze_chunk(sites, stations, max_distance_km, as_csv):
+    """
+    Worker task: analyze one chunk. When writing CSV the rows are formatted in
+    the worker, which keeps the parent process down to file appends.
+    """
+    result = analyze_sites(sites, stations, max_distance_km)
+    return len(result), result.to_csv(header=False, index=False) if as_csv else result
+
+def _standardize_site_columns(chunk):
+    """Map input columns case-insensitively onto site_id, state, lat, lon"""
+    column_mapping = {}
+    for col in chunk.columns:
+        col_lower = str(col).lower().strip()
+        if col_lower in ['site_id', 'site', 'id']:
+            column_mapping[col] = 'site_id'
+        elif col_lower in ['state']:
+            column_mapping[col] = 'state'
+        elif col_lower in ['lat', 'latitude']:
+            column_mapping[col] = 'lat'
+        elif col_lower in ['lon', 'lng', 'longitude']:
+            column_mapping[col] = 'lon'
+    chunk = chunk.rename(columns=column_mapping)
+
+    missing_columns = [col for col in ['site_id', 'state', 'lat', 'lon'] if col not in chunk.columns]
+    if missing_columns:
+        raise ValueError(f"Input is missing columns: {missing_columns}")
+
+    chunk['lat'] = pd.to_numeric(chunk['lat'], errors='coerce')
+    chunk['lon'] = pd.to_numeric(chunk['lon'], errors='coerce')
+    return chunk[['site_id', 'state', 'lat', 'lon']]
+
+def read_sites(input_path, chunk_size):
+    """Yield the input file (CSV or Parquet) in chunks of sites"""
+    if input_path.lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(input_path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield _standardize_site_columns(batch.to_pandas())
+    else:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            yield _standardize_site_columns(chunk)
+
+def run_batch(input_path, output_path, workers=None, chunk_size=50000, max_distance_km=50):
+    """
+    Analyze every site in input_path and stream the results to output_path.
+    Chunks are matched in a process pool; at most two chunks per worker are in
+    flight, and results are written in input order as they complete. Workers
+    map the station store instead of receiving a copy of the station data.
+
+    Returns:
+    - Number of sites written
+    """
+    # Written here if the workbooks changed, so workers only have to map it
+    store_path = os.path.join(opened_data_loader.CACHE_DIR, STORE_FILE)
+    store = load_station_store(path=store_path)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    is_parquet = output_path.lower().endswith(('.parquet', '.pq'))
+    parquet_writer = None
+    parquet_schema = None
+    rows_written = 0
+
+    if not is_parquet:
+        # CSV rows are formatted by the workers and appended here
+        output_file = open(output_path, 'w', newline='', encoding='utf-8')
+        output_file.write(','.join(OUTPUT_COLUMNS) + '\n')
+
+    def write(chunk_result):
+        nonlocal parquet_writer, parquet_schema, rows_written
+        n_rows, result = chunk_result
+        if is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if parquet_schema is None:
+                parquet_schema = parquet_output_schema(result)
+            table = pa.Table.from_pandas(result, schema=parquet_schema, preserve_index=False)
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(output_path, parquet_schema)
+            parquet_writer.write_table(table)
+        else:
+            output_file.write(result)
+        rows_written += n_rows
+
+    try:
+        if workers <= 1:
+            stations = load_batch_stations(store)
+            for chunk in read_sites(input_path, chunk_size):
+                write(_analyze_chunk(chunk, stations, max_distance_km, not is_parquet))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(store_path,)) as executor:
+                pending = deque()
+                for chunk in read_sites(input_path, chunk_size):
+                    pending.append(executor.submit(_analyze_chunk, chunk, None, max_distance_km, not is_parquet))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+        if not is_parquet:
+            output_file.close()
+
+    return rows_written
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Match sites to their nearest freeze-thaw monitoring station and "
+                    "report 5-year and all-years statistics.")
+    parser.add_argument('input', help="CSV or Parquet file with site_id, state, lat, lon columns")
+    parser.add_argument('output', help="CSV or Parquet file to write the results to")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help="Sites per batch (default: 50000)")
+    parser.add_argument('--max-distance-km', type=float, default=50,
+                        help="Maximum distance to the matched station (default: 50 km)")
+    args = parser.parse_args()
+
+    rows_written = run_batch(args.input, args.output, args.workers, args.chunk_size, args.max_distance_km)
+    print(f"Wrote {rows_written} sites to '{args.output}'")
+
+if __name__ == "__main__":
+    main()
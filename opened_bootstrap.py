@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 18:47:12 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Bootstrap confidence intervals for the all-years and recent-years averages
+# and COVs. One seeded array of uniform draws defines every resample; for a
+# station with n seasons, draw j of resample b picks season floor(u[b, j] * n)
+# of its season vector. Applying that to all stations of a chunk at once
+# keeps the whole computation in array operations, and the same seed always
+# gives the same intervals.
+import numpy as np
+import pandas as pd
+from opened_instrumentation import timed
+
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+
+# Upper bound on the number of resampled values held in memory at once
+BOOTSTRAP_BLOCK = 4_000_000
+
+def _left_align(values, selected):
+    """Selected values of each row moved to the front (season order kept), NaN after"""
+    order = np.argsort(~selected, axis=1, kind='stable')
+    return np.take_along_axis(np.where(selected, values, np.nan), order, axis=1), selected.sum(axis=1)
+
+def _resampled_mean_and_cov(values, counts, uniforms):
+    """
+    Mean and COV (%) of every resample of every row
+
+    Parameters:
+    - values: (rows, width) left-aligned season values
+    - counts: Number of values per row
+    - uniforms: (resamples, width) uniform draws in [0, 1)
+
+    Returns:
+    - Two (rows, resamples) arrays, with the conventions of station_statistics
+    """
+    draws = np.floor(uniforms[None, :, :] * counts[:, None, None]).astype(np.int64)
+    samples = values[np.arange(len(values))[:, None, None], draws]
+    valid = np.arange(uniforms.shape[1]) < counts[:, None, None]
+
+    safe_counts = np.maximum(counts, 1)[:, None]
+    average = np.where(valid, samples, 0.0).sum(axis=2) / safe_counts
+    std = np.sqrt(np.where(valid, (samples - average[:, :, None]) ** 2, 0.0).sum(axis=2) / safe_counts)
+    cov = np.where((counts[:, None] > 1) & (average > 0), std / np.where(average > 0, average, 1) * 100, 0.0)
+    return average, cov
+
+@timed('bootstrap')
+def bootstrap_confidence_intervals(panel, rows=None, n_resamples=BOOTSTRAP_RESAMPLES,
+                                   confidence=BOOTSTRAP_CONFIDENCE, recent_years=5, seed=BOOTSTRAP_SEED,
+                                   chunk_size=None):
+    """
+    Percentile bootstrap intervals of the average and COV of every station,
+    over all its seasons and over its most recent `recent_years` seasons
+
+    Parameters:
+    - panel: Station x season panel
+    - rows: Station IDs to compute (default: all)
+    - n_resamples: Number of bootstrap resamples
+    - confidence: Coverage of the intervals (0.95 = 2.5th to 97.5th percentile)
+    - seed: Seed of the resample draws
+    - chunk_size: Stations per chunk (default: as many as fit BOOTSTRAP_BLOCK
+      resampled values)
+
+    Returns:
+    - DataFrame indexed by station ID with '{m}_{window}_{statistic}_low' and
+      '_high' columns for m in total / damaging, window in all / 5yr and
+      statistic in avg / cov; NaN for stations without data
+    """
+    if rows is None:
+        rows = np.arange(len(panel['State']))
+    rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+
+    n_seasons = panel['total'].shape[1]
+    uniforms = np.random.default_rng(seed).random((n_resamples, max(n_seasons, 1)))
+    percentiles = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    if chunk_size is None:
+        chunk_size = max(1, BOOTSTRAP_BLOCK // max(1, n_resamples * n_seasons))
+
+    columns = {f'{measure}_{window}_{statistic}_{bound}': np.full(len(rows), np.nan)
+               for measure in ['total', 'damaging'] for window in ['all', '5yr']
+               for statistic in ['avg', 'cov'] for bound in ['low', 'high']}
+
+    for chunk_start in range(0, len(rows), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        chunk_rows = rows[chunk]
+        present = ~np.isnan(panel['total'][chunk_rows])
+        rank_from_latest = np.cumsum(present[:, ::-1], axis=1)[:, ::-1]
+        recent = present & (rank_from_latest <= recent_years)
+
+        for window, selected, width in [('all', present, n_seasons), ('5yr', recent, recent_years)]:
+            for measure in ['total', 'damaging']:
+                values, counts = _left_align(panel[measure][chunk_rows], selected)
+                average, cov = _resampled_mean_and_cov(values[:, :width], counts, uniforms[:, :width])
+                for statistic, resampled in [('avg', average), ('cov', cov)]:
+                    low, high = np.percentile(resampled, percentiles, axis=1)
+                    columns[f'{measure}_{window}_{statistic}_low'][chunk] = np.where(counts > 0, low, np.nan)
+                    columns[f'{measure}_{window}_{statistic}_high'][chunk] = np.where(counts > 0, high, np.nan)
+
+    return pd.DataFrame(columns, index=pd.Index(rows, name='station_id'))
\ No newline at end of file
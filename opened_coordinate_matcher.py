@@ -8,6 +8,9 @@ Created on Wed Aug  6 21:27:27 2025
 ##################### Stastical Analysis
 import numpy as np
 import pandas as pd
+from opened_spatial_index import (load_or_build_station_index, query_k_nearest_batch,
+                                  load_or_build_nearest_grid, query_nearest_grid, state_codes)
+from opened_instrumentation import timed, count
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -30,7 +33,215 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     
     return c * r
 
-def find_nearest_location(target_lat, target_lon, data, max_distance_km=50):
+# Upper bound on the number of target x station distances held in memory at once
+MAX_DISTANCE_BLOCK = 4_000_000
+
+# Datasets with at least this many stations are searched through the spatial index
+INDEX_MIN_STATIONS = 5000
+
+# Extra neighbours fetched from the index, so stations at the same haversine
+# distance but a chord distance one rounding apart are ranked like the scan
+INDEX_TIE_CANDIDATES = 4
+
+@timed('nearest_station')
+def find_nearest_locations(target_lats, target_lons, data, max_distance_km=50,
+                           block_size=MAX_DISTANCE_BLOCK, use_index=None, use_grid=False):
+    """
+    Find the nearest location in the dataset for many target coordinates at once
+    
+    Parameters:
+    - target_lats: Array of target latitudes
+    - target_lons: Array of target longitudes
+    - data: DataFrame with location data
+    - max_distance_km: Maximum distance to consider (default 50 km)
+    - block_size: Maximum number of distances computed per NumPy pass
+    - use_index: Search through the spatial index instead of a full scan
+      (default: only for datasets of INDEX_MIN_STATIONS or more)
+    - use_grid: Answer queries from the precomputed nearest-station grid where
+      it is conclusive; the rest fall back to the exact search
+    
+    Returns:
+    - Tuple of (positions, distances_km) arrays. positions index rows of data
+      with iloc and are -1 (distance NaN) where no location is within range
+    """
+    target_lats = np.atleast_1d(np.asarray(target_lats, dtype=float))
+    target_lons = np.atleast_1d(np.asarray(target_lons, dtype=float))
+    
+    positions = np.full(len(target_lats), -1, dtype=np.int64)
+    distances = np.full(len(target_lats), np.nan)
+    
+    if data.empty or len(target_lats) == 0:
+        return positions, distances
+    
+    count('nearest_station_targets', len(target_lats))
+    
+    station_lats = data['Latitude'].to_numpy(dtype=float)
+    station_lons = data['Longitude'].to_numpy(dtype=float)
+    n_stations = len(station_lats)
+    
+    if use_grid:
+        grid = load_or_build_nearest_grid(station_lats, station_lons)
+        candidates, resolved = query_nearest_grid(grid, target_lats, target_lons, max_distance_km)
+        count('nearest_grid_hits', int(resolved.sum()))
+        
+        # The grid gives the exact nearest station; its distance decides the cutoff
+        found = np.flatnonzero(resolved & (candidates >= 0))
+        found_distances = haversine_distance(target_lats[found], target_lons[found],
+                                             station_lats[candidates[found]], station_lons[candidates[found]])
+        within_range = found_distances <= max_distance_km
+        positions[found[within_range]] = candidates[found[within_range]]
+        distances[found[within_range]] = found_distances[within_range]
+        
+        unresolved = np.flatnonzero(~resolved)
+        if len(unresolved):
+            positions[unresolved], distances[unresolved] = find_nearest_locations(
+                target_lats[unresolved], target_lons[unresolved], data, max_distance_km, block_size, use_index)
+        return positions, distances
+    
+    if use_index is None:
+        use_index = n_stations >= INDEX_MIN_STATIONS
+    if use_index:
+        positions, distances = _find_nearest_indexed(target_lats, target_lons, station_lats, station_lons,
+                                                     max_distance_km)
+        return positions[:, 0], distances[:, 0]
+    
+    # Split targets (and stations, for very large datasets) into blocks
+    station_step = min(n_stations, block_size)
+    target_step = max(1, block_size // station_step)
+    
+    for target_start in range(0, len(target_lats), target_step):
+        target_slice = slice(target_start, target_start + target_step)
+        block_lats = target_lats[target_slice, None]
+        block_lons = target_lons[target_slice, None]
+        
+        best_positions = np.zeros(len(block_lats), dtype=np.int64)
+        best_distances = np.full(len(block_lats), np.inf)
+        
+        for station_start in range(0, n_stations, station_step):
+            station_slice = slice(station_start, station_start + station_step)
+            block_distances = haversine_distance(
+                block_lats, block_lons,
+                station_lats[None, station_slice], station_lons[None, station_slice]
+            )
+            
+            block_best = np.argmin(block_distances, axis=1)
+            block_min = block_distances[np.arange(len(block_best)), block_best]
+            
+            # Strict comparison keeps the first station on ties, like np.argmin
+            improved = (block_min < best_distances) | (np.isnan(block_min) & ~np.isnan(best_distances))
+            best_positions[improved] = block_best[improved] + station_start
+            best_distances[improved] = block_min[improved]
+        
+        # Check if within acceptable range
+        within_range = best_distances <= max_distance_km
+        positions[target_slice] = np.where(within_range, best_positions, -1)
+        distances[target_slice] = np.where(within_range, best_distances, np.nan)
+    
+    return positions, distances
+
+def _find_nearest_indexed(target_lats, target_lons, station_lats, station_lons, max_distance_km, k=1,
+                          index_role='nationwide'):
+    """
+    k nearest stations per target through the persisted spatial index, all
+    targets in one batched query; (targets, k) arrays like find_k_nearest_locations
+    """
+    index = load_or_build_station_index(station_lats, station_lons, index_role)
+    
+    # Search slightly past the cutoff; the haversine distance below decides
+    search_km = max_distance_km * (1 + 1e-9) + 1e-9
+    positions, _ = query_k_nearest_batch(index, target_lats, target_lons, k + INDEX_TIE_CANDIDATES, search_km)
+    
+    distances = np.full(positions.shape, np.inf)
+    found = positions >= 0
+    targets = np.nonzero(found)[0]
+    distances[found] = haversine_distance(target_lats[targets], target_lons[targets],
+                                          station_lats[positions[found]], station_lons[positions[found]])
+    
+    # Rank by haversine distance, then position (the scan's tie order), and keep k
+    ranked = np.lexsort((np.where(found, positions, len(station_lats)), distances), axis=1)[:, :k]
+    positions = np.take_along_axis(positions, ranked, axis=1)
+    distances = np.take_along_axis(distances, ranked, axis=1)
+    
+    within_range = distances <= max_distance_km
+    positions[~within_range] = -1
+    distances[~within_range] = np.nan
+    return positions, distances
+
+@timed('k_nearest_stations')
+def find_k_nearest_locations(target_lats, target_lons, data, k=5, max_distance_km=50,
+                             block_size=MAX_DISTANCE_BLOCK, use_index=None, index_role='nationwide'):
+    """
+    Find the k nearest locations in the dataset for many target coordinates at once
+    
+    Parameters:
+    - target_lats: Array of target latitudes
+    - target_lons: Array of target longitudes
+    - data: DataFrame with location data
+    - k: Number of locations per target
+    - max_distance_km: Maximum distance to consider (default 50 km)
+    - block_size: Maximum number of distances computed per NumPy pass
+    - use_index: Search through the spatial index instead of a full scan
+      (default: only for datasets of INDEX_MIN_STATIONS or more)
+    - index_role: Cache file of that index (load_or_build_station_index), so
+      station sets used side by side do not replace each other's index
+    
+    Returns:
+    - Tuple of (positions, distances_km) arrays of shape (targets, k), nearest
+      first. positions index rows of data with iloc and are -1 (distance NaN)
+      where fewer than k locations are within range
+    """
+    target_lats = np.atleast_1d(np.asarray(target_lats, dtype=float))
+    target_lons = np.atleast_1d(np.asarray(target_lons, dtype=float))
+    
+    positions = np.full((len(target_lats), k), -1, dtype=np.int64)
+    distances = np.full((len(target_lats), k), np.nan)
+    
+    if data.empty or len(target_lats) == 0 or k < 1:
+        return positions, distances
+    
+    count('k_nearest_targets', len(target_lats))
+    
+    station_lats = data['Latitude'].to_numpy(dtype=float)
+    station_lons = data['Longitude'].to_numpy(dtype=float)
+    
+    if use_index is None:
+        use_index = len(station_lats) >= INDEX_MIN_STATIONS
+    if use_index:
+        return _find_nearest_indexed(target_lats, target_lons, station_lats, station_lons, max_distance_km, k,
+                                     index_role)
+    
+    n_found = min(k, len(station_lats))
+    target_step = max(1, block_size // len(station_lats))
+    
+    for target_start in range(0, len(target_lats), target_step):
+        target_slice = slice(target_start, target_start + target_step)
+        block_distances = haversine_distance(
+            target_lats[target_slice, None], target_lons[target_slice, None],
+            station_lats[None, :], station_lons[None, :]
+        )
+        block_distances = np.where(np.isnan(block_distances), np.inf, block_distances)
+        
+        # The k smallest per row; of stations tied with the k-th, the first ones in data
+        kth = np.partition(block_distances, n_found - 1, axis=1)[:, n_found - 1, None]
+        closer = block_distances < kth
+        tied = block_distances == kth
+        n_tied = n_found - closer.sum(axis=1, keepdims=True)
+        selected = closer | (tied & (np.cumsum(tied, axis=1) <= n_tied))
+        nearest = np.nonzero(selected)[1].reshape(-1, n_found)
+        
+        # Sort by distance; stable, so ties keep data order like np.argmin
+        nearest_distances = np.take_along_axis(block_distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1, kind='stable')
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+        
+        within_range = nearest_distances <= max_distance_km
+        positions[target_slice, :n_found] = np.where(within_range, nearest, -1)
+        distances[target_slice, :n_found] = np.where(within_range, nearest_distances, np.nan)
+    
+    return positions, distances
+
+def find_nearest_location(target_lat, target_lon, data, max_distance_km=50, use_grid=False):
     """
     Find the nearest location in the dataset to the target coordinates
     
@@ -39,6 +250,7 @@ def find_nearest_location(target_lat, target_lon, data, max_distance_km=50):
     - target_lon: Target longitude  
     - data: DataFrame with location data
     - max_distance_km: Maximum distance to consider (default 50 km)
+    - use_grid: Look the station up in the precomputed nearest-station grid
     
     Returns:
     - Tuple of (nearest_location_row, distance_km) or (None, None) if no location found
@@ -47,26 +259,94 @@ def find_nearest_location(target_lat, target_lon, data, max_distance_km=50):
     if data.empty:
         return None, None
     
-    # Calculate distances to all locations
-    distances = []
+    positions, distances = find_nearest_locations(target_lat, target_lon, data, max_distance_km,
+                                                  use_grid=use_grid)
     
-    for idx, row in data.iterrows():
-        distance = haversine_distance(
-            target_lat, target_lon,
-            row['Latitude'], row['Longitude']
-        )
-        distances.append(distance)
+    if positions[0] < 0:
+        return None, None
+    
+    nearest_location = data.iloc[positions[0]]
+    return nearest_location, distances[0]
+
+@timed('nearest_station_in_state')
+def find_nearest_locations_in_state(target_lats, target_lons, target_states, data, partition, max_distance_km=50,
+                                    cross_border=True, block_size=MAX_DISTANCE_BLOCK):
+    """
+    Find the nearest location for many targets, each preferring its own
+    selected state, with one batched search of the nationwide grid
     
-    # Convert to numpy array for easier manipulation
-    distances = np.array(distances)
+    A target whose nationwide nearest station is in its state keeps it.
+    The other targets are grouped by state and matched against that state's
+    stations (one contiguous range of the partition) in one pass per state;
+    when a state has no station in range and cross_border is set, the
+    nationwide nearest station (in a neighbouring state) is used instead.
+    
+    Parameters:
+    - target_lats, target_lons: Target coordinates
+    - target_states: Selected state per target (matched exactly, ignoring case)
+    - data: DataFrame with location data for the whole country
+    - partition: build_state_partition of data's State, Latitude and Longitude
+    - max_distance_km: Maximum distance to consider (default 50 km)
+    - cross_border: Fall back to stations of other states
+    - block_size: Maximum number of distances computed per NumPy pass
+    
+    Returns:
+    - Tuple of (positions, distances_km, in_state) arrays. positions index
+      rows of data with iloc and are -1 (distance NaN) where no location is found
+    """
+    target_lats = np.atleast_1d(np.asarray(target_lats, dtype=float))
+    target_lons = np.atleast_1d(np.asarray(target_lons, dtype=float))
+    target_codes = state_codes(partition, np.atleast_1d(target_states))
+    
+    positions, distances = find_nearest_locations(target_lats, target_lons, data, max_distance_km,
+                                                  block_size, use_grid=True)
+    in_state = (positions >= 0) & (target_codes >= 0)
+    in_state[in_state] = partition['codes'][positions[in_state]] == target_codes[in_state]
+    
+    national_positions, national_distances = positions.copy(), distances.copy()
+    pending = ~in_state
+    positions[pending] = -1
+    distances[pending] = np.nan
+    
+    for code in np.unique(target_codes[pending & (target_codes >= 0)]):
+        targets = np.flatnonzero(pending & (target_codes == code))
+        start, end = int(partition['starts'][code]), int(partition['ends'][code])
+        target_step = max(1, block_size // (end - start))
+        for target_start in range(0, len(targets), target_step):
+            block = targets[target_start:target_start + target_step]
+            state_distances = haversine_distance(target_lats[block, None], target_lons[block, None],
+                                                 partition['latitudes'][None, start:end],
+                                                 partition['longitudes'][None, start:end])
+            best = np.argmin(state_distances, axis=1)
+            best_distances = state_distances[np.arange(len(block)), best]
+            within_range = best_distances <= max_distance_km
+            positions[block[within_range]] = partition['order'][start + best[within_range]]
+            distances[block[within_range]] = best_distances[within_range]
+            in_state[block[within_range]] = True
+    
+    if cross_border:
+        fallback = ~in_state & (national_positions >= 0)
+        positions[fallback] = national_positions[fallback]
+        distances[fallback] = national_distances[fallback]
+    
+    return positions, distances, in_state
+
+def find_nearest_location_in_state(target_lat, target_lon, data, partition, state, max_distance_km=50,
+                                   cross_border=True):
+    """
+    Find the nearest location to the target coordinates, preferring the
+    selected state (see find_nearest_locations_in_state)
+    
+    Returns:
+    - Tuple of (nearest_location_row, distance_km, in_state) or
+      (None, None, False) if no location found
+    """
+    if data.empty:
+        return None, None, False
     
-    # Find the minimum distance
-    min_distance_idx = np.argmin(distances)
-    min_distance = distances[min_distance_idx]
+    positions, distances, in_state = find_nearest_locations_in_state(
+        target_lat, target_lon, [state], data, partition, max_distance_km, cross_border)
     
-    # Check if within acceptable range
-    if min_distance <= max_distance_km:
-        nearest_location = data.iloc[min_distance_idx]
-        return nearest_location, min_distance
-    else:
-        return None, None
\ No newline at end of file
+    if positions[0] < 0:
+        return None, None, False
+    return data.iloc[positions[0]], distances[0], bool(in_state[0])
\ No newline at end of file
@@ -6,14 +6,97 @@ Created on Wed Aug  6 21:16:47 2025
 """
 
 ################## Stastical Analysis
+import os
+import re
+import glob
+import json
+import hashlib
 import pandas as pd
 import numpy as np
+from opened_instrumentation import timed, count
+
+# Directory for the binary columnar copies of the season workbooks
+CACHE_DIR = os.environ.get('FREEZE_THAW_CACHE_DIR', '.freeze_thaw_cache')
+CACHE_FORMAT_VERSION = 3
+
+REQUIRED_COLUMNS = ['State', 'County', 'Latitude', 'Longitude',
+                    'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']
+NUMERIC_COLUMNS = ['Latitude', 'Longitude', 'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']
+CYCLE_COLUMNS = ['Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']
+
+# Checks of clean_season_frame, in the order a rejected row's reason is picked
+REJECT_REASONS = ['missing_latitude', 'missing_longitude', 'missing_total_cycles',
+                  'missing_damaging_cycles', 'latitude_out_of_range', 'longitude_out_of_range']
+
+# Trailing digits of station county names (e.g., Jefferson5)
+COUNTY_SUFFIX_PATTERN = re.compile(r'\d+$')
+
+def clean_county_name(county):
+    """Remove numbers from county names (e.g., Jefferson5 -> Jefferson)"""
+    if pd.isna(county):
+        return county
+    # Remove trailing numbers
+    cleaned = COUNTY_SUFFIX_PATTERN.sub('', str(county)).strip()
+    return cleaned if cleaned else str(county)
+
+def clean_county_names(counties):
+    """Vectorized clean_county_name for a Series of county names"""
+    text = counties.astype(str)
+    cleaned = text.str.replace(COUNTY_SUFFIX_PATTERN, '', regex=True).str.strip()
+    cleaned = cleaned.where(cleaned != '', text)
+    return cleaned.where(counties.notna(), counties)
+
+def season_county_clean(data):
+    """Cleaned county names of a season: its County_Clean column, or computed from County"""
+    if 'County_Clean' in data.columns:
+        return data['County_Clean']
+    return clean_county_names(data['County'])
+
+def compact_season_frame(data, copy=True):
+    """
+    Compact dtypes for a cleaned season: a County_Clean column
+    (clean_county_name of County, computed here once), categorical State,
+    County, County_Clean and other text columns, and the smallest integer
+    type holding the cycle counts (float32 when they are not whole numbers).
+    Coordinates stay float64 so they keep the workbook's six decimals.
+    With copy=False the frame is converted in place.
+    """
+    if copy:
+        data = data.copy()
+    data['County_Clean'] = clean_county_names(data['County'])
+    for column in data.columns:
+        if not pd.api.types.is_numeric_dtype(data[column].dtype):
+            data[column] = data[column].astype('category')
+    
+    for column in CYCLE_COLUMNS:
+        values = data[column].to_numpy(dtype=float)
+        if np.array_equal(values, np.round(values)):
+            data[column] = pd.to_numeric(values.astype(np.int64), downcast='integer')
+        else:
+            data[column] = values.astype(np.float32)
+    
+    return data
+
+def share_categories(frames):
+    """
+    Give the categorical columns of several season DataFrames the same
+    categories (in place), so every season refers to one copy of each
+    distinct name and concatenated seasons stay categorical
+    """
+    categorical_columns = {column for frame in frames for column in frame.columns
+                           if isinstance(frame[column].dtype, pd.CategoricalDtype)}
+    for column in sorted(categorical_columns):
+        columns = [frame[column] for frame in frames
+                   if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype)]
+        categories = columns[0].cat.categories
+        for values in columns[1:]:
+            categories = categories.union(values.cat.categories)
+        for frame in frames:
+            if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].cat.set_categories(categories)
 
 def get_available_seasons():
     """Get list of available seasons from Excel files"""
-    import glob
-    import re
-    
     # Look for files with spaces in names (your actual file pattern)
     excel_files = glob.glob('Predicted Freeze-Thaw Cycles (*.xlsx')
     seasons = []
@@ -26,36 +109,63 @@ def get_available_seasons():
     
     return sorted(seasons)
 
-def load_freeze_thaw_data_by_season(season=None):
-    """
-    Load freeze-thaw cycle data for a specific season.
-    If no season specified, loads the most recent available season.
+def _empty_season_frame():
+    """Empty DataFrame with the standard season columns"""
+    return pd.DataFrame({
+        'State': [], 'County': [], 'Latitude': [], 'Longitude': [],
+        'Total_Freeze_Thaw_Cycles': [], 'Damaging_Freeze_Thaw_Cycles': [], 'County_Clean': []
+    })
+
+def _empty_reject_report():
+    """Empty reject report (row, reason)"""
+    return pd.DataFrame({'row': np.array([], dtype=np.int64), 'reason': np.array([], dtype=str)})
+
+def clean_season_frame(raw_data):
     """
-    import glob
-    import re
+    Validate and clean a season's raw rows (standard column names) in one pass.
     
-    if season is None:
-        # Get the most recent season
-        available_seasons = get_available_seasons()
-        if not available_seasons:
-            return pd.DataFrame({
-                'State': [], 'County': [], 'Latitude': [], 'Longitude': [],
-                'Total_Freeze_Thaw_Cycles': [], 'Damaging_Freeze_Thaw_Cycles': []
-            })
-        season = available_seasons[-1]  # Most recent
+    Each numeric column is converted once, every check goes into one
+    validity mask, and the valid rows are gathered in a single copy before
+    compact_season_frame; damaging cycles are capped at total cycles.
     
-    # Find the file for the specified season (with parentheses)
-    file_pattern = f"Predicted Freeze-Thaw Cycles ({season}).xlsx"
-    matching_files = glob.glob(file_pattern)
+    Returns:
+    - Tuple of (cleaned DataFrame, rejects): rejects has one row per dropped
+      workbook row with 'row' (its 0-based data row, the DataFrame index) and
+      'reason', the first of REJECT_REASONS it fails
+    """
+    numeric = {column: pd.to_numeric(raw_data[column], errors='coerce').to_numpy(dtype=float)
+               for column in NUMERIC_COLUMNS}
+    
+    failed = np.stack([
+        np.isnan(numeric['Latitude']),
+        np.isnan(numeric['Longitude']),
+        np.isnan(numeric['Total_Freeze_Thaw_Cycles']),
+        np.isnan(numeric['Damaging_Freeze_Thaw_Cycles']),
+        np.abs(numeric['Latitude']) > 90,
+        np.abs(numeric['Longitude']) > 180
+    ])
+    invalid = failed.any(axis=0)
+    valid = ~invalid
     
-    if not matching_files:
-        return pd.DataFrame({
-            'State': [], 'County': [], 'Latitude': [], 'Longitude': [],
-            'Total_Freeze_Thaw_Cycles': [], 'Damaging_Freeze_Thaw_Cycles': []
-        })
+    rejects = pd.DataFrame({
+        'row': raw_data.index.to_numpy(dtype=np.int64)[invalid],
+        'reason': np.array(REJECT_REASONS)[failed[:, invalid].argmax(axis=0)]
+    })
     
-    file_path = matching_files[0]
+    numeric['Damaging_Freeze_Thaw_Cycles'] = np.minimum(numeric['Damaging_Freeze_Thaw_Cycles'],
+                                                        numeric['Total_Freeze_Thaw_Cycles'])
+    cleaned = pd.DataFrame({
+        column: numeric[column][valid] if column in numeric else raw_data[column].to_numpy()[valid]
+        for column in raw_data.columns
+    }, index=raw_data.index[valid])
     
+    return compact_season_frame(cleaned, copy=False), rejects
+
+def _parse_season_file(file_path):
+    """
+    Parse and clean one season workbook with openpyxl (slow path).
+    Returns (data, rejects) as clean_season_frame, or None if it cannot be read.
+    """
     try:
         # Load the Excel file
         temp_data = pd.read_excel(file_path)
@@ -81,44 +191,329 @@ def load_freeze_thaw_data_by_season(season=None):
         temp_data = temp_data.rename(columns=column_mapping)
         
         # Check if we have required columns
-        required_columns = ['State', 'County', 'Latitude', 'Longitude', 
-                          'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles']
-        
-        missing_columns = [col for col in required_columns if col not in temp_data.columns]
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in temp_data.columns]
         if missing_columns:
             print(f"Warning: File '{file_path}' is missing columns: {missing_columns}")
-            return pd.DataFrame({
-                'State': [], 'County': [], 'Latitude': [], 'Longitude': [],
-                'Total_Freeze_Thaw_Cycles': [], 'Damaging_Freeze_Thaw_Cycles': []
-            })
+            return None
         
         # Clean and validate data
-        temp_data['Latitude'] = pd.to_numeric(temp_data['Latitude'], errors='coerce')
-        temp_data['Longitude'] = pd.to_numeric(temp_data['Longitude'], errors='coerce')
-        temp_data['Total_Freeze_Thaw_Cycles'] = pd.to_numeric(temp_data['Total_Freeze_Thaw_Cycles'], errors='coerce')
-        temp_data['Damaging_Freeze_Thaw_Cycles'] = pd.to_numeric(temp_data['Damaging_Freeze_Thaw_Cycles'], errors='coerce')
+        temp_data, rejects = clean_season_frame(temp_data)
+        if len(rejects):
+            counts = rejects['reason'].value_counts()
+            print(f"Warning: Dropped {len(rejects)} rows from '{file_path}': "
+                  + ", ".join(f"{reason} ({n})" for reason, n in counts.items()))
+        
+        return temp_data, rejects
+        
+    except Exception as e:
+        print(f"Error loading file '{file_path}': {str(e)}")
+        return None
+
+def get_season_file(season):
+    """Path of the workbook for a season, or None if it is not present"""
+    # Find the file for the specified season (with parentheses)
+    file_pattern = f"Predicted Freeze-Thaw Cycles ({season}).xlsx"
+    matching_files = glob.glob(file_pattern)
+    
+    return matching_files[0] if matching_files else None
+
+def season_file_signature(file_path):
+    """
+    Cache key for a season workbook: absolute path, modification time and size.
+    Any change to the file on disk produces a different signature.
+    """
+    file_stat = os.stat(file_path)
+    return {
+        'path': os.path.abspath(file_path),
+        'mtime_ns': file_stat.st_mtime_ns,
+        'size': file_stat.st_size,
+        'version': CACHE_FORMAT_VERSION
+    }
+
+def dataset_version(seasons=None):
+    """
+    Short hash of the season workbooks (path, mtime and size of each).
+    Changes whenever a workbook is added, removed or modified.
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+
+    signature = []
+    for season in sorted(seasons):
+        file_path = get_season_file(season)
+        signature.append([season, season_file_signature(file_path) if file_path else None])
+    return hashlib.blake2b(json.dumps(signature).encode('utf-8'), digest_size=8).hexdigest()
+
+def _season_cache_dir(file_path):
+    """Directory holding the columnar copy of one season workbook"""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(CACHE_DIR, stem)
+
+def _read_season_cache(file_path, signature):
+    """
+    Memory-map the cached columns of a season workbook.
+    Returns None when there is no cache entry or it is stale.
+    """
+    cache_dir = _season_cache_dir(file_path)
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('signature') != signature:
+            return None
         
-        # Remove rows with missing critical data
-        temp_data = temp_data.dropna(subset=['Latitude', 'Longitude', 'Total_Freeze_Thaw_Cycles', 'Damaging_Freeze_Thaw_Cycles'])
+        columns = {}
+        for position, column in enumerate(meta['columns']):
+            # Copy-on-write mapping: pages are shared until a caller modifies them
+            values = np.asarray(np.load(os.path.join(cache_dir, f'col_{position}.npy'), mmap_mode='c'))
+            if column['kind'] == 'category':
+                categories = np.load(os.path.join(cache_dir, f'categories_{position}.npy'))
+                values = pd.Categorical.from_codes(values, categories=categories)
+            elif column['kind'] == 'string':
+                values = pd.Series(values, dtype=object)
+                if column['missing']:
+                    values.iloc[column['missing']] = np.nan
+                values = values.values
+            columns[column['name']] = values
         
-        # Validate coordinate ranges
-        temp_data = temp_data[(temp_data['Latitude'] >= -90) & (temp_data['Latitude'] <= 90)]
-        temp_data = temp_data[(temp_data['Longitude'] >= -180) & (temp_data['Longitude'] <= 180)]
+        index = np.load(os.path.join(cache_dir, 'index.npy'))
+        return pd.DataFrame(columns, index=pd.Index(index), copy=False)
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _read_season_rejects(file_path, signature):
+    """Reject report stored with a season's cache entry, or None when it is missing or stale"""
+    try:
+        with open(os.path.join(_season_cache_dir(file_path), 'meta.json'), 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('signature') != signature:
+            return None
+        return pd.DataFrame({'row': np.array(meta['rejects']['row'], dtype=np.int64),
+                             'reason': np.array(meta['rejects']['reason'], dtype=str)})
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _write_season_cache(file_path, signature, data, rejects=None):
+    """
+    Write a cleaned season as one .npy file per column plus a meta.json key
+    (which also holds the season's reject report)
+    """
+    if rejects is None:
+        rejects = _empty_reject_report()
+    cache_dir = _season_cache_dir(file_path)
+    
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
         
-        # Ensure damaging cycles don't exceed total cycles
-        temp_data['Damaging_Freeze_Thaw_Cycles'] = np.minimum(
-            temp_data['Damaging_Freeze_Thaw_Cycles'], 
-            temp_data['Total_Freeze_Thaw_Cycles']
-        )
+        columns = []
+        for position, name in enumerate(data.columns):
+            series = data[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Codes per row (-1 = missing) plus the category names
+                values = series.cat.codes.to_numpy()
+                _save_npy_atomic(os.path.join(cache_dir, f'categories_{position}.npy'),
+                                 series.cat.categories.to_numpy(dtype=str))
+                column = {'name': name, 'kind': 'category', 'missing': []}
+            elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                values = series.to_numpy()
+                column = {'name': name, 'kind': 'numeric', 'missing': []}
+            else:
+                missing = series.isna().to_numpy()
+                values = series.where(~missing, '').astype(str).to_numpy(dtype=str)
+                column = {'name': name, 'kind': 'string', 'missing': np.flatnonzero(missing).tolist()}
+            _save_npy_atomic(os.path.join(cache_dir, f'col_{position}.npy'), values)
+            columns.append(column)
         
-        return temp_data
+        _save_npy_atomic(os.path.join(cache_dir, 'index.npy'), data.index.to_numpy(dtype=np.int64))
         
-    except Exception as e:
-        print(f"Error loading file '{file_path}': {str(e)}")
-        return pd.DataFrame({
-            'State': [], 'County': [], 'Latitude': [], 'Longitude': [],
-            'Total_Freeze_Thaw_Cycles': [], 'Damaging_Freeze_Thaw_Cycles': []
-        })
+        # meta.json is written last so a half-written entry never validates
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        temp_path = f'{meta_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump({'signature': signature, 'columns': columns,
+                       'rejects': {'row': rejects['row'].tolist(), 'reason': rejects['reason'].tolist()}},
+                      meta_file)
+        os.replace(temp_path, meta_path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Warning: Could not write cache for '{file_path}': {str(e)}")
+
+def _save_npy_atomic(path, values):
+    """np.save through a temporary file so readers never see a partial array"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as npy_file:
+        np.save(npy_file, np.ascontiguousarray(values))
+    os.replace(temp_path, path)
+
+@timed('load_season')
+def load_freeze_thaw_data_by_season(season=None, use_cache=True):
+    """
+    Load freeze-thaw cycle data for a specific season.
+    If no season specified, loads the most recent available season.
+    
+    Cleaned seasons are kept in CACHE_DIR as binary columns keyed by the
+    workbook's path, mtime and size; a workbook is only reparsed after it changes.
+    """
+    if season is None:
+        # Get the most recent season
+        available_seasons = get_available_seasons()
+        if not available_seasons:
+            return _empty_season_frame()
+        season = available_seasons[-1]  # Most recent
+    
+    file_path = get_season_file(season)
+    if file_path is None:
+        return _empty_season_frame()
+    
+    if use_cache:
+        signature = season_file_signature(file_path)
+        cached_data = _read_season_cache(file_path, signature)
+        if cached_data is not None:
+            count('season_cache_hits')
+            return cached_data
+    
+    count('season_workbooks_parsed')
+    parsed = _parse_season_file(file_path)
+    if parsed is None:
+        return _empty_season_frame()
+    temp_data, rejects = parsed
+    
+    if use_cache:
+        _write_season_cache(file_path, signature, temp_data, rejects)
+    
+    return temp_data
+
+def _init_ingest_worker(cache_dir):
+    """Process pool initializer: use the parent's cache directory"""
+    global CACHE_DIR
+    CACHE_DIR = cache_dir
+
+def _ingest_season(season):
+    """
+    Worker task: parse one season workbook into the columnar cache.
+    The parsed frame itself only travels back if the cache could not be written.
+    """
+    import time
+    
+    start = time.perf_counter()
+    file_path = get_season_file(season)
+    parsed = _parse_season_file(file_path)
+    if parsed is None:
+        return season, 0, time.perf_counter() - start, _empty_season_frame()
+    temp_data, rejects = parsed
+    
+    signature = season_file_signature(file_path)
+    _write_season_cache(file_path, signature, temp_data, rejects)
+    cached = os.path.exists(os.path.join(_season_cache_dir(file_path), 'meta.json'))
+    return season, len(temp_data), time.perf_counter() - start, None if cached else temp_data
+
+@timed('load_all_seasons')
+def load_all_seasons(seasons=None, workers=None):
+    """
+    Load many seasons at once, parsing stale workbooks in parallel processes.
+    
+    Workers write each parsed season to the columnar cache and the parent
+    memory-maps the result, so DataFrames are not pickled between processes.
+    
+    Parameters:
+    - seasons: List of seasons to load (default: all available)
+    - workers: Number of worker processes (default: number of CPUs)
+    
+    Returns:
+    - Tuple of (data_by_season, timings): a dict of season -> DataFrame in
+      season order, and a list of per-file dicts with season, file, source
+      ('cache' or 'parsed'), rows and seconds
+    """
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if seasons is None:
+        seasons = get_available_seasons()
+    seasons = sorted(seasons)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    data_by_season = {}
+    timings = []
+    stale_seasons = []
+    
+    for season in seasons:
+        start = time.perf_counter()
+        file_path = get_season_file(season)
+        if file_path is None:
+            data_by_season[season] = _empty_season_frame()
+            continue
+        cached_data = _read_season_cache(file_path, season_file_signature(file_path))
+        if cached_data is None:
+            stale_seasons.append(season)
+            continue
+        data_by_season[season] = cached_data
+        timings.append({'season': season, 'file': file_path, 'source': 'cache',
+                        'rows': len(cached_data), 'seconds': time.perf_counter() - start})
+    
+    if stale_seasons:
+        if workers <= 1 or len(stale_seasons) == 1:
+            results = map(_ingest_season, stale_seasons)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(stale_seasons)),
+                                           initializer=_init_ingest_worker, initargs=(CACHE_DIR,))
+            results = executor.map(_ingest_season, stale_seasons)
+        
+        try:
+            for season, rows, seconds, parsed_data in results:
+                file_path = get_season_file(season)
+                if parsed_data is None:
+                    parsed_data = _read_season_cache(file_path, season_file_signature(file_path))
+                    if parsed_data is None:
+                        parsed_data = load_freeze_thaw_data_by_season(season, use_cache=False)
+                data_by_season[season] = parsed_data
+                timings.append({'season': season, 'file': file_path, 'source': 'parsed',
+                                'rows': rows, 'seconds': seconds})
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    
+    data_by_season = {season: data_by_season[season] for season in seasons}
+    share_categories(list(data_by_season.values()))
+    timings.sort(key=lambda timing: timing['season'])
+    return data_by_season, timings
+
+def load_reject_report(seasons=None):
+    """
+    Rows dropped while cleaning the season workbooks
+    
+    Parameters:
+    - seasons: Seasons to report (default: all available)
+    
+    Returns:
+    - DataFrame with season, row (0-based data row of the workbook) and
+      reason (one of REJECT_REASONS), in season and row order
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+    seasons = sorted(seasons)
+    
+    reports = []
+    for season in seasons:
+        file_path = get_season_file(season)
+        if file_path is None:
+            continue
+        signature = season_file_signature(file_path)
+        rejects = _read_season_rejects(file_path, signature)
+        if rejects is None:
+            # Reparse (and recache) the workbook to get its report
+            parsed = _parse_season_file(file_path)
+            if parsed is None:
+                continue
+            _write_season_cache(file_path, signature, *parsed)
+            rejects = parsed[1]
+        reports.append(rejects.assign(season=season)[['season', 'row', 'reason']])
+    
+    if not reports:
+        return pd.DataFrame({'season': np.array([], dtype=str), 'row': np.array([], dtype=np.int64),
+                             'reason': np.array([], dtype=str)})
+    return pd.concat(reports, ignore_index=True)
 
 def load_freeze_thaw_data():
     """Load the most recent season's data for backward compatibility"""
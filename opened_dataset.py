@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 16:02:11 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# One read-only dataset per process: every season, the station panel, the
+# summary table and the state partition of the latest season. The seasons,
+# panel and summary are views of the memory-mapped station store, so every
+# process on a host shares one copy of them through the page cache and
+# nothing is parsed at startup. Sessions share the dataset without copying;
+# its arrays are marked read-only so no caller can change another session's
+# data by accident.
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+from opened_data_loader import get_available_seasons, load_reject_report
+from opened_station_store import load_station_store, store_season_frame, store_panel, store_summary
+from opened_spatial_index import build_state_partition
+from opened_station_identity import duplicate_station_rows
+from opened_window_statistics import build_season_prefix_sums
+from opened_trend_analysis import load_station_trends
+from opened_region_statistics import build_station_buckets
+
+def _read_only(values):
+    """Array view that cannot be written to"""
+    values = np.asarray(values).view()
+    values.flags.writeable = False
+    return values
+
+def _read_only_column(values):
+    """Read-only version of a column; categoricals keep their dtype with read-only codes"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(_read_only(values.cat.codes.to_numpy()), dtype=values.dtype)
+    return _read_only(values.to_numpy())
+
+def _read_only_frame(frame):
+    """DataFrame over read-only views of the frame's columns"""
+    return pd.DataFrame({name: _read_only_column(frame[name]) for name in frame.columns},
+                        index=frame.index, copy=False)
+
+def load_dataset(seasons=None):
+    """
+    Load everything the app queries into one read-only object.
+
+    Parameters:
+    - seasons: Seasons to include (default: all available)
+
+    Returns:
+    - Read-only mapping with:
+      - 'version': Signature of the station store it was read from (the
+        dataset_version() of the workbooks and the panel format)
+      - 'seasons': Tuple of seasons, oldest first
+      - 'latest_season': Most recent season, or None if there are no seasons
+      - 'season_data': Mapping of season -> DataFrame (store_season_frame)
+      - 'states': Sorted state names of the latest season
+      - 'panel': Station x season panel (store_panel)
+      - 'summary': Station summary table (store_summary)
+      - 'season_prefix_sums': build_season_prefix_sums of the panel
+      - 'station_trends': load_station_trends (cached per dataset version)
+      - 'station_buckets': build_station_buckets of the panel's stations (region queries)
+      - 'rejects': Rows dropped while cleaning the workbooks (load_reject_report)
+        and rows left out of the panel as duplicates of a station
+        (duplicate_station_rows), in season and row order
+      - 'state_partition': build_state_partition of the latest season's rows, or None
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+    seasons = tuple(sorted(seasons))
+
+    store = load_station_store(list(seasons))
+    season_data = {season: _read_only_frame(store_season_frame(store, season)) for season in seasons}
+    latest_season = seasons[-1] if seasons else None
+
+    states = []
+    state_partition = None
+    if latest_season is not None and not season_data[latest_season].empty:
+        latest_data = season_data[latest_season]
+        states = latest_data['State'].dropna().astype(str).str.strip()
+        states = sorted(set(state for state in states.unique() if state))
+        state_partition = build_state_partition(latest_data['State'].astype(str).to_numpy(),
+                                                latest_data['Latitude'].to_numpy(dtype=float),
+                                                latest_data['Longitude'].to_numpy(dtype=float))
+        state_partition = MappingProxyType({name: _read_only(values) for name, values in state_partition.items()})
+
+    rejects = pd.concat([load_reject_report(list(seasons)),
+                         duplicate_station_rows(seasons, store['row_station'], store['row_offsets'],
+                                                store['row_position'], store['row_index'])], ignore_index=True)
+    rejects = rejects.sort_values(['season', 'row'], kind='stable', ignore_index=True)
+
+    panel = store_panel(store)
+    prefix_sums = build_season_prefix_sums(panel)
+    panel = MappingProxyType({name: _read_only(values) for name, values in panel.items()})
+
+    return MappingProxyType({
+        'version': store['signature'],
+        'seasons': seasons,
+        'latest_season': latest_season,
+        'season_data': MappingProxyType(season_data),
+        'states': tuple(states),
+        'panel': panel,
+        'summary': _read_only_frame(store_summary(store)),
+        'season_prefix_sums': MappingProxyType({name: _read_only(values) for name, values in prefix_sums.items()}),
+        'station_trends': _read_only_frame(load_station_trends(list(seasons), panel)),
+        'station_buckets': MappingProxyType({name: _read_only(values) for name, values
+                                             in build_station_buckets(panel['Latitude'], panel['Longitude']).items()}),
+        'rejects': _read_only_frame(rejects),
+        'state_partition': state_partition
+    })
\ No newline at end of file
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 15:10:24 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Per-query timing and profiling hooks.
+#
+# Environment switches:
+# - FREEZE_THAW_TIMING=1           record stage timings for every query
+# - FREEZE_THAW_TIMING_LOG=<path>  append each query record to a JSON lines file
+# - FREEZE_THAW_PROFILE=cprofile   save a cProfile .prof file per query (one query
+#                                  at a time; concurrent queries are not profiled)
+# - FREEZE_THAW_PROFILE=sampling   save sampled stacks (collapsed format) per query
+# - FREEZE_THAW_PROFILE_DIR=<dir>  where profiles go (default: profiles)
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import itertools
+from collections import deque
+from contextlib import contextmanager
+
+TIMING_ENABLED = os.environ.get('FREEZE_THAW_TIMING', '').lower() in ['1', 'true', 'yes', 'on']
+TIMING_LOG = os.environ.get('FREEZE_THAW_TIMING_LOG')
+PROFILE_MODE = os.environ.get('FREEZE_THAW_PROFILE', '').lower()
+PROFILE_DIR = os.environ.get('FREEZE_THAW_PROFILE_DIR', 'profiles')
+
+# Seconds between stack samples in sampling mode
+SAMPLING_INTERVAL = 0.005
+
+# Query records kept per buffer
+RECENT_RECORDS = 100
+
+# Most recent query records of this process, newest last; query_timer callers
+# serving several users (e.g. Streamlit sessions) pass their own buffer instead
+recent_records = deque(maxlen=RECENT_RECORDS)
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+# Held while a cProfile profiler is active; the interpreter allows only one
+_profile_lock = threading.Lock()
+_profile_counter = itertools.count()
+
+def timing_enabled():
+    """Whether stage timings are being recorded"""
+    return TIMING_ENABLED or PROFILE_MODE in ['cprofile', 'sampling']
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as one stage of the current query. Nested stages are
+    subtracted from their parent's self time. Does nothing outside query_timer.
+    """
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+
+    stack = _local.stack
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        stage_times = record['stages'].setdefault(name, {'calls': 0, 'total_ms': 0.0, 'self_ms': 0.0})
+        stage_times['calls'] += 1
+        stage_times['total_ms'] += elapsed * 1000
+        stage_times['self_ms'] += (elapsed - children) * 1000
+
+def timed(name):
+    """Decorator form of stage(); costs one attribute lookup when no query is being timed"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'record', None) is None:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, amount=1):
+    """Add to a counter of the current query"""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['counters'][name] = record['counters'].get(name, 0) + amount
+
+def _sample_stacks(thread_id, samples, stop_event):
+    """Sampling profiler thread: collect the query thread's stack every SAMPLING_INTERVAL"""
+    while not stop_event.wait(SAMPLING_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+            frame = frame.f_back
+        if stack:
+            key = ';'.join(reversed(stack))
+            samples[key] = samples.get(key, 0) + 1
+
+def _profile_path(query, extension):
+    """File name for a query's profile"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # The counter keeps two profiles written within the same second apart
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{query}-{stamp}-{os.getpid()}-{next(_profile_counter)}.{extension}")
+
+@contextmanager
+def query_timer(query, records=None, **fields):
+    """
+    Record one query: stage timings and counters from stage(), timed() and
+    count() inside the block, plus the total time. The record is appended to
+    records (default: recent_records) and to TIMING_LOG as one JSON line.
+    When timing is disabled this yields None and records nothing.
+
+    In cprofile mode only one query is profiled at a time; a query that
+    starts while another is being profiled is timed without a profile.
+    """
+    if not timing_enabled() or getattr(_local, 'record', None) is not None:
+        yield None
+        return
+
+    record = {'query': query, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              **fields, 'total_ms': 0.0, 'stages': {}, 'counters': {}}
+    _local.record = record
+    _local.stack = [0.0]
+
+    profiler = None
+    sampler = None
+    if PROFILE_MODE == 'cprofile' and _profile_lock.acquire(blocking=False):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (not started here) is active
+            profiler = None
+            _profile_lock.release()
+    elif PROFILE_MODE == 'sampling':
+        samples = {}
+        stop_event = threading.Event()
+        sampler = threading.Thread(target=_sample_stacks, daemon=True,
+                                   args=(threading.get_ident(), samples, stop_event))
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['total_ms'] = (time.perf_counter() - start) * 1000
+        record['untimed_ms'] = (record['total_ms'] - _local.stack[0] * 1000)
+        _local.record = None
+
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            record['profile'] = _profile_path(query, 'prof')
+            profiler.dump_stats(record['profile'])
+        if sampler is not None:
+            stop_event.set()
+            sampler.join()
+            record['profile'] = _profile_path(query, 'collapsed')
+            with open(record['profile'], 'w', encoding='utf-8') as profile_file:
+                for key, n_samples in sorted(samples.items()):
+                    profile_file.write(f'{key} {n_samples}\n')
+
+        (recent_records if records is None else records).append(record)
+        if TIMING_LOG:
+            with _log_lock:
+                with open(TIMING_LOG, 'a', encoding='utf-8') as log_file:
+                    log_file.write(json.dumps(record) + '\n')
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 17:25:06 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import argparse
+import numpy as np
+import pandas as pd
+from opened_coordinate_matcher import find_k_nearest_locations, MAX_DISTANCE_BLOCK
+from opened_station_panel import compute_station_summary, load_station_panel
+from opened_instrumentation import timed
+
+# Default number of stations and distance power of the inverse-distance weights
+IDW_NEIGHBORS = 5
+IDW_POWER = 2
+
+# Targets this close to a station (km) take that station's values as they are
+IDW_EXACT_KM = 0.001
+
+def idw_weights(distances, power=IDW_POWER):
+    """
+    Inverse-distance weights for a (targets, k) distance array (NaN = no
+    station). A target within IDW_EXACT_KM of a station gets all its weight
+    from the station(s) that close.
+    """
+    distances = np.asarray(distances, dtype=float)
+    available = ~np.isnan(distances)
+    exact = available & (distances <= IDW_EXACT_KM)
+    with np.errstate(divide='ignore'):
+        weights = np.where(available, 1 / np.maximum(distances, IDW_EXACT_KM) ** power, 0.0)
+    return np.where(exact.any(axis=1)[:, None], exact.astype(float), weights)
+
+@timed('interpolate')
+def interpolate_cycles(target_lats, target_lons, panel, k=IDW_NEIGHBORS, power=IDW_POWER,
+                       max_distance_km=50, recent_years=5, block_size=MAX_DISTANCE_BLOCK):
+    """
+    Estimate Total and Damaging cycles at many sites from their k nearest
+    stations with inverse-distance weighting, for every season at once.
+
+    Neighbours are found through the persisted spatial index of the panel's
+    stations. Each season is interpolated from the neighbours that have data
+    for it, with their weights renormalized; a season none of them has stays
+    NaN.
+    The estimated series are then summarized like station histories.
+
+    Parameters:
+    - target_lats, target_lons: Site coordinates in decimal degrees
+    - panel: Station x season panel (load_station_panel)
+    - k: Number of stations per site
+    - power: Distance power of the weights
+    - max_distance_km: Stations further away than this are not used
+    - recent_years: Window of the '5yr' statistics
+    - block_size: Maximum number of values gathered per NumPy pass
+
+    Returns:
+    - Dictionary with:
+      - 'total', 'damaging': (sites, seasons) estimated cycles
+      - 'positions', 'distances': The (sites, k) panel rows and distances used
+      - 'summary': DataFrame per site with Latitude, Longitude, years
+        available and the avg / std / cov / variability columns of
+        compute_station_summary for the estimated series
+    """
+    target_lats = np.atleast_1d(np.asarray(target_lats, dtype=float))
+    target_lons = np.atleast_1d(np.asarray(target_lons, dtype=float))
+
+    stations = pd.DataFrame({'Latitude': panel['Latitude'], 'Longitude': panel['Longitude']})
+    positions, distances = find_k_nearest_locations(target_lats, target_lons, stations, k, max_distance_km,
+                                                    block_size, use_index=True, index_role='panel')
+    weights = idw_weights(distances, power)
+
+    n_seasons = len(panel['seasons'])
+    estimates = {measure: np.full((len(target_lats), n_seasons), np.nan) for measure in ['total', 'damaging']}
+    target_step = max(1, block_size // max(1, k * n_seasons))
+
+    for target_start in range(0, len(target_lats), target_step):
+        target_slice = slice(target_start, target_start + target_step)
+        block_positions = positions[target_slice]
+        block_weights = weights[target_slice, :, None]
+        for measure in ['total', 'damaging']:
+            # (sites, k, seasons) values of the neighbours
+            values = panel[measure][np.maximum(block_positions, 0)]
+            present = ~np.isnan(values) & (block_positions >= 0)[:, :, None]
+            weight_sum = (block_weights * present).sum(axis=1)
+            weighted = (block_weights * np.where(present, values, 0.0)).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                estimates[measure][target_slice] = np.where(weight_sum > 0, weighted / weight_sum, np.nan)
+
+    summary = compute_station_summary({
+        'State': np.full(len(target_lats), ''), 'County': np.full(len(target_lats), ''),
+        'Latitude': target_lats, 'Longitude': target_lons,
+        'total': estimates['total'], 'damaging': estimates['damaging']
+    }, recent_years)
+    summary = summary.drop(columns=['State', 'County']).rename_axis('site')
+
+    return {
+        'total': estimates['total'],
+        'damaging': estimates['damaging'],
+        'positions': positions,
+        'distances': distances,
+        'summary': summary
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate freeze-thaw cycles at sites from their nearest monitoring stations "
+                    "and report 5-year and all-years statistics.")
+    parser.add_argument('input', help="CSV file with lat and lon columns (and optionally site_id)")
+    parser.add_argument('output', help="CSV file to write the estimated statistics to")
+    parser.add_argument('--neighbors', type=int, default=IDW_NEIGHBORS,
+                        help=f"Stations per site (default: {IDW_NEIGHBORS})")
+    parser.add_argument('--power', type=float, default=IDW_POWER,
+                        help=f"Distance power of the weights (default: {IDW_POWER})")
+    parser.add_argument('--max-distance-km', type=float, default=50,
+                        help="Maximum distance to a station used (default: 50 km)")
+    args = parser.parse_args()
+
+    sites = pd.read_csv(args.input)
+    sites.columns = [str(col).lower().strip() for col in sites.columns]
+    missing_columns = [col for col in ['lat', 'lon'] if col not in sites.columns]
+    if missing_columns:
+        raise ValueError(f"Input is missing columns: {missing_columns}")
+
+    result = interpolate_cycles(pd.to_numeric(sites['lat'], errors='coerce').to_numpy(dtype=float),
+                                pd.to_numeric(sites['lon'], errors='coerce').to_numpy(dtype=float),
+                                load_station_panel(), args.neighbors, args.power, args.max_distance_km)
+    summary = result['summary']
+    if 'site_id' in sites.columns:
+        summary.index = pd.Index(sites['site_id'].to_numpy(), name='site_id')
+    summary['stations_used'] = (result['positions'] >= 0).sum(axis=1)
+    summary.to_csv(args.output)
+    print(f"Wrote {len(summary)} sites to '{args.output}' "
+          f"({int((summary['stations_used'] > 0).sum())} with stations in range)")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 00:41:08 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# In-process cache of location query results. Keys are (state, latitude,
+# longitude, dataset version) with the coordinates rounded to
+# QUERY_CACHE_PRECISION decimals, so repeated and nearby queries that resolve
+# the same way skip the station search and statistics. The dataset version
+# changes whenever a season workbook changes, which makes older entries
+# unreachable; they are dropped as soon as a newer version is stored.
+#
+# Environment switches:
+# - FREEZE_THAW_QUERY_CACHE_SIZE=<n>       entries kept (default 1024, 0 disables)
+# - FREEZE_THAW_QUERY_CACHE_PRECISION=<d>  decimals of the rounded coordinates (default 4, ~11 m)
+import os
+import threading
+from collections import OrderedDict
+from opened_instrumentation import count
+
+QUERY_CACHE_SIZE = int(os.environ.get('FREEZE_THAW_QUERY_CACHE_SIZE', 1024))
+QUERY_CACHE_PRECISION = int(os.environ.get('FREEZE_THAW_QUERY_CACHE_PRECISION', 4))
+
+def create_query_cache(max_entries=QUERY_CACHE_SIZE, precision=QUERY_CACHE_PRECISION):
+    """Empty LRU cache with its settings and hit / miss / eviction counters"""
+    return {
+        'entries': OrderedDict(),
+        'max_entries': max_entries,
+        'precision': precision,
+        'version': None,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'lock': threading.Lock()
+    }
+
+# Cache shared by every session of this process
+QUERY_CACHE = create_query_cache()
+
+def query_cache_key(cache, state, latitude, longitude, version):
+    """Key of a query: the state, the rounded coordinates and the dataset version"""
+    precision = cache['precision']
+    return (str(state).strip().upper(), round(float(latitude), precision),
+            round(float(longitude), precision), version)
+
+def cache_get(cache, key):
+    """Cached result for a key (marking it most recently used), or None"""
+    with cache['lock']:
+        result = cache['entries'].get(key)
+        if result is None:
+            cache['misses'] += 1
+            count('query_cache_misses')
+            return None
+        cache['entries'].move_to_end(key)
+        cache['hits'] += 1
+        count('query_cache_hits')
+        return result
+
+def cache_put(cache, key, result):
+    """
+    Store a result, evicting the least recently used entries beyond
+    max_entries. Storing a key of a new dataset version clears the entries of
+    the previous one.
+    """
+    if cache['max_entries'] <= 0:
+        return
+    with cache['lock']:
+        version = key[-1]
+        if version != cache['version']:
+            cache['entries'].clear()
+            cache['version'] = version
+        cache['entries'][key] = result
+        cache['entries'].move_to_end(key)
+        while len(cache['entries']) > cache['max_entries']:
+            cache['entries'].popitem(last=False)
+            cache['evictions'] += 1
+
+def cache_stats(cache):
+    """Entries, capacity, hits, misses, evictions and hit rate of a cache"""
+    with cache['lock']:
+        lookups = cache['hits'] + cache['misses']
+        return {
+            'entries': len(cache['entries']),
+            'max_entries': cache['max_entries'],
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'evictions': cache['evictions'],
+            'hit_rate': cache['hits'] / lookups if lookups else 0.0
+        }
+
+def clear_query_cache(cache):
+    """Drop every entry and reset the counters"""
+    with cache['lock']:
+        cache['entries'].clear()
+        cache['version'] = None
+        cache['hits'] = cache['misses'] = cache['evictions'] = 0
\ No newline at end of file
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 02:31:55 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Statistics over every station inside a region: a bounding box, a radius
+# around a point or a simple polygon. Stations are bucketed once on a
+# lat/lon grid and sorted by bucket, so the buckets overlapping a region's
+# bounding box are a few contiguous ranges; only those candidates go through
+# the exact (haversine or point-in-polygon) test.
+import numpy as np
+import pandas as pd
+from opened_coordinate_matcher import haversine_distance
+from opened_spatial_index import EARTH_RADIUS_KM
+from opened_instrumentation import timed, count
+
+REGION_BUCKET_DEG = 0.5
+
+# Upper bound on the number of point x edge tests held in memory at once
+REGION_POLYGON_BLOCK = 4_000_000
+
+def build_station_buckets(latitudes, longitudes, bucket_deg=REGION_BUCKET_DEG):
+    """
+    Station positions sorted by grid bucket
+
+    Returns:
+    - Dictionary with 'bucket_deg', 'n_cols' (buckets per row), 'keys'
+      (sorted bucket key row * n_cols + col of each entry), 'order' (station
+      position of each entry) and 'latitudes' / 'longitudes' in that order
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    n_cols = int(np.ceil(360 / bucket_deg)) + 1
+    keys = (np.floor((latitudes + 90) / bucket_deg).astype(np.int64) * n_cols +
+            np.floor((longitudes + 180) / bucket_deg).astype(np.int64))
+    order = np.argsort(keys, kind='stable')
+    return {
+        'bucket_deg': np.float64(bucket_deg),
+        'n_cols': np.int64(n_cols),
+        'keys': keys[order],
+        'order': order,
+        'latitudes': latitudes[order],
+        'longitudes': longitudes[order]
+    }
+
+def _bbox_candidates(buckets, lat_min, lat_max, lon_min, lon_max):
+    """Entries (positions into the sorted bucket arrays) of the buckets overlapping a box"""
+    deg, n_cols = float(buckets['bucket_deg']), int(buckets['n_cols'])
+    lat_min, lat_max = max(lat_min, -90.0), min(lat_max, 90.0)
+    lon_min, lon_max = max(lon_min, -180.0), min(lon_max, 180.0)
+    if lat_min > lat_max or lon_min > lon_max:
+        return np.empty(0, dtype=np.int64)
+
+    rows = np.arange(int(np.floor((lat_min + 90) / deg)), int(np.floor((lat_max + 90) / deg)) + 1)
+    col_min, col_max = int(np.floor((lon_min + 180) / deg)), int(np.floor((lon_max + 180) / deg))
+
+    # One contiguous range of entries per bucket row
+    starts = np.searchsorted(buckets['keys'], rows * n_cols + col_min, side='left')
+    ends = np.searchsorted(buckets['keys'], rows * n_cols + col_max, side='right')
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+def _selected_stations(buckets, candidates, inside):
+    """Sorted station positions of the candidates that passed the exact test"""
+    count('region_candidates', len(candidates))
+    return np.sort(buckets['order'][candidates[inside]])
+
+def stations_in_bbox(buckets, lat_min, lat_max, lon_min, lon_max):
+    """Station positions inside a latitude / longitude box (edges included)"""
+    candidates = _bbox_candidates(buckets, lat_min, lat_max, lon_min, lon_max)
+    latitudes = buckets['latitudes'][candidates]
+    longitudes = buckets['longitudes'][candidates]
+    inside = (latitudes >= lat_min) & (latitudes <= lat_max) & (longitudes >= lon_min) & (longitudes <= lon_max)
+    return _selected_stations(buckets, candidates, inside)
+
+def stations_in_radius(buckets, latitude, longitude, radius_km):
+    """Station positions within radius_km (haversine) of a point"""
+    lat_margin = np.degrees(radius_km / EARTH_RADIUS_KM)
+    if abs(latitude) + lat_margin >= 90:
+        lon_margin = 180.0
+    else:
+        lon_margin = np.degrees(radius_km / (EARTH_RADIUS_KM * np.cos(np.radians(abs(latitude) + lat_margin))))
+
+    candidates = _bbox_candidates(buckets, latitude - lat_margin, latitude + lat_margin,
+                                  longitude - lon_margin, longitude + lon_margin)
+    distances = haversine_distance(latitude, longitude, buckets['latitudes'][candidates],
+                                   buckets['longitudes'][candidates])
+    return _selected_stations(buckets, candidates, distances <= radius_km)
+
+def points_in_polygon(latitudes, longitudes, polygon_lats, polygon_lons, block_size=REGION_POLYGON_BLOCK):
+    """
+    Even-odd (ray casting) test of many points against one simple polygon,
+    treating latitude / longitude as plane coordinates
+
+    Parameters:
+    - latitudes, longitudes: Points to test
+    - polygon_lats, polygon_lons: Polygon vertices in order (closing the ring is optional)
+    - block_size: Maximum number of point x edge tests per NumPy pass
+
+    Returns:
+    - Boolean array, True for points inside the polygon
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    y1 = np.asarray(polygon_lats, dtype=float)
+    x1 = np.asarray(polygon_lons, dtype=float)
+    y2, x2 = np.roll(y1, 1), np.roll(x1, 1)
+
+    inside = np.zeros(len(latitudes), dtype=bool)
+    if len(y1) < 3:
+        return inside
+
+    step = max(1, block_size // len(y1))
+    for start in range(0, len(latitudes), step):
+        block = slice(start, start + step)
+        y = latitudes[block, None]
+        x = longitudes[block, None]
+        # Edges the horizontal ray from the point can cross, and where they cross it
+        spans = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside[block] = (spans & (x < crossing_x)).sum(axis=1) % 2 == 1
+    return inside
+
+def stations_in_polygon(buckets, polygon_lats, polygon_lons):
+    """Station positions inside a simple polygon given by its vertices"""
+    polygon_lats = np.asarray(polygon_lats, dtype=float)
+    polygon_lons = np.asarray(polygon_lons, dtype=float)
+    if len(polygon_lats) < 3:
+        raise ValueError("A polygon needs at least 3 vertices")
+
+    candidates = _bbox_candidates(buckets, polygon_lats.min(), polygon_lats.max(),
+                                  polygon_lons.min(), polygon_lons.max())
+    inside = points_in_polygon(buckets['latitudes'][candidates], buckets['longitudes'][candidates],
+                               polygon_lats, polygon_lons)
+    return _selected_stations(buckets, candidates, inside)
+
+def area_statistics(summary, station_ids):
+    """
+    Area-level statistics of a set of stations, pooling every station-season
+    value (all seasons, and each station's most recent 5) from the per-station
+    averages and standard deviations of the summary table
+
+    Returns:
+    - Series with stations, and for total / damaging and all / 5yr the
+      number of station-seasons ('{m}_{w}_values'), average, std and COV (%)
+    """
+    rows = summary.iloc[np.asarray(station_ids, dtype=np.int64)]
+    statistics = {'stations': len(rows)}
+    for window, years_column in [('all', 'years_available'), ('5yr', 'years_5yr')]:
+        counts = rows[years_column].to_numpy(dtype=float)
+        n_values = counts.sum()
+        for measure in ['total', 'damaging']:
+            averages = rows[f'{measure}_{window}_avg'].to_numpy(dtype=float)
+            stds = rows[f'{measure}_{window}_std'].to_numpy(dtype=float)
+            average = (counts * averages).sum() / n_values if n_values else 0.0
+            variance = (counts * (stds ** 2 + averages ** 2)).sum() / n_values - average ** 2 if n_values else 0.0
+            std = np.sqrt(max(variance, 0.0))
+            statistics[f'{measure}_{window}_values'] = int(n_values)
+            statistics[f'{measure}_{window}_avg'] = average
+            statistics[f'{measure}_{window}_std'] = std
+            statistics[f'{measure}_{window}_cov'] = std / average * 100 if n_values > 1 and average > 0 else 0.0
+    return pd.Series(statistics)
+
+@timed('region_statistics')
+def region_statistics(summary, buckets, bbox=None, center=None, radius_km=None, polygon=None):
+    """
+    Stations inside a region and their area-level statistics
+
+    Parameters:
+    - summary: Station summary table (load_station_summary); its rows are the
+      stations the buckets were built from
+    - buckets: build_station_buckets of the summary's Latitude / Longitude
+    - bbox: (lat_min, lat_max, lon_min, lon_max), or
+    - center and radius_km: (latitude, longitude) and a radius, or
+    - polygon: (polygon_lats, polygon_lons) vertex arrays
+
+    Returns:
+    - Tuple of (stations, statistics): the summary rows of the stations
+      inside the region and area_statistics of them
+    """
+    if bbox is not None:
+        station_ids = stations_in_bbox(buckets, *bbox)
+    elif center is not None and radius_km is not None:
+        station_ids = stations_in_radius(buckets, center[0], center[1], radius_km)
+    elif polygon is not None:
+        station_ids = stations_in_polygon(buckets, *polygon)
+    else:
+        raise ValueError("Give a bbox, a center and radius_km, or a polygon")
+
+    return summary.iloc[station_ids], area_statistics(summary, station_ids)
\ No newline at end of file
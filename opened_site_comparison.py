@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 01:22:40 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Side-by-side comparison of candidate sites. All sites are matched in one
+# batched nearest-station search, and their season histories and statistics
+# are gathered from the station panel and summary with one indexing
+# operation each, so comparing many sites costs about the same as one.
+import numpy as np
+import pandas as pd
+from opened_coordinate_matcher import find_nearest_locations_in_state
+from opened_dataset import load_dataset
+
+COMPARISON_STATISTICS = ['years_available',
+                         'total_5yr_avg', 'total_5yr_cov', 'total_5yr_variability',
+                         'damaging_5yr_avg', 'damaging_5yr_cov', 'damaging_5yr_variability',
+                         'total_all_avg', 'total_all_cov', 'total_all_variability',
+                         'damaging_all_avg', 'damaging_all_cov', 'damaging_all_variability']
+
+def compare_sites(sites, dataset=None, max_distance_km=50):
+    """
+    Match many sites to their nearest stations and gather their statistics
+
+    Parameters:
+    - sites: DataFrame with state, lat and lon columns (and optionally
+      site_id; default: the row number)
+    - dataset: load_dataset() result (default: loaded here)
+    - max_distance_km: Maximum matching distance (default 50 km)
+
+    Returns:
+    - Dictionary with:
+      - 'table': DataFrame per site with site_id, state, lat, lon,
+        station_id, station_state, station_county, distance_km, in_state
+        and COMPARISON_STATISTICS; station columns are empty for unmatched sites
+      - 'seasons': Season labels of the histories
+      - 'total', 'damaging': (sites, seasons) cycles of each site's station
+        (NaN for missing seasons and unmatched sites)
+    """
+    if dataset is None:
+        dataset = load_dataset()
+
+    n_sites = len(sites)
+    site_ids = sites['site_id'].to_numpy() if 'site_id' in sites.columns else np.arange(n_sites)
+    panel = dataset['panel']
+    seasons = np.asarray(panel['seasons'])
+
+    station_ids = np.full(n_sites, -1, dtype=np.int64)
+    distances = np.full(n_sites, np.nan)
+    in_state = np.zeros(n_sites, dtype=bool)
+
+    latest_season = dataset['latest_season']
+    search_data = dataset['season_data'][latest_season] if latest_season is not None else None
+    if n_sites and search_data is not None and not search_data.empty:
+        positions, distances, in_state = find_nearest_locations_in_state(
+            sites['lat'].to_numpy(dtype=float), sites['lon'].to_numpy(dtype=float),
+            sites['state'].astype(str).to_numpy(), search_data, dataset['state_partition'], max_distance_km)
+
+        # Latest-season rows to station IDs in one lookup
+        season_idx = np.flatnonzero(seasons == latest_season)
+        if len(season_idx):
+            matched = positions >= 0
+            offset = panel['row_offsets'][season_idx[0]]
+            station_ids[matched] = panel['row_station'][offset + positions[matched]]
+
+    matched = np.flatnonzero(station_ids >= 0)
+    stations = dataset['summary'].iloc[station_ids[matched]].set_axis(matched).reindex(np.arange(n_sites))
+
+    histories = {}
+    for measure in ['total', 'damaging']:
+        histories[measure] = np.full((n_sites, len(seasons)), np.nan)
+        histories[measure][matched] = panel[measure][station_ids[matched]]
+
+    table = pd.DataFrame({
+        'site_id': site_ids,
+        'state': sites['state'].to_numpy(),
+        'lat': sites['lat'].to_numpy(),
+        'lon': sites['lon'].to_numpy(),
+        'station_id': pd.Series(station_ids, dtype='Int64').where(station_ids >= 0).array,
+        'station_state': stations['State'].to_numpy(),
+        'station_county': stations['County'].to_numpy(),
+        'distance_km': distances,
+        'in_state': in_state,
+        **{column: stations[column].to_numpy() for column in COMPARISON_STATISTICS}
+    })
+
+    return {
+        'table': table,
+        'seasons': seasons,
+        'total': histories['total'],
+        'damaging': histories['damaging']
+    }
\ No newline at end of file
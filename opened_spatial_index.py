@@ -0,0 +1,654 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 10:02:18 2026
+
+@author: bahaa
+"""
+
+##################### Stastical Analysis
+import os
+import re
+import hashlib
+import numpy as np
+import opened_data_loader
+
+# Radius of earth in kilometers (same value as haversine_distance)
+EARTH_RADIUS_KM = 6371
+
+# Stations per leaf of the tree
+LEAF_SIZE = 32
+
+# Targets per pass of the batched tree queries (query_k_nearest_batch)
+QUERY_BATCH_TARGETS = 4096
+
+# Relative slack of the batched box pruning, so rounding never drops a
+# station that sits exactly on the current bound
+PRUNE_SLACK = 1e-9
+
+# Indexes kept in memory per process, keyed by coordinate fingerprint
+_LOADED_INDEXES = {}
+_MAX_LOADED_INDEXES = 32
+
+# Nearest-station grid: default cell size and extent margin (degrees), the
+# reach (km) within which stations are looked at for a cell, cells per tile
+# side during the build, and the slack (km) covering float32 storage and
+# chord rounding in the safety tests
+GRID_CELL_DEG = 0.02
+GRID_MARGIN_DEG = 0.5
+GRID_REACH_KM = 150
+GRID_TILE_CELLS = 64
+GRID_TOLERANCE_KM = 0.01
+
+# Upper bound on the number of cell x station distances held in memory at once
+GRID_DISTANCE_BLOCK = 4_000_000
+
+_LOADED_GRIDS = {}
+
+# Index and grid files of earlier versions were named by coordinate
+# fingerprint, one per coordinate set; they are deleted once a file named by
+# role is written
+_FINGERPRINT_FILE = re.compile(r'^(station_index|nearest_grid)_[0-9a-f]{32}(_[0-9.e+-]+)?\.npz$')
+
+def _unit_vectors(latitudes, longitudes):
+    """Convert decimal degrees to 3D points on the unit sphere"""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+def _km_to_chord2(distance_km):
+    """Squared straight-line distance on the unit sphere for a great circle distance"""
+    if distance_km is None:
+        return np.inf
+    angle = min(distance_km / EARTH_RADIUS_KM, np.pi)
+    return (2 * np.sin(angle / 2)) ** 2
+
+def _chord2_to_km(chord2):
+    """Great circle distance in kilometers for squared unit-sphere chord lengths"""
+    half_chord = np.minimum(np.sqrt(chord2) / 2, 1.0)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(half_chord)
+
+def build_station_index(latitudes, longitudes, leaf_size=LEAF_SIZE):
+    """
+    Build a KD-tree over station coordinates projected onto the unit sphere.
+    Straight-line (chord) distance on the sphere orders stations exactly like
+    the haversine distance, so nearest-neighbour answers are the same.
+
+    Parameters:
+    - latitudes, longitudes: Station coordinates in decimal degrees
+    - leaf_size: Maximum number of stations per leaf
+
+    Returns:
+    - Dictionary of arrays describing a complete binary tree; positions in
+      query results refer to the order of the input coordinates
+    """
+    xyz = _unit_vectors(latitudes, longitudes)
+    n_points = len(xyz)
+
+    depth = 0
+    while n_points > leaf_size * 2 ** depth:
+        depth += 1
+    n_internal = 2 ** depth - 1
+    n_nodes = 2 ** (depth + 1) - 1
+
+    order = np.arange(n_points)
+    node_start = np.zeros(n_nodes, dtype=np.int64)
+    node_end = np.zeros(n_nodes, dtype=np.int64)
+    node_end[0] = n_points
+
+    # Split every internal node at the median of its widest dimension
+    for node in range(n_internal):
+        start, end = node_start[node], node_end[node]
+        mid = (start + end) // 2
+        segment = order[start:end]
+        if end - start > 1:
+            points = xyz[segment]
+            dim = np.argmax(points.max(axis=0) - points.min(axis=0))
+            order[start:end] = segment[np.argpartition(points[:, dim], mid - start)]
+        node_start[2 * node + 1], node_end[2 * node + 1] = start, mid
+        node_start[2 * node + 2], node_end[2 * node + 2] = mid, end
+
+    # Bounding boxes: leaves from their points, internal nodes from their children
+    sorted_xyz = xyz[order]
+    box_lo = np.full((n_nodes, 3), np.inf)
+    box_hi = np.full((n_nodes, 3), -np.inf)
+    leaves = np.arange(n_internal, n_nodes)
+    filled = leaves[node_end[leaves] > node_start[leaves]]
+    if len(filled):
+        box_lo[filled] = np.minimum.reduceat(sorted_xyz, node_start[filled], axis=0)
+        box_hi[filled] = np.maximum.reduceat(sorted_xyz, node_start[filled], axis=0)
+    for level in range(depth - 1, -1, -1):
+        parents = np.arange(2 ** level - 1, 2 ** (level + 1) - 1)
+        box_lo[parents] = np.minimum(box_lo[2 * parents + 1], box_lo[2 * parents + 2])
+        box_hi[parents] = np.maximum(box_hi[2 * parents + 1], box_hi[2 * parents + 2])
+
+    return {
+        'xyz': sorted_xyz,
+        'order': order,
+        'node_start': node_start,
+        'node_end': node_end,
+        'box_lo': box_lo,
+        'box_hi': box_hi,
+        'n_internal': np.array(n_internal)
+    }
+
+def _tree_nodes(index):
+    """Node tables as Python lists; tree walks are faster on floats than NumPy scalars"""
+    if '_nodes' not in index:
+        index['_nodes'] = (
+            int(index['n_internal']),
+            index['node_start'].tolist(),
+            index['node_end'].tolist(),
+            [tuple(box) for box in index['box_lo'].tolist()],
+            [tuple(box) for box in index['box_hi'].tolist()]
+        )
+    return index['_nodes']
+
+def _box_distance2(query, lo, hi):
+    """Squared distance from a point to an axis-aligned box"""
+    total = 0.0
+    for q, low, high in zip(query, lo, hi):
+        if q < low:
+            total += (low - q) ** 2
+        elif q > high:
+            total += (q - high) ** 2
+    return total
+
+def _walk(index, query, bound2, visit_leaf):
+    """
+    Depth-first walk visiting the closer child first. visit_leaf(start, end)
+    receives a leaf's range and returns the (possibly tightened) bound.
+    """
+    n_internal, node_start, node_end, box_lo, box_hi = _tree_nodes(index)
+    if _box_distance2(query, box_lo[0], box_hi[0]) > bound2:
+        return
+
+    stack = [(0.0, 0)]
+    while stack:
+        box_d2, node = stack.pop()
+        if box_d2 > bound2:
+            continue
+        if node >= n_internal:
+            bound2 = visit_leaf(node_start[node], node_end[node])
+            continue
+        left, right = 2 * node + 1, 2 * node + 2
+        left_d2 = _box_distance2(query, box_lo[left], box_hi[left])
+        right_d2 = _box_distance2(query, box_lo[right], box_hi[right])
+        if left_d2 <= right_d2:
+            stack.append((right_d2, right))
+            stack.append((left_d2, left))
+        else:
+            stack.append((left_d2, left))
+            stack.append((right_d2, right))
+
+def query_k_nearest(index, latitude, longitude, k=1, max_distance_km=None):
+    """
+    Find the k nearest stations to a point
+
+    Returns:
+    - Tuple of (positions, distances_km) arrays ordered by distance; fewer than
+      k entries when fewer stations lie within max_distance_km
+    """
+    query = _unit_vectors([latitude], [longitude])[0]
+    query_tuple = tuple(query.tolist())
+    xyz, order = index['xyz'], index['order']
+    best_d2 = np.empty(0)
+    best_pos = np.empty(0, dtype=np.int64)
+    bound2 = _km_to_chord2(max_distance_km)
+
+    def visit_leaf(start, end):
+        nonlocal best_d2, best_pos
+        diff = xyz[start:end] - query
+        leaf_d2 = np.einsum('ij,ij->i', diff, diff)
+        keep = leaf_d2 <= bound2
+        best_d2 = np.concatenate([best_d2, leaf_d2[keep]])
+        best_pos = np.concatenate([best_pos, order[start:end][keep]])
+        if len(best_d2) > k:
+            # Ties go to the lower input position, like np.argmin
+            ranked = np.lexsort((best_pos, best_d2))[:k]
+            best_d2, best_pos = best_d2[ranked], best_pos[ranked]
+        return best_d2.max() if len(best_d2) == k else bound2
+
+    _walk(index, query_tuple, bound2, visit_leaf)
+
+    ranked = np.lexsort((best_pos, best_d2))
+    return best_pos[ranked], _chord2_to_km(best_d2[ranked])
+
+def _box_distance2_batch(queries, lo, hi):
+    """Squared distance from each query point to its box; rows of (n, 3) arrays"""
+    gap = np.maximum(lo - queries, 0) + np.maximum(queries - hi, 0)
+    return np.einsum('ij,ij->i', gap, gap)
+
+def _leaf_points(index, leaves, width):
+    """(leaves, width) positions into index['xyz'] of each leaf's points, and which are real"""
+    starts = index['node_start'][leaves]
+    points = starts[:, None] + np.arange(width)
+    valid = points < index['node_end'][leaves][:, None]
+    return np.where(valid, points, 0), valid
+
+def _k_nearest_block(index, query, k, max_bound2):
+    """query_k_nearest_batch for one block of unit-vector queries; squared chords"""
+    n_targets = len(query)
+    n_internal = int(index['n_internal'])
+    box_lo, box_hi, xyz = index['box_lo'], index['box_hi'], index['xyz']
+    leaf_sizes = index['node_end'][n_internal:] - index['node_start'][n_internal:]
+    width = max(int(leaf_sizes.max()), 1) if len(leaf_sizes) else 1
+
+    # Initial bound: the k-th nearest point of the leaf reached by always
+    # stepping into the closer child (inf when that leaf has fewer than k)
+    nodes = np.zeros(n_targets, dtype=np.int64)
+    while n_internal and nodes[0] < n_internal:
+        left, right = 2 * nodes + 1, 2 * nodes + 2
+        closer_left = (_box_distance2_batch(query, box_lo[left], box_hi[left]) <=
+                       _box_distance2_batch(query, box_lo[right], box_hi[right]))
+        nodes = np.where(closer_left, left, right)
+    points, valid = _leaf_points(index, nodes, width)
+    diff = xyz[points] - query[:, None, :]
+    leaf_d2 = np.where(valid, np.einsum('ijk,ijk->ij', diff, diff), np.inf)
+    if k <= width:
+        bound2 = np.partition(leaf_d2, k - 1, axis=1)[:, k - 1]
+    else:
+        bound2 = np.full(n_targets, np.inf)
+    bound2 = np.minimum(bound2, max_bound2) * (1 + PRUNE_SLACK)
+
+    # Walk all targets down the tree one level at a time, keeping the
+    # (target, node) pairs whose box can still hold a point within the bound
+    targets = np.arange(n_targets)
+    nodes = np.zeros(n_targets, dtype=np.int64)
+    keep = _box_distance2_batch(query, box_lo[nodes], box_hi[nodes]) <= bound2
+    targets, nodes = targets[keep], nodes[keep]
+    while len(nodes) and nodes[0] < n_internal:
+        targets = np.repeat(targets, 2)
+        nodes = np.column_stack([2 * nodes + 1, 2 * nodes + 2]).ravel()
+        keep = _box_distance2_batch(query[targets], box_lo[nodes], box_hi[nodes]) <= bound2[targets]
+        targets, nodes = targets[keep], nodes[keep]
+
+    # Every point of the surviving leaves, then the k smallest per target
+    points, valid = _leaf_points(index, nodes, width)
+    diff = xyz[points] - query[targets][:, None, :]
+    candidate_d2 = np.einsum('ijk,ijk->ij', diff, diff)
+    valid &= candidate_d2 <= max_bound2
+    candidate_targets = np.broadcast_to(targets[:, None], valid.shape)[valid]
+    candidate_d2 = candidate_d2[valid]
+    candidate_positions = index['order'][points[valid]]
+
+    # Ties go to the lower input position, like np.argmin
+    ranked = np.lexsort((candidate_positions, candidate_d2, candidate_targets))
+    candidate_targets = candidate_targets[ranked]
+    counts = np.bincount(candidate_targets, minlength=n_targets)
+    ranks = np.arange(len(ranked)) - np.repeat(np.cumsum(counts) - counts, counts)
+    selected = ranks < k
+
+    positions = np.full((n_targets, k), -1, dtype=np.int64)
+    best_d2 = np.full((n_targets, k), np.inf)
+    positions[candidate_targets[selected], ranks[selected]] = candidate_positions[ranked][selected]
+    best_d2[candidate_targets[selected], ranks[selected]] = candidate_d2[ranked][selected]
+    return positions, best_d2
+
+def query_k_nearest_batch(index, latitudes, longitudes, k=1, max_distance_km=None,
+                          batch_size=QUERY_BATCH_TARGETS):
+    """
+    Find the k nearest stations to many points at once. Targets descend the
+    tree together one level per NumPy pass instead of one walk per point,
+    which is what makes large batches faster than a full scan.
+
+    Returns:
+    - Tuple of (positions, distances_km) arrays of shape (targets, k),
+      nearest first; -1 (distance NaN) where fewer than k stations lie
+      within max_distance_km. Same stations and order as query_k_nearest.
+    """
+    latitudes = np.atleast_1d(np.asarray(latitudes, dtype=float))
+    longitudes = np.atleast_1d(np.asarray(longitudes, dtype=float))
+    positions = np.full((len(latitudes), k), -1, dtype=np.int64)
+    distances = np.full((len(latitudes), k), np.nan)
+    if len(index['order']) == 0 or k < 1:
+        return positions, distances
+
+    max_bound2 = _km_to_chord2(max_distance_km)
+    for start in range(0, len(latitudes), batch_size):
+        block = slice(start, start + batch_size)
+        block_positions, block_d2 = _k_nearest_block(
+            index, _unit_vectors(latitudes[block], longitudes[block]), k, max_bound2)
+        positions[block] = block_positions
+        found = block_positions >= 0
+        distances[block] = np.where(found, _chord2_to_km(np.where(found, block_d2, 0)), np.nan)
+    return positions, distances
+
+def query_nearest(index, latitude, longitude, max_distance_km=None):
+    """
+    Find the nearest station to a point
+
+    Returns:
+    - Tuple of (position, distance_km) or (-1, nan) if no station is within range
+    """
+    positions, distances = query_k_nearest(index, latitude, longitude, 1, max_distance_km)
+    if len(positions) == 0:
+        return -1, np.nan
+    return int(positions[0]), float(distances[0])
+
+def query_radius(index, latitude, longitude, radius_km):
+    """
+    Find every station within radius_km of a point
+
+    Returns:
+    - Tuple of (positions, distances_km) arrays ordered by distance
+    """
+    query = _unit_vectors([latitude], [longitude])[0]
+    xyz, order = index['xyz'], index['order']
+    bound2 = _km_to_chord2(radius_km)
+    found_d2 = []
+    found_pos = []
+
+    def visit_leaf(start, end):
+        diff = xyz[start:end] - query
+        leaf_d2 = np.einsum('ij,ij->i', diff, diff)
+        keep = leaf_d2 <= bound2
+        found_d2.append(leaf_d2[keep])
+        found_pos.append(order[start:end][keep])
+        return bound2
+
+    _walk(index, tuple(query.tolist()), bound2, visit_leaf)
+
+    if not found_d2:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    found_d2 = np.concatenate(found_d2)
+    found_pos = np.concatenate(found_pos)
+    ranked = np.lexsort((found_pos, found_d2))
+    return found_pos[ranked], _chord2_to_km(found_d2[ranked])
+
+def coordinate_fingerprint(latitudes, longitudes):
+    """
+    Hash of every station coordinate, used as the index cache key. The full
+    coordinate bytes are hashed on each call, so a changed or reused buffer
+    never maps to the index of other coordinates.
+    """
+    latitudes = np.ascontiguousarray(latitudes, dtype=float)
+    longitudes = np.ascontiguousarray(longitudes, dtype=float)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(latitudes.tobytes())
+    digest.update(longitudes.tobytes())
+    return digest.hexdigest()
+
+def _read_cache_file(path, signature):
+    """Arrays of a cached index or grid file, or None if missing or built for another signature"""
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            if str(cached['signature']) == signature:
+                return {name: cached[name] for name in cached.files if name != 'signature'}
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def _write_cache_file(path, signature, arrays, description):
+    """Atomically replace a cached index or grid file, then drop fingerprint-named files"""
+    try:
+        os.makedirs(opened_data_loader.CACHE_DIR, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, signature=np.array(signature), **arrays)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not write {description} cache: {str(e)}")
+        return
+
+    try:
+        names = os.listdir(opened_data_loader.CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        if _FINGERPRINT_FILE.match(name):
+            try:
+                os.remove(os.path.join(opened_data_loader.CACHE_DIR, name))
+            except OSError:
+                pass
+
+def load_or_build_station_index(latitudes, longitudes, role='nationwide'):
+    """
+    Station index for a set of coordinates. Indexes are kept in memory and
+    persisted in the data cache directory, so they are built once per
+    coordinate set rather than at every app start.
+
+    Parameters:
+    - latitudes, longitudes: Station coordinates in decimal degrees
+    - role: Name of the cache file (station_index_{role}.npz); each role
+      keeps one file, replaced when its coordinates change
+    """
+    fingerprint = coordinate_fingerprint(latitudes, longitudes)
+    if fingerprint in _LOADED_INDEXES:
+        return _LOADED_INDEXES[fingerprint]
+
+    index_path = os.path.join(opened_data_loader.CACHE_DIR, f'station_index_{role}.npz')
+    index = _read_cache_file(index_path, fingerprint)
+    if index is None:
+        index = build_station_index(latitudes, longitudes)
+        _write_cache_file(index_path, fingerprint, index, 'station index')
+
+    if len(_LOADED_INDEXES) >= _MAX_LOADED_INDEXES:
+        _LOADED_INDEXES.pop(next(iter(_LOADED_INDEXES)))
+    _LOADED_INDEXES[fingerprint] = index
+    return index
+
+def build_state_partition(states, latitudes, longitudes):
+    """
+    Station rows grouped by state, so the stations of one state are a
+    contiguous range instead of a filter over every row. States are matched
+    by their exact name (case and surrounding spaces ignored).
+
+    Returns:
+    - Dictionary with 'states' (sorted upper-case names), 'starts' and 'ends'
+      (each state's range in 'order'), 'order' (row positions grouped by
+      state, in their original order within a state), 'codes' (each row's
+      position in 'states') and 'latitudes' / 'longitudes' in 'order' order
+    """
+    keys = np.char.upper(np.char.strip(np.asarray(states, dtype=str)))
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+
+    order = np.argsort(keys, kind='stable')
+    names, starts, codes = np.unique(keys[order], return_index=True, return_inverse=True)
+    row_codes = np.empty(len(keys), dtype=np.int64)
+    row_codes[order] = codes
+    return {
+        'states': names,
+        'starts': starts,
+        'ends': np.append(starts[1:], len(keys)),
+        'order': order,
+        'codes': row_codes,
+        'latitudes': latitudes[order],
+        'longitudes': longitudes[order]
+    }
+
+def state_codes(partition, states):
+    """Position of each state in partition['states'], or -1 for states without stations"""
+    keys = np.char.upper(np.char.strip(np.asarray(states, dtype=str)))
+    codes = np.full(keys.shape, -1, dtype=np.int64)
+    if len(partition['states']) == 0:
+        return codes
+    positions = np.searchsorted(partition['states'], keys)
+    found = positions < len(partition['states'])
+    found[found] = partition['states'][positions[found]] == keys[found]
+    codes[found] = positions[found]
+    return codes
+
+def state_code(partition, state):
+    """Position of a state in partition['states'], or -1 if it has no stations"""
+    return int(state_codes(partition, [str(state)])[0])
+
+def state_row_range(partition, state):
+    """(start, end) of a state's stations in partition['order']; (0, 0) if it has none"""
+    code = state_code(partition, state)
+    if code < 0:
+        return 0, 0
+    return int(partition['starts'][code]), int(partition['ends'][code])
+
+def _two_nearest(cell_xyz, station_xyz, block_size=GRID_DISTANCE_BLOCK):
+    """
+    Nearest station per cell (position into station_xyz, -1 if none) and the
+    squared chord to the nearest and second-nearest station (inf if none)
+    """
+    n_cells = len(cell_xyz)
+    nearest = np.full(n_cells, -1, dtype=np.int64)
+    best_dot = np.full(n_cells, -np.inf)
+    second_dot = np.full(n_cells, -np.inf)
+    cells = np.arange(n_cells)
+
+    station_step = max(1, block_size // max(1, n_cells))
+    for station_start in range(0, len(station_xyz), station_step):
+        # The largest dot product is the nearest station on the sphere
+        dots = cell_xyz @ station_xyz[station_start:station_start + station_step].T
+        block_best = np.argmax(dots, axis=1)
+        block_best_dot = dots[cells, block_best]
+        dots[cells, block_best] = -np.inf
+        block_second_dot = dots.max(axis=1) if dots.shape[1] > 1 else np.full(n_cells, -np.inf)
+
+        improved = block_best_dot > best_dot
+        second_dot = np.where(improved, np.maximum(best_dot, block_second_dot),
+                              np.maximum(second_dot, block_best_dot))
+        nearest = np.where(improved, block_best + station_start, nearest)
+        best_dot = np.where(improved, block_best_dot, best_dot)
+
+    def to_chord2(dot):
+        return np.where(np.isfinite(dot), np.maximum(2 - 2 * dot, 0), np.inf)
+    return nearest, to_chord2(best_dot), to_chord2(second_dot)
+
+def build_nearest_grid(latitudes, longitudes, cell_deg=GRID_CELL_DEG, margin_deg=GRID_MARGIN_DEG,
+                       reach_km=GRID_REACH_KM):
+    """
+    Raster of the nearest and second-nearest station distance for every cell
+    center of a lat/lon grid covering the stations plus margin_deg.
+
+    For a point in a cell, the distance to any station changes by at most the
+    cell's half-diagonal h from its value at the center. So when the second
+    nearest station is more than 2h further from the center than the nearest
+    one, the nearest station is the same for the whole cell, and when the
+    nearest one is more than h beyond the search radius, nothing in the cell
+    is in range. query_nearest_grid answers those cells directly.
+
+    The grid is built in tiles; each tile only looks at the stations that
+    can be within reach_km of it. Distances beyond reach_km are stored as
+    reach_km, a lower bound, which keeps both tests above conservative.
+
+    Parameters:
+    - latitudes, longitudes: Station coordinates in decimal degrees
+    - cell_deg: Cell size in degrees (e.g. 0.01)
+    - margin_deg: Extent beyond the stations' bounding box, in degrees
+    - reach_km: Largest station distance resolved exactly
+
+    Returns:
+    - Dictionary with 'nearest' (station position per cell, -1 if none
+      within reach, int32), 'nearest_km' and 'second_km' (float32) of shape
+      (rows, cols), 'origin' (latitude, longitude of the south-west corner),
+      'cell_deg' and 'half_diagonal_km'
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+
+    lat0 = np.floor((latitudes.min() - margin_deg) / cell_deg) * cell_deg
+    lon0 = np.floor((longitudes.min() - margin_deg) / cell_deg) * cell_deg
+    n_rows = int(np.ceil((latitudes.max() + margin_deg - lat0) / cell_deg))
+    n_cols = int(np.ceil((longitudes.max() + margin_deg - lon0) / cell_deg))
+
+    station_xyz = _unit_vectors(latitudes, longitudes)
+    nearest = np.full((n_rows, n_cols), -1, dtype=np.int32)
+    nearest_km = np.full((n_rows, n_cols), reach_km, dtype=np.float32)
+    second_km = np.full((n_rows, n_cols), reach_km, dtype=np.float32)
+
+    reach_lat_deg = np.degrees(reach_km / EARTH_RADIUS_KM)
+    for row_start in range(0, n_rows, GRID_TILE_CELLS):
+        tile_rows = np.arange(row_start, min(row_start + GRID_TILE_CELLS, n_rows))
+        tile_lats = lat0 + (tile_rows + 0.5) * cell_deg
+        lat_lo = tile_lats[0] - reach_lat_deg
+        lat_hi = tile_lats[-1] + reach_lat_deg
+        # Degrees of longitude within reach, at the tile's most poleward latitude
+        max_abs_lat = min(max(abs(lat_lo), abs(lat_hi)), 89.9)
+        reach_lon_deg = min(180.0, reach_lat_deg / np.cos(np.radians(max_abs_lat)))
+        band = np.flatnonzero((latitudes >= lat_lo) & (latitudes <= lat_hi))
+
+        for col_start in range(0, n_cols, GRID_TILE_CELLS):
+            tile_cols = np.arange(col_start, min(col_start + GRID_TILE_CELLS, n_cols))
+            tile_lons = lon0 + (tile_cols + 0.5) * cell_deg
+            candidates = band[(longitudes[band] >= tile_lons[0] - reach_lon_deg) &
+                              (longitudes[band] <= tile_lons[-1] + reach_lon_deg)]
+            if len(candidates) == 0:
+                continue
+
+            cell_xyz = _unit_vectors(np.repeat(tile_lats, len(tile_lons)), np.tile(tile_lons, len(tile_lats)))
+            tile_nearest, best_d2, second_d2 = _two_nearest(cell_xyz, station_xyz[candidates])
+            tile_nearest_km = _chord2_to_km(best_d2)
+            in_reach = tile_nearest_km < reach_km
+
+            tile = np.ix_(tile_rows, tile_cols)
+            shape = (len(tile_rows), len(tile_cols))
+            nearest[tile] = np.where(in_reach, candidates[np.maximum(tile_nearest, 0)], -1).reshape(shape)
+            nearest_km[tile] = np.minimum(tile_nearest_km, reach_km).reshape(shape)
+            second_km[tile] = np.minimum(_chord2_to_km(second_d2), reach_km).reshape(shape)
+
+    # Center-to-corner distance is largest at the equator, so this bounds every cell
+    half_diagonal_km = _chord2_to_km(np.sum((_unit_vectors(0, 0) - _unit_vectors(cell_deg / 2, cell_deg / 2)) ** 2))
+
+    return {
+        'nearest': nearest,
+        'nearest_km': nearest_km,
+        'second_km': second_km,
+        'origin': np.array([lat0, lon0]),
+        'cell_deg': np.array(cell_deg),
+        'half_diagonal_km': np.array(half_diagonal_km)
+    }
+
+def query_nearest_grid(grid, latitudes, longitudes, max_distance_km):
+    """
+    Resolve nearest-station queries from a grid built by build_nearest_grid.
+
+    Returns:
+    - Tuple of (positions, resolved) arrays. Where resolved is True the grid
+      settled the query: positions is the exact nearest station (its distance
+      still has to be compared with max_distance_km) or -1 when no station
+      can be within max_distance_km. Queries outside the grid or in cells
+      near a Voronoi boundary are not resolved and need an exact search.
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    positions = np.full(len(latitudes), -1, dtype=np.int64)
+    resolved = np.zeros(len(latitudes), dtype=bool)
+
+    lat0, lon0 = grid['origin']
+    cell_deg = float(grid['cell_deg'])
+    n_rows, n_cols = grid['nearest'].shape
+    with np.errstate(invalid='ignore'):
+        rows = np.floor((latitudes - lat0) / cell_deg)
+        cols = np.floor((longitudes - lon0) / cell_deg)
+        inside = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+    cells = rows[inside].astype(np.int64) * n_cols + cols[inside].astype(np.int64)
+
+    nearest_km = grid['nearest_km'].ravel()[cells]
+    second_km = grid['second_km'].ravel()[cells]
+    half_diagonal_km = float(grid['half_diagonal_km'])
+    same_nearest = second_km - nearest_km > 2 * half_diagonal_km + GRID_TOLERANCE_KM
+    out_of_range = nearest_km - half_diagonal_km > max_distance_km + GRID_TOLERANCE_KM
+
+    inside_rows = np.flatnonzero(inside)
+    positions[inside_rows[same_nearest]] = grid['nearest'].ravel()[cells[same_nearest]]
+    resolved[inside_rows[same_nearest | out_of_range]] = True
+    return positions, resolved
+
+def load_or_build_nearest_grid(latitudes, longitudes, cell_deg=GRID_CELL_DEG, role='nationwide'):
+    """
+    Nearest-station grid for a set of coordinates, kept in memory and
+    persisted in the data cache directory like the station index: one
+    nearest_grid_{role}.npz file per role, replaced when its coordinates or
+    cell size change
+    """
+    key = f'{coordinate_fingerprint(latitudes, longitudes)}_{cell_deg:g}'
+    if key in _LOADED_GRIDS:
+        return _LOADED_GRIDS[key]
+
+    grid_path = os.path.join(opened_data_loader.CACHE_DIR, f'nearest_grid_{role}.npz')
+    grid = _read_cache_file(grid_path, key)
+    if grid is None:
+        grid = build_nearest_grid(latitudes, longitudes, cell_deg)
+        _write_cache_file(grid_path, key, grid, 'nearest-station grid')
+
+    if len(_LOADED_GRIDS) >= _MAX_LOADED_INDEXES:
+        _LOADED_GRIDS.pop(next(iter(_LOADED_GRIDS)))
+    _LOADED_GRIDS[key] = grid
+    return grid
\ No newline at end of file
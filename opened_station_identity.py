@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 12:41:37 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import numpy as np
+import pandas as pd
+from opened_data_loader import season_county_clean
+
+# Rows of the same State and County within this many degrees are the same station
+CLUSTER_TOLERANCE_DEG = 0.01
+
+# Reject report reason of a row left out of the panel because another row of
+# the same season belongs to the same station
+DUPLICATE_STATION_REASON = 'duplicate_station'
+
+def _cluster_coordinates(group_ids, latitudes, longitudes, tolerance=CLUSTER_TOLERANCE_DEG):
+    """
+    Cluster index of each row's coordinates within its State/County group.
+    Groups with a single distinct coordinate (almost all of them) are handled
+    in one vectorized step; the rest are clustered greedily in sorted order,
+    so the result does not depend on season or row order.
+    """
+    coords = pd.DataFrame({'group': group_ids, 'lat': latitudes, 'lon': longitudes})
+    unique_coords = coords.drop_duplicates().sort_values(['group', 'lat', 'lon'], ignore_index=True)
+    unique_coords['cluster'] = 0
+
+    group_sizes = unique_coords.groupby('group')['lat'].transform('size')
+    for group, group_coords in unique_coords[group_sizes > 1].groupby('group'):
+        centers = []
+        clusters = []
+        for lat, lon in zip(group_coords['lat'], group_coords['lon']):
+            for cluster, (center_lat, center_lon) in enumerate(centers):
+                if abs(lat - center_lat) <= tolerance and abs(lon - center_lon) <= tolerance:
+                    break
+            else:
+                cluster = len(centers)
+                centers.append((lat, lon))
+            clusters.append(cluster)
+        unique_coords.loc[group_coords.index, 'cluster'] = clusters
+
+    return coords.merge(unique_coords, on=['group', 'lat', 'lon'], how='left')['cluster'].to_numpy()
+
+def keep_closest_rows(groups, latitudes, longitudes, center_lats, center_lons):
+    """
+    Which row to keep where several rows share a group (one station in one
+    season): the row closest to its group's center, ties going to the first row
+
+    Parameters:
+    - groups: Group key of each row
+    - latitudes, longitudes: Row coordinates
+    - center_lats, center_lons: Center of each row's group
+
+    Returns:
+    - Boolean array, True for exactly one row per group
+    """
+    groups = np.asarray(groups)
+    offsets = ((np.asarray(latitudes, dtype=float) - center_lats) ** 2 +
+               (np.asarray(longitudes, dtype=float) - center_lons) ** 2)
+    order = np.lexsort((np.arange(len(groups)), offsets, groups))
+    sorted_groups = groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    kept = np.zeros(len(groups), dtype=bool)
+    kept[order[first]] = True
+    return kept
+
+def duplicate_station_rows(seasons, row_station, row_offsets, row_position, row_index):
+    """
+    Rows left out of the panel because a closer row of the same season
+    belongs to the same station
+
+    Parameters:
+    - seasons: Season labels, oldest first
+    - row_station, row_offsets, row_position: As returned by resolve_station_ids
+    - row_index: Workbook row (0-based data row) of every row, seasons concatenated
+
+    Returns:
+    - DataFrame with season, row and reason (DUPLICATE_STATION_REASON), like
+      load_reject_report
+    """
+    season_idx = np.repeat(np.arange(len(seasons)), np.diff(row_offsets))
+    row_in_season = np.arange(len(row_station)) - np.asarray(row_offsets)[season_idx]
+    dropped = np.flatnonzero(np.asarray(row_position)[row_station, season_idx] != row_in_season)
+    return pd.DataFrame({
+        'season': np.asarray(seasons, dtype=str)[season_idx[dropped]],
+        'row': np.asarray(row_index, dtype=np.int64)[dropped],
+        'reason': np.full(len(dropped), DUPLICATE_STATION_REASON)
+    })
+
+def resolve_station_ids(season_frames):
+    """
+    Assign a station ID to every row of every season.
+
+    A station is a (State, cleaned County, coordinate cluster) combination.
+    IDs are numbered in sorted State / County / coordinate order, so the same
+    workbooks always produce the same IDs and a station keeps its ID in every
+    season it appears in. If several rows of one season fall into the same
+    station, the panel keeps the one closest to the centroid of all the
+    station's rows (keep_closest_rows); the others are reported by
+    duplicate_station_rows.
+
+    Parameters:
+    - season_frames: List of loaded season DataFrames, oldest season first
+
+    Returns:
+    - Dictionary with:
+      - 'row_station': Station ID of every row, seasons concatenated in order
+      - 'row_offsets': Start of each season in row_station (length seasons + 1),
+        so season i's rows are row_station[row_offsets[i]:row_offsets[i + 1]]
+      - 'row_position': (stations, seasons) row position of each station's
+        kept row in each season's DataFrame, -1 where the station is missing
+      - 'stations': DataFrame of State, County, County_Clean, Latitude and
+        Longitude per station ID, taken from its most recent kept row
+    """
+    row_counts = [len(frame) for frame in season_frames]
+    row_offsets = np.concatenate([[0], np.cumsum(row_counts)]).astype(np.int64)
+    stations_columns = ['State', 'County', 'County_Clean', 'Latitude', 'Longitude']
+
+    if row_offsets[-1] == 0:
+        return {
+            'row_station': np.empty(0, dtype=np.int32),
+            'row_offsets': row_offsets,
+            'row_position': np.empty((0, len(season_frames)), dtype=np.int32),
+            'stations': pd.DataFrame(columns=stations_columns)
+        }
+
+    all_data = pd.concat([frame[['State', 'County', 'Latitude', 'Longitude']] for frame in season_frames],
+                         ignore_index=True)
+    season_idx = np.repeat(np.arange(len(season_frames)), row_counts)
+    row_in_season = np.arange(len(all_data)) - row_offsets[season_idx]
+
+    state_keys = all_data['State'].astype(str).str.strip().str.upper()
+    county_clean = pd.concat([season_county_clean(frame) for frame in season_frames], ignore_index=True)
+    county_keys = county_clean.astype(str).str.strip().str.upper()
+
+    group_ids, _ = pd.factorize(pd.MultiIndex.from_arrays([state_keys, county_keys]))
+    clusters = _cluster_coordinates(group_ids, all_data['Latitude'].to_numpy(), all_data['Longitude'].to_numpy())
+
+    # Number stations in State / County / coordinate order
+    keys = pd.DataFrame({'state': state_keys, 'county': county_keys, 'group': group_ids,
+                         'cluster': clusters, 'lat': all_data['Latitude'], 'lon': all_data['Longitude']})
+    station_keys = (keys.groupby(['group', 'cluster'], sort=False)
+                        .agg(state=('state', 'first'), county=('county', 'first'),
+                             lat=('lat', 'min'), lon=('lon', 'min'))
+                        .sort_values(['state', 'county', 'lat', 'lon']))
+    station_keys['station_id'] = np.arange(len(station_keys))
+    row_station = (keys[['group', 'cluster']]
+                   .merge(station_keys['station_id'].reset_index(), on=['group', 'cluster'], how='left')
+                   ['station_id'].to_numpy(dtype=np.int32))
+
+    n_stations = len(station_keys)
+    latitudes = all_data['Latitude'].to_numpy(dtype=float)
+    longitudes = all_data['Longitude'].to_numpy(dtype=float)
+    station_rows = np.bincount(row_station, minlength=n_stations)
+    center_lats = np.bincount(row_station, weights=latitudes, minlength=n_stations) / station_rows
+    center_lons = np.bincount(row_station, weights=longitudes, minlength=n_stations) / station_rows
+    kept = keep_closest_rows(row_station.astype(np.int64) * len(season_frames) + season_idx, latitudes, longitudes,
+                             center_lats[row_station], center_lons[row_station])
+    if not kept.all():
+        print(f"Warning: {int((~kept).sum())} rows share a station with another row of the same season; "
+              "kept the row closest to each station's centroid")
+
+    row_position = np.full((n_stations, len(season_frames)), -1, dtype=np.int32)
+    row_position[row_station[kept], season_idx[kept]] = row_in_season[kept]
+
+    # Station attributes from the most recent season the station appears in
+    kept_rows = np.flatnonzero(kept)
+    latest_rows = pd.Series(kept_rows).groupby(row_station[kept_rows]).last().to_numpy()
+    stations = pd.DataFrame({
+        'State': all_data['State'].astype(str).str.strip().to_numpy()[latest_rows],
+        'County': all_data['County'].astype(str).to_numpy()[latest_rows],
+        'County_Clean': county_keys.to_numpy()[latest_rows],
+        'Latitude': latitudes[latest_rows],
+        'Longitude': longitudes[latest_rows]
+    })
+
+    return {
+        'row_station': row_station,
+        'row_offsets': row_offsets,
+        'row_position': row_position,
+        'stations': stations
+    }
+
+def match_station_ids(stations, season_data, tolerance=CLUSTER_TOLERANCE_DEG):
+    """
+    Station IDs for the rows of a new season, given the existing station table.
+    Rows match a station with the same State and cleaned County whose
+    coordinates are within tolerance; other rows become new stations, numbered
+    after the existing ones.
+
+    Parameters:
+    - stations: Existing station table or panel (State, County_Clean, Latitude, Longitude)
+    - season_data: Loaded DataFrame of the new season
+
+    Returns:
+    - Tuple of (row_station, new_stations): station ID per row of season_data
+      and a station table for the stations that did not exist before
+    """
+    stations_columns = ['State', 'County', 'County_Clean', 'Latitude', 'Longitude']
+    if season_data.empty:
+        return np.empty(0, dtype=np.int32), pd.DataFrame(columns=stations_columns)
+
+    county_keys = season_county_clean(season_data).astype(str).str.strip().str.upper()
+    rows = pd.DataFrame({
+        'row': np.arange(len(season_data)),
+        'state': season_data['State'].astype(str).str.strip().str.upper().to_numpy(),
+        'county': county_keys.to_numpy(),
+        'lat': season_data['Latitude'].to_numpy(dtype=float),
+        'lon': season_data['Longitude'].to_numpy(dtype=float)
+    })
+    n_stations = len(stations['State'])
+    existing = pd.DataFrame({
+        'station_id': np.arange(n_stations),
+        'state': pd.Series(stations['State'], dtype=object).astype(str).str.upper().to_numpy(),
+        'county': np.asarray(stations['County_Clean'], dtype=str),
+        'station_lat': np.asarray(stations['Latitude'], dtype=float),
+        'station_lon': np.asarray(stations['Longitude'], dtype=float)
+    })
+
+    # Candidate pairs share State and County; keep the closest one within tolerance
+    pairs = rows.merge(existing, on=['state', 'county'])
+    lat_diff = (pairs['lat'] - pairs['station_lat']).abs()
+    lon_diff = (pairs['lon'] - pairs['station_lon']).abs()
+    pairs = pairs[(lat_diff <= tolerance) & (lon_diff <= tolerance)].assign(distance=np.hypot(lat_diff, lon_diff))
+    closest = pairs.sort_values(['row', 'distance', 'station_id']).drop_duplicates('row')
+
+    row_station = np.full(len(rows), -1, dtype=np.int32)
+    row_station[closest['row'].to_numpy()] = closest['station_id'].to_numpy()
+
+    # Unmatched rows form new stations, clustered among themselves
+    unmatched = np.flatnonzero(row_station < 0)
+    if len(unmatched) == 0:
+        return row_station, pd.DataFrame(columns=stations_columns)
+
+    new_rows = rows.iloc[unmatched]
+    group_ids, _ = pd.factorize(pd.MultiIndex.from_arrays([new_rows['state'], new_rows['county']]))
+    clusters = _cluster_coordinates(group_ids, new_rows['lat'].to_numpy(), new_rows['lon'].to_numpy())
+    new_ids, _ = pd.factorize(pd.MultiIndex.from_arrays([group_ids, clusters]))
+    row_station[unmatched] = n_stations + new_ids
+
+    # Attributes from the last row of each new station
+    last_rows = unmatched[pd.Series(np.arange(len(unmatched))).groupby(new_ids).last().to_numpy()]
+    new_stations = pd.DataFrame({
+        'State': season_data['State'].astype(str).str.strip().to_numpy()[last_rows],
+        'County': season_data['County'].astype(str).to_numpy()[last_rows],
+        'County_Clean': county_keys.to_numpy()[last_rows],
+        'Latitude': season_data['Latitude'].to_numpy(dtype=float)[last_rows],
+        'Longitude': season_data['Longitude'].to_numpy(dtype=float)[last_rows]
+    })
+
+    return row_station, new_stations
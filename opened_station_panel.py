@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 09:12:41 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import os
+import json
+import numpy as np
+import pandas as pd
+import opened_data_loader
+from opened_data_loader import (clean_county_name, season_county_clean, get_available_seasons,
+                                get_season_file, load_all_seasons, load_freeze_thaw_data_by_season,
+                                season_file_signature)
+from opened_station_identity import match_station_ids, resolve_station_ids, keep_closest_rows
+from opened_instrumentation import timed
+
+PANEL_CACHE_FILE = 'station_panel.npz'
+SUMMARY_CACHE_FILE = 'station_summary.npz'
+AGGREGATES_CACHE_FILE = 'station_aggregates.npz'
+PANEL_FORMAT_VERSION = 3
+
+# Statistics reported by station_statistics besides 'data' and 'years_available'
+STATISTIC_KEYS = ['total_all_avg', 'damaging_all_avg', 'total_all_cov', 'damaging_all_cov',
+                  'total_5yr_avg', 'damaging_5yr_avg', 'total_5yr_cov', 'damaging_5yr_cov']
+
+# COV thresholds (%) of the Low / Moderate / High variability categories
+VARIABILITY_LOW_MAX = 15
+VARIABILITY_MODERATE_MAX = 40
+
+@timed('build_panel')
+def build_station_panel(seasons=None):
+    """
+    Combine every season into dense station x season matrices.
+
+    Parameters:
+    - seasons: List of seasons to include (default: all available, oldest first)
+
+    Returns:
+    - Dictionary with per-station State, County, County_Clean, Latitude and
+      Longitude arrays, 'total' / 'damaging' matrices of shape
+      (stations, seasons) holding NaN where a station is missing from a season,
+      and the season <-> row mapping from resolve_station_ids. Panel rows are
+      station IDs.
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+    seasons = sorted(seasons)
+
+    data_by_season, _ = load_all_seasons(seasons)
+    return build_panel_from_frames(seasons, list(data_by_season.values()))
+
+def build_panel_from_frames(seasons, season_frames):
+    """
+    Station x season panel from already loaded season DataFrames
+    (one per season, in the same order as seasons)
+    """
+    identity = resolve_station_ids(season_frames)
+    stations = identity['stations']
+
+    n_stations = len(stations)
+    total = np.full((n_stations, len(seasons)), np.nan)
+    damaging = np.full((n_stations, len(seasons)), np.nan)
+    for season_idx, season_data in enumerate(season_frames):
+        if season_data.empty:
+            continue
+        # Each station's kept row of the season (see resolve_station_ids)
+        positions = identity['row_position'][:, season_idx]
+        present = positions >= 0
+        rows = positions[present]
+        total[present, season_idx] = season_data['Total_Freeze_Thaw_Cycles'].to_numpy(dtype=float)[rows]
+        damaging[present, season_idx] = season_data['Damaging_Freeze_Thaw_Cycles'].to_numpy(dtype=float)[rows]
+
+    return {
+        'seasons': np.array(seasons, dtype=str),
+        'State': stations['State'].to_numpy(dtype=str),
+        'County': stations['County'].to_numpy(dtype=str),
+        'County_Clean': stations['County_Clean'].to_numpy(dtype=str),
+        'Latitude': stations['Latitude'].to_numpy(dtype=float),
+        'Longitude': stations['Longitude'].to_numpy(dtype=float),
+        'total': total,
+        'damaging': damaging,
+        'row_station': identity['row_station'],
+        'row_offsets': identity['row_offsets'],
+        'row_position': identity['row_position']
+    }
+
+def _empty_panel(seasons):
+    """Panel with no stations"""
+    return {
+        'seasons': np.array(seasons, dtype=str),
+        'State': np.array([], dtype=str), 'County': np.array([], dtype=str),
+        'County_Clean': np.array([], dtype=str),
+        'Latitude': np.array([], dtype=float), 'Longitude': np.array([], dtype=float),
+        'total': np.empty((0, len(seasons))), 'damaging': np.empty((0, len(seasons))),
+        'row_station': np.empty(0, dtype=np.int32),
+        'row_offsets': np.zeros(len(seasons) + 1, dtype=np.int64),
+        'row_position': np.empty((0, len(seasons)), dtype=np.int32)
+    }
+
+def _panel_signature(seasons):
+    """Signatures of every season workbook the panel is built from"""
+    signature = [['format', PANEL_FORMAT_VERSION]]
+    for season in sorted(seasons):
+        file_path = get_season_file(season)
+        signature.append([season, season_file_signature(file_path) if file_path else None])
+    return signature
+
+def _read_cached_arrays(path, signature):
+    """Arrays saved by _write_cached_arrays, or None if missing or stale"""
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            if str(cached['signature']) == signature:
+                return {name: cached[name] for name in cached.files if name != 'signature'}
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def _write_cached_arrays(path, signature, arrays):
+    """Save arrays with their signature as an uncompressed .npz in CACHE_DIR"""
+    try:
+        os.makedirs(opened_data_loader.CACHE_DIR, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, signature=np.array(signature), **arrays)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not write cache file '{path}': {str(e)}")
+
+@timed('load_panel')
+def load_station_panel(seasons=None):
+    """
+    Station x season panel, rebuilt only when a season workbook changes.
+    The panel is stored as CACHE_DIR/station_panel.npz next to the season cache.
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+
+    signature = json.dumps(_panel_signature(seasons))
+    panel_path = os.path.join(opened_data_loader.CACHE_DIR, PANEL_CACHE_FILE)
+
+    panel = _read_cached_arrays(panel_path, signature)
+    if panel is None:
+        panel = build_station_panel(seasons)
+        _write_cached_arrays(panel_path, signature, panel)
+
+    return panel
+
+def variability_categories(cov):
+    """Vectorized get_variability_category: 'Low', 'Moderate' or 'High' per COV value"""
+    cov = np.asarray(cov, dtype=float)
+    return np.where(cov < VARIABILITY_LOW_MAX, 'Low',
+                    np.where(cov <= VARIABILITY_MODERATE_MAX, 'Moderate', 'High'))
+
+def _masked_average_and_cov(values, mask):
+    """
+    Row-wise mean, standard deviation and COV (%) of values where mask is True,
+    with the same conventions as _average_and_cov
+    """
+    counts = mask.sum(axis=1)
+    safe_counts = np.maximum(counts, 1)
+    masked = np.where(mask, values, 0.0)
+    average = masked.sum(axis=1) / safe_counts
+    std = np.sqrt((np.where(mask, values - average[:, None], 0.0) ** 2).sum(axis=1) / safe_counts)
+    cov = np.where((counts > 1) & (average > 0), std / np.where(average > 0, average, 1) * 100, 0.0)
+    return np.where(counts > 0, average, 0.0), np.where(counts > 0, std, 0.0), cov
+
+def compute_station_summary(panel, recent_years=5):
+    """
+    All-years and last 5 years statistics for every station at once
+
+    Returns:
+    - DataFrame indexed by station ID with State, County, Latitude, Longitude,
+      years_available, years_5yr and, for total / damaging and all / 5yr,
+      the average, std, cov and variability category columns
+      (e.g. 'total_5yr_cov', 'damaging_all_variability')
+    """
+    present = ~np.isnan(panel['total'])
+
+    # The most recent `recent_years` seasons each station has data for
+    rank_from_latest = np.cumsum(present[:, ::-1], axis=1)[:, ::-1]
+    recent = present & (rank_from_latest <= recent_years)
+
+    summary = pd.DataFrame({
+        'State': panel['State'],
+        'County': panel['County'],
+        'Latitude': panel['Latitude'],
+        'Longitude': panel['Longitude'],
+        'years_available': present.sum(axis=1),
+        'years_5yr': recent.sum(axis=1)
+    })
+    summary.index.name = 'station_id'
+
+    for measure in ['total', 'damaging']:
+        for window, mask in [('all', present), ('5yr', recent)]:
+            average, std, cov = _masked_average_and_cov(panel[measure], mask)
+            summary[f'{measure}_{window}_avg'] = average
+            summary[f'{measure}_{window}_std'] = std
+            summary[f'{measure}_{window}_cov'] = cov
+            summary[f'{measure}_{window}_variability'] = variability_categories(cov)
+
+    return summary
+
+def _write_station_summary(signature, summary):
+    """Save a summary table as CACHE_DIR/station_summary.npz"""
+    columns = {}
+    for name in summary.columns:
+        values = summary[name].to_numpy()
+        columns[name] = values.astype(str) if values.dtype == object else values
+    _write_cached_arrays(os.path.join(opened_data_loader.CACHE_DIR, SUMMARY_CACHE_FILE), signature,
+                         {'station_id': summary.index.to_numpy(), **columns})
+
+@timed('load_summary')
+def load_station_summary(seasons=None):
+    """
+    Summary table from compute_station_summary, cached as
+    CACHE_DIR/station_summary.npz and rebuilt only when a season workbook changes
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+
+    signature = json.dumps(_panel_signature(seasons))
+    summary_path = os.path.join(opened_data_loader.CACHE_DIR, SUMMARY_CACHE_FILE)
+
+    columns = _read_cached_arrays(summary_path, signature)
+    if columns is not None:
+        station_ids = columns.pop('station_id')
+        return pd.DataFrame(columns, index=pd.Index(station_ids, name='station_id'))
+
+    summary = compute_station_summary(load_station_panel(seasons))
+    _write_station_summary(signature, summary)
+
+    return summary
+
+def compute_running_aggregates(panel, recent_years=5):
+    """
+    Per-station running aggregates that a new season can update in place:
+    count, sum, Welford mean and M2 (sum of squared deviations) over all
+    seasons, and the values of the most recent `recent_years` seasons
+    (oldest first, NaN-padded) for each of total and damaging
+
+    Returns:
+    - Dictionary of arrays, e.g. 'total_count', 'total_m2', 'damaging_recent'
+    """
+    aggregates = {}
+    for measure in ['total', 'damaging']:
+        values = panel[measure]
+        present = ~np.isnan(values)
+        count = present.sum(axis=1)
+        total = np.where(present, values, 0.0).sum(axis=1)
+        mean = total / np.maximum(count, 1)
+        m2 = (np.where(present, values - mean[:, None], 0.0) ** 2).sum(axis=1)
+
+        # Last `recent_years` present values, right-aligned
+        recent = np.full((len(values), recent_years), np.nan)
+        rank_from_latest = np.cumsum(present[:, ::-1], axis=1)[:, ::-1]
+        station_idx, season_idx = np.nonzero(present & (rank_from_latest <= recent_years))
+        recent[station_idx, recent_years - rank_from_latest[station_idx, season_idx]] = values[station_idx, season_idx]
+
+        aggregates[f'{measure}_count'] = count
+        aggregates[f'{measure}_sum'] = total
+        aggregates[f'{measure}_mean'] = mean
+        aggregates[f'{measure}_m2'] = m2
+        aggregates[f'{measure}_recent'] = recent
+    return aggregates
+
+def update_running_aggregates(aggregates, total_values, damaging_values):
+    """
+    Fold one new season into the running aggregates in place.
+    Value arrays hold one entry per station (NaN where the station has no data);
+    stations beyond the current aggregates are added first.
+    """
+    for measure, new_values in [('total', total_values), ('damaging', damaging_values)]:
+        new_values = np.asarray(new_values, dtype=float)
+        n_new = len(new_values) - len(aggregates[f'{measure}_count'])
+        if n_new > 0:
+            for name in ['count', 'sum', 'mean', 'm2']:
+                aggregates[f'{measure}_{name}'] = np.concatenate(
+                    [aggregates[f'{measure}_{name}'], np.zeros(n_new, dtype=aggregates[f'{measure}_{name}'].dtype)])
+            recent = aggregates[f'{measure}_recent']
+            aggregates[f'{measure}_recent'] = np.vstack([recent, np.full((n_new, recent.shape[1]), np.nan)])
+
+        present = ~np.isnan(new_values)
+        x = new_values[present]
+        count = aggregates[f'{measure}_count']
+        mean = aggregates[f'{measure}_mean']
+        m2 = aggregates[f'{measure}_m2']
+
+        # Welford update
+        count[present] += 1
+        aggregates[f'{measure}_sum'][present] += x
+        delta = x - mean[present]
+        mean[present] += delta / count[present]
+        m2[present] += delta * (x - mean[present])
+
+        recent = aggregates[f'{measure}_recent']
+        recent[present] = np.column_stack([recent[present, 1:], x])
+
+def summary_from_aggregates(panel, aggregates):
+    """Station summary table (as compute_station_summary) from running aggregates"""
+    summary = pd.DataFrame({
+        'State': panel['State'],
+        'County': panel['County'],
+        'Latitude': panel['Latitude'],
+        'Longitude': panel['Longitude'],
+        'years_available': aggregates['total_count'],
+        'years_5yr': (~np.isnan(aggregates['total_recent'])).sum(axis=1)
+    })
+    summary.index.name = 'station_id'
+
+    for measure in ['total', 'damaging']:
+        count = aggregates[f'{measure}_count']
+        average = np.where(count > 0, aggregates[f'{measure}_mean'], 0.0)
+        std = np.sqrt(aggregates[f'{measure}_m2'] / np.maximum(count, 1))
+        cov = np.where((count > 1) & (average > 0), std / np.where(average > 0, average, 1) * 100, 0.0)
+        recent = aggregates[f'{measure}_recent']
+        recent_average, recent_std, recent_cov = _masked_average_and_cov(np.nan_to_num(recent), ~np.isnan(recent))
+
+        for window, (window_average, window_std, window_cov) in [('all', (average, std, cov)),
+                                                                 ('5yr', (recent_average, recent_std, recent_cov))]:
+            summary[f'{measure}_{window}_avg'] = window_average
+            summary[f'{measure}_{window}_std'] = window_std
+            summary[f'{measure}_{window}_cov'] = window_cov
+            summary[f'{measure}_{window}_variability'] = variability_categories(window_cov)
+
+    return summary
+
+def append_season(panel, season, season_data, aggregates=None):
+    """
+    Add one season, newer than every season in the panel, without touching
+    the other seasons' files. Rows are matched to existing station IDs by
+    State, cleaned County and coordinates; unmatched rows become new stations.
+    Of several rows falling into one station, the panel keeps the one closest
+    to the station's stored coordinates (for a new station, the centroid of
+    its rows).
+
+    Parameters:
+    - panel: Station panel (not modified)
+    - season: Season label, e.g. '2024-2025'
+    - season_data: Loaded DataFrame for the season
+    - aggregates: Running aggregates to update in place (optional)
+
+    Returns:
+    - The new panel with one more season column
+    """
+    if len(panel['seasons']) and season <= str(panel['seasons'][-1]):
+        raise ValueError(f"Season {season} is not newer than {panel['seasons'][-1]}")
+
+    row_station, new_stations = match_station_ids(panel, season_data)
+
+    n_old = len(panel['State'])
+    n_stations = n_old + len(new_stations)
+    new_panel = {'seasons': np.append(panel['seasons'], season).astype(str)}
+
+    latitudes = season_data['Latitude'].to_numpy(dtype=float)
+    longitudes = season_data['Longitude'].to_numpy(dtype=float)
+    new_station_rows = np.bincount(row_station, minlength=n_stations)[n_old:]
+    new_lats = np.bincount(row_station, weights=latitudes, minlength=n_stations)[n_old:] / new_station_rows
+    new_lons = np.bincount(row_station, weights=longitudes, minlength=n_stations)[n_old:] / new_station_rows
+    center_lats = np.concatenate([np.asarray(panel['Latitude'], dtype=float), new_lats])
+    center_lons = np.concatenate([np.asarray(panel['Longitude'], dtype=float), new_lons])
+    kept_rows = np.flatnonzero(keep_closest_rows(row_station, latitudes, longitudes,
+                                                 center_lats[row_station], center_lons[row_station]))
+    kept_stations = row_station[kept_rows]
+
+    # Station attributes come from the most recent season, as in a full rebuild
+    season_attributes = {
+        'State': season_data['State'].astype(str).str.strip().to_numpy(dtype=object),
+        'County': season_data['County'].astype(str).to_numpy(dtype=object),
+        'County_Clean': season_county_clean(season_data).astype(str).str.strip().str.upper().to_numpy(dtype=object),
+        'Latitude': season_data['Latitude'].to_numpy(dtype=float),
+        'Longitude': season_data['Longitude'].to_numpy(dtype=float)
+    }
+    for name, season_values in season_attributes.items():
+        values = np.concatenate([panel[name].astype(season_values.dtype),
+                                 new_stations[name].to_numpy(dtype=season_values.dtype)])
+        values[kept_stations] = season_values[kept_rows]
+        new_panel[name] = values.astype(str if values.dtype == object else float)
+
+    season_total = np.full(n_stations, np.nan)
+    season_damaging = np.full(n_stations, np.nan)
+    if len(row_station):
+        season_total[kept_stations] = season_data['Total_Freeze_Thaw_Cycles'].to_numpy(dtype=float)[kept_rows]
+        season_damaging[kept_stations] = season_data['Damaging_Freeze_Thaw_Cycles'].to_numpy(dtype=float)[kept_rows]
+
+    for measure, season_values in [('total', season_total), ('damaging', season_damaging)]:
+        grown = np.vstack([panel[measure], np.full((n_stations - n_old, panel[measure].shape[1]), np.nan)])
+        new_panel[measure] = np.column_stack([grown, season_values])
+
+    row_position = np.vstack([panel['row_position'],
+                              np.full((n_stations - n_old, panel['row_position'].shape[1]), -1, dtype=np.int32)])
+    season_position = np.full(n_stations, -1, dtype=np.int32)
+    season_position[kept_stations] = kept_rows
+    new_panel['row_position'] = np.column_stack([row_position, season_position])
+    new_panel['row_station'] = np.concatenate([panel['row_station'], row_station]).astype(np.int32)
+    new_panel['row_offsets'] = np.append(panel['row_offsets'], panel['row_offsets'][-1] + len(row_station))
+
+    if aggregates is not None:
+        update_running_aggregates(aggregates, season_total, season_damaging)
+
+    return new_panel
+
+def load_running_aggregates(seasons=None):
+    """Running aggregates for a season set, cached as CACHE_DIR/station_aggregates.npz"""
+    if seasons is None:
+        seasons = get_available_seasons()
+
+    signature = json.dumps(_panel_signature(seasons))
+    aggregates_path = os.path.join(opened_data_loader.CACHE_DIR, AGGREGATES_CACHE_FILE)
+
+    aggregates = _read_cached_arrays(aggregates_path, signature)
+    if aggregates is None:
+        aggregates = compute_running_aggregates(load_station_panel(seasons))
+        _write_cached_arrays(aggregates_path, signature, aggregates)
+
+    return aggregates
+
+def append_season_to_cache(season):
+    """
+    Ingest a newly added season workbook into the cached panel, running
+    aggregates and summary table, reading only the new workbook.
+    Falls back to a full rebuild if the season is not the newest one.
+
+    Returns:
+    - Tuple of (panel, aggregates) for all available seasons
+    """
+    seasons = get_available_seasons()
+    previous_seasons = [existing for existing in seasons if existing != season]
+    if not previous_seasons or season != seasons[-1]:
+        return load_station_panel(seasons), load_running_aggregates(seasons)
+
+    panel = load_station_panel(previous_seasons)
+    aggregates = {name: values.copy() for name, values in load_running_aggregates(previous_seasons).items()}
+    panel = append_season(panel, season, load_freeze_thaw_data_by_season(season), aggregates)
+
+    signature = json.dumps(_panel_signature(seasons))
+    _write_cached_arrays(os.path.join(opened_data_loader.CACHE_DIR, PANEL_CACHE_FILE), signature, panel)
+    _write_cached_arrays(os.path.join(opened_data_loader.CACHE_DIR, AGGREGATES_CACHE_FILE), signature, aggregates)
+
+    _write_station_summary(signature, summary_from_aggregates(panel, aggregates))
+
+    return panel, aggregates
+
+def verify_against_rebuild(panel, aggregates=None, rtol=1e-9):
+    """
+    Compare an incrementally updated panel (and its running aggregates) with a
+    full rebuild from every season workbook. Stations are matched by State,
+    cleaned County and coordinates, since incremental IDs are numbered in
+    arrival order.
+
+    Returns:
+    - List of mismatch descriptions; empty when both agree
+    """
+    rebuilt = build_station_panel(list(panel['seasons']))
+    problems = []
+
+    if not np.array_equal(rebuilt['seasons'], panel['seasons']):
+        return [f"Seasons differ: {list(panel['seasons'])} vs {list(rebuilt['seasons'])}"]
+
+    def station_keys(station_panel):
+        return pd.MultiIndex.from_arrays([np.char.upper(station_panel['State']), station_panel['County_Clean'],
+                                          station_panel['Latitude'], station_panel['Longitude']])
+
+    rebuilt_keys = station_keys(rebuilt)
+    rebuilt_rows = rebuilt_keys.get_indexer(station_keys(panel))
+    if len(rebuilt_keys) != len(panel['State']) or (rebuilt_rows < 0).any():
+        problems.append(f"Stations differ: {len(panel['State'])} incremental vs {len(rebuilt_keys)} rebuilt")
+        return problems
+
+    for measure in ['total', 'damaging']:
+        if not np.allclose(panel[measure], rebuilt[measure][rebuilt_rows], rtol=rtol, equal_nan=True):
+            problems.append(f"'{measure}' matrix differs")
+
+    if aggregates is not None:
+        incremental_summary = summary_from_aggregates(panel, aggregates)
+        rebuilt_summary = compute_station_summary(rebuilt).iloc[rebuilt_rows]
+        for column in incremental_summary.columns:
+            left = incremental_summary[column].to_numpy()
+            right = rebuilt_summary[column].to_numpy()
+            if pd.api.types.is_numeric_dtype(incremental_summary[column]):
+                same = np.allclose(left, right, rtol=rtol, atol=1e-9)
+            else:
+                same = np.array_equal(left.astype(str), right.astype(str))
+            if not same:
+                problems.append(f"Summary column '{column}' differs")
+
+    return problems
+
+def station_for_season_row(panel, season, position):
+    """
+    Station ID (panel row) of the row at a given position in a season's
+    loaded DataFrame, or None if the season is not in the panel
+    """
+    season_idx = np.flatnonzero(panel['seasons'] == season)
+    if len(season_idx) == 0:
+        return None
+    offset = panel['row_offsets'][season_idx[0]]
+    return int(panel['row_station'][offset + position])
+
+def find_station_row(panel, location_data):
+    """
+    Panel row for a location record (State, County, Latitude, Longitude).
+    When the cleaned County name is shared by several stations in the State,
+    the station with the closest coordinates is used.
+
+    Returns:
+    - Row index into the panel, or None if no station matches
+    """
+    state = str(location_data['State']).strip().upper()
+    county = str(clean_county_name(location_data['County'])).strip().upper()
+
+    candidates = np.flatnonzero((np.char.upper(panel['State']) == state) &
+                                (panel['County_Clean'] == county))
+    if len(candidates) == 0:
+        return None
+
+    lat_diff = panel['Latitude'][candidates] - location_data['Latitude']
+    lon_diff = panel['Longitude'][candidates] - location_data['Longitude']
+    return int(candidates[np.argmin(np.hypot(lat_diff, lon_diff))])
+
+def _average_and_cov(values):
+    """Mean and COV (%) as reported by the app; COV is 0 for fewer than 2 values"""
+    average = float(np.mean(values)) if len(values) > 0 else 0
+    cov = float((np.std(values) / np.mean(values) * 100)) if len(values) > 1 and np.mean(values) > 0 else 0
+    return average, cov
+
+@timed('station_statistics')
+def station_statistics(panel, row, summary=None):
+    """
+    All-years and last 5 years statistics for one panel row.
+    With a table from compute_station_summary / load_station_summary the
+    figures are read from it instead of being recomputed.
+
+    Returns:
+    - Dictionary in the format of calculate_comprehensive_statistics,
+      or None if the station has no seasons
+    """
+    if row is None:
+        return None
+
+    present = np.flatnonzero(~np.isnan(panel['total'][row]))
+    if len(present) == 0:
+        return None
+
+    # Most recent season first
+    present = present[::-1]
+    total_cycles = panel['total'][row, present]
+    damaging_cycles = panel['damaging'][row, present]
+    stats_df = pd.DataFrame({
+        'Season': panel['seasons'][present],
+        'Total_Cycles': total_cycles,
+        'Damaging_Cycles': damaging_cycles
+    }, index=np.arange(len(present))[::-1])
+
+    if summary is not None:
+        station_summary = summary.loc[row]
+        return {
+            'data': stats_df,
+            **{key: float(station_summary[key]) for key in STATISTIC_KEYS},
+            'years_available': int(station_summary['years_available'])
+        }
+
+    total_all_avg, total_all_cov = _average_and_cov(total_cycles)
+    damaging_all_avg, damaging_all_cov = _average_and_cov(damaging_cycles)
+    total_5yr_avg, total_5yr_cov = _average_and_cov(total_cycles[:5])
+    damaging_5yr_avg, damaging_5yr_cov = _average_and_cov(damaging_cycles[:5])
+
+    return {
+        'data': stats_df,
+        'total_all_avg': total_all_avg,
+        'damaging_all_avg': damaging_all_avg,
+        'total_all_cov': total_all_cov,
+        'damaging_all_cov': damaging_all_cov,
+        'total_5yr_avg': total_5yr_avg,
+        'damaging_5yr_avg': damaging_5yr_avg,
+        'total_5yr_cov': total_5yr_cov,
+        'damaging_5yr_cov': damaging_5yr_cov,
+        'years_available': len(total_cycles)
+    }
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 16:41:52 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Single-file binary store of every season, the station panel and the station
+# summary, for processes that should not parse or unpickle anything at
+# startup. The file is opened with np.memmap read-only, so every app replica
+# and batch worker on a host shares one copy of it through the OS page cache.
+#
+# Layout (little-endian):
+# - A fixed-width header (STORE_HEADER_DTYPE): magic, format version, counts,
+#   the dataset version of the workbooks, and the (offset, bytes) of every section
+# - Sections in STORE_SECTIONS order, each starting on a 64-byte boundary
+# - State, County and variability names are codes into one interned string
+#   table (UTF-8 bytes plus start offsets); cycles are float32, coordinates
+#   and summary statistics float64
+import os
+import sys
+import numpy as np
+import pandas as pd
+import opened_data_loader
+from opened_data_loader import get_available_seasons, load_all_seasons, season_county_clean, dataset_version
+from opened_station_panel import load_station_panel, load_station_summary, compute_station_summary, PANEL_FORMAT_VERSION
+
+STORE_FILE = 'station_store.bin'
+STORE_MAGIC = b'FTHWSTOR'
+STORE_FORMAT_VERSION = 2
+STORE_ALIGNMENT = 64
+STORE_SIGNATURE_BYTES = 64
+
+# Summary table columns besides State, County, Latitude and Longitude
+# (which come from the station sections), in compute_station_summary order
+STORE_SUMMARY_COLUMNS = ['years_available', 'years_5yr'] + [
+    f'{measure}_{window}_{statistic}' for measure in ['total', 'damaging'] for window in ['all', '5yr']
+    for statistic in ['avg', 'std', 'cov', 'variability']]
+
+def _summary_dtype(column):
+    """Store dtype of a summary column; variability categories are string codes"""
+    if column.startswith('years_'):
+        return '<i8'
+    return '<i4' if column.endswith('_variability') else '<f8'
+
+# (name, dtype, shape) of each section; shapes use the header counts
+STORE_SECTIONS = [
+    ('season_codes', '<i4', ('seasons',)),
+    ('station_state', '<i4', ('stations',)),
+    ('station_county', '<i4', ('stations',)),
+    ('station_county_clean', '<i4', ('stations',)),
+    ('station_latitude', '<f8', ('stations',)),
+    ('station_longitude', '<f8', ('stations',)),
+    ('total', '<f4', ('stations', 'seasons')),
+    ('damaging', '<f4', ('stations', 'seasons')),
+    ('row_position', '<i4', ('stations', 'seasons')),
+    ('row_offsets', '<i8', ('seasons_plus_one',)),
+    ('row_station', '<i4', ('rows',)),
+    ('row_index', '<i8', ('rows',)),
+    ('row_state', '<i4', ('rows',)),
+    ('row_county', '<i4', ('rows',)),
+    ('row_county_clean', '<i4', ('rows',)),
+    ('row_latitude', '<f8', ('rows',)),
+    ('row_longitude', '<f8', ('rows',)),
+    ('row_total', '<f4', ('rows',)),
+    ('row_damaging', '<f4', ('rows',)),
+    ('string_offsets', '<i8', ('strings_plus_one',)),
+    ('string_bytes', 'u1', ('string_bytes',))
+] + [(f'summary_{column}', _summary_dtype(column), ('stations',)) for column in STORE_SUMMARY_COLUMNS]
+
+STORE_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_seasons', '<u4'),
+    ('n_stations', '<u8'),
+    ('n_rows', '<u8'),
+    ('n_strings', '<u8'),
+    ('n_string_bytes', '<u8'),
+    ('signature', f'S{STORE_SIGNATURE_BYTES}'),
+    ('sections', '<u8', (len(STORE_SECTIONS), 2))
+])
+
+def _intern_strings(*columns):
+    """
+    One sorted table of the distinct strings in columns, and each column
+    as int32 codes into it
+    """
+    values = [np.asarray(column, dtype=str) for column in columns]
+    strings, codes = np.unique(np.concatenate(values) if values else np.array([], dtype=str),
+                               return_inverse=True)
+    splits = np.cumsum([len(column) for column in values])[:-1]
+    return strings, [part.astype(np.int32) for part in np.split(codes, splits)]
+
+def write_station_store(path, panel, season_frames, signature='', summary=None):
+    """
+    Write a panel, its season DataFrames and its summary as one binary store file.
+
+    Parameters:
+    - path: File to write (replaced atomically)
+    - panel: Station x season panel (build_station_panel / load_station_panel)
+    - season_frames: Loaded season DataFrames, in panel['seasons'] order
+    - signature: Text identifying the workbooks the data came from (dataset_version)
+    - summary: Station summary table of the panel (default: compute_station_summary)
+    """
+    encoded_signature = signature.encode('utf-8')
+    if len(encoded_signature) > STORE_SIGNATURE_BYTES:
+        raise ValueError(f"Store signature is longer than {STORE_SIGNATURE_BYTES} bytes")
+
+    if summary is None:
+        summary = compute_station_summary(panel)
+    variability_columns = [column for column in STORE_SUMMARY_COLUMNS if column.endswith('_variability')]
+
+    row_frames = [frame for frame in season_frames if not frame.empty]
+    row_state = [frame['State'].astype(str).to_numpy() for frame in row_frames]
+    row_county = [frame['County'].astype(str).to_numpy() for frame in row_frames]
+    row_county_clean = [season_county_clean(frame).astype(str).to_numpy() for frame in row_frames]
+    strings, codes = _intern_strings(panel['seasons'], panel['State'], panel['County'], panel['County_Clean'],
+                                     np.concatenate(row_state) if row_frames else [],
+                                     np.concatenate(row_county) if row_frames else [],
+                                     np.concatenate(row_county_clean) if row_frames else [],
+                                     *(summary[column].to_numpy(dtype=str) for column in variability_columns))
+    summary_codes = dict(zip(variability_columns, codes[7:]))
+    encoded_strings = [string.encode('utf-8') for string in strings]
+    string_offsets = np.concatenate([[0], np.cumsum([len(string) for string in encoded_strings])])
+
+    def row_column(column, dtype):
+        if not row_frames:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([frame[column].to_numpy(dtype=dtype) for frame in row_frames])
+
+    sections = {
+        'season_codes': codes[0],
+        'station_state': codes[1],
+        'station_county': codes[2],
+        'station_county_clean': codes[3],
+        'station_latitude': panel['Latitude'],
+        'station_longitude': panel['Longitude'],
+        'total': panel['total'],
+        'damaging': panel['damaging'],
+        'row_position': panel['row_position'],
+        'row_offsets': panel['row_offsets'],
+        'row_station': panel['row_station'],
+        'row_index': np.concatenate([frame.index.to_numpy(dtype=np.int64) for frame in row_frames])
+                     if row_frames else np.empty(0, dtype=np.int64),
+        'row_state': codes[4],
+        'row_county': codes[5],
+        'row_county_clean': codes[6],
+        'row_latitude': row_column('Latitude', float),
+        'row_longitude': row_column('Longitude', float),
+        'row_total': row_column('Total_Freeze_Thaw_Cycles', float),
+        'row_damaging': row_column('Damaging_Freeze_Thaw_Cycles', float),
+        'string_offsets': string_offsets,
+        'string_bytes': np.frombuffer(b''.join(encoded_strings), dtype=np.uint8),
+        **{f'summary_{column}': summary_codes[column] if column in summary_codes else summary[column].to_numpy()
+           for column in STORE_SUMMARY_COLUMNS}
+    }
+
+    header = np.zeros(1, dtype=STORE_HEADER_DTYPE)
+    header['magic'] = STORE_MAGIC
+    header['version'] = STORE_FORMAT_VERSION
+    header['n_seasons'] = len(panel['seasons'])
+    header['n_stations'] = len(panel['State'])
+    header['n_rows'] = len(panel['row_station'])
+    header['n_strings'] = len(strings)
+    header['n_string_bytes'] = string_offsets[-1]
+    header['signature'] = encoded_signature
+
+    offset = STORE_HEADER_DTYPE.itemsize
+    blobs = []
+    for position, (name, dtype, _) in enumerate(STORE_SECTIONS):
+        offset += -offset % STORE_ALIGNMENT
+        blob = np.ascontiguousarray(sections[name], dtype=dtype).tobytes()
+        header['sections'][0, position] = (offset, len(blob))
+        blobs.append((offset, blob))
+        offset += len(blob)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as store_file:
+        store_file.write(header.tobytes())
+        for blob_offset, blob in blobs:
+            store_file.write(b'\x00' * (blob_offset - store_file.tell()))
+            store_file.write(blob)
+    os.replace(temp_path, path)
+
+def read_store_signature(path):
+    """Signature text of a store file, or None if it is missing or not a store"""
+    try:
+        with open(path, 'rb') as store_file:
+            header = np.frombuffer(store_file.read(STORE_HEADER_DTYPE.itemsize), dtype=STORE_HEADER_DTYPE)
+    except (OSError, ValueError):
+        return None
+    if len(header) != 1 or header['magic'][0] != STORE_MAGIC or header['version'][0] != STORE_FORMAT_VERSION:
+        return None
+    return header['signature'][0].decode('utf-8')
+
+def open_station_store(path):
+    """
+    Memory-map a store file read-only. Nothing is parsed or copied except
+    the string table.
+
+    Returns:
+    - Dictionary in the station panel format (seasons, State, County,
+      County_Clean, Latitude, Longitude, total, damaging, row_station,
+      row_offsets, row_position), whose numeric arrays are read-only views of
+      the file, plus 'strings' (the interned string table), 'string_dtype'
+      (a categorical dtype over it), the code, row and summary arrays of
+      STORE_SECTIONS, and 'signature'
+    """
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    header = mapped[:STORE_HEADER_DTYPE.itemsize].view(STORE_HEADER_DTYPE)[0]
+    if header['magic'] != STORE_MAGIC:
+        raise ValueError(f"'{path}' is not a station store")
+    if header['version'] != STORE_FORMAT_VERSION:
+        raise ValueError(f"'{path}' has store format {header['version']}, expected {STORE_FORMAT_VERSION}")
+
+    counts = {
+        'seasons': int(header['n_seasons']),
+        'seasons_plus_one': int(header['n_seasons']) + 1,
+        'stations': int(header['n_stations']),
+        'rows': int(header['n_rows']),
+        'strings_plus_one': int(header['n_strings']) + 1,
+        'string_bytes': int(header['n_string_bytes'])
+    }
+
+    store = {}
+    for position, (name, dtype, shape) in enumerate(STORE_SECTIONS):
+        offset, n_bytes = (int(value) for value in header['sections'][position])
+        store[name] = mapped[offset:offset + n_bytes].view(dtype).reshape(tuple(counts[dim] for dim in shape))
+
+    string_bytes = store['string_bytes'].tobytes()
+    string_offsets = store['string_offsets']
+    strings = np.array([string_bytes[start:end].decode('utf-8')
+                        for start, end in zip(string_offsets[:-1], string_offsets[1:])], dtype=str)
+
+    store.update({
+        'strings': strings,
+        'string_dtype': pd.CategoricalDtype(strings),
+        'signature': header['signature'].decode('utf-8'),
+        'seasons': strings[store['season_codes']],
+        'State': strings[store['station_state']],
+        'County': strings[store['station_county']],
+        'County_Clean': strings[store['station_county_clean']],
+        'Latitude': store['station_latitude'],
+        'Longitude': store['station_longitude']
+    })
+    return store
+
+def store_season_frame(store, season):
+    """
+    One season's rows from a store, as a DataFrame with the loader's standard
+    columns and County_Clean. Coordinates and (float32) cycles are views of
+    the file; the name columns are categoricals over the store's string table.
+    Other workbook columns are not kept in the store.
+    """
+    season_idx = np.flatnonzero(store['seasons'] == season)
+    if len(season_idx) == 0:
+        raise KeyError(season)
+    rows = slice(store['row_offsets'][season_idx[0]], store['row_offsets'][season_idx[0] + 1])
+
+    def names(codes):
+        return pd.Categorical.from_codes(codes[rows], dtype=store['string_dtype'])
+
+    return pd.DataFrame({
+        'State': names(store['row_state']),
+        'County': names(store['row_county']),
+        'Latitude': store['row_latitude'][rows],
+        'Longitude': store['row_longitude'][rows],
+        'Total_Freeze_Thaw_Cycles': store['row_total'][rows],
+        'Damaging_Freeze_Thaw_Cycles': store['row_damaging'][rows],
+        'County_Clean': names(store['row_county_clean'])
+    }, index=pd.Index(store['row_index'][rows]), copy=False)
+
+def store_panel(store):
+    """The station x season panel of a store (load_station_panel format, views of the file)"""
+    return {name: store[name] for name in ['seasons', 'State', 'County', 'County_Clean', 'Latitude', 'Longitude',
+                                           'total', 'damaging', 'row_station', 'row_offsets', 'row_position']}
+
+def store_summary(store):
+    """The station summary table of a store (load_station_summary format)"""
+    columns = {
+        'State': store['State'],
+        'County': store['County'],
+        'Latitude': store['Latitude'],
+        'Longitude': store['Longitude']
+    }
+    for column in STORE_SUMMARY_COLUMNS:
+        values = store[f'summary_{column}']
+        columns[column] = store['strings'][values] if column.endswith('_variability') else values
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(store['State']), name='station_id'), copy=False)
+
+def load_station_store(seasons=None, path=None):
+    """
+    Open the store for the current season workbooks, writing it first if it
+    is missing or was written from different workbooks.
+
+    Parameters:
+    - seasons: Seasons to include (default: all available)
+    - path: Store file (default: CACHE_DIR/station_store.bin)
+    """
+    if seasons is None:
+        seasons = get_available_seasons()
+    seasons = sorted(seasons)
+    if path is None:
+        path = os.path.join(opened_data_loader.CACHE_DIR, STORE_FILE)
+
+    # The panel format is part of the signature, so a store built by older
+    # panel code is rewritten even if the workbooks did not change
+    signature = f'{dataset_version(seasons)}.{PANEL_FORMAT_VERSION}'
+    if read_store_signature(path) != signature:
+        season_data, _ = load_all_seasons(seasons)
+        write_station_store(path, load_station_panel(seasons), list(season_data.values()), signature,
+                            load_station_summary(seasons))
+
+    return open_station_store(path)
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(opened_data_loader.CACHE_DIR, STORE_FILE)
+    store = load_station_store(path=path)
+    print(f"Station store '{path}': {len(store['seasons'])} seasons, {len(store['State'])} stations, "
+          f"{len(store['row_station'])} rows, {os.path.getsize(path) / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 00:10:24 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Mann-Kendall trend test and Sen's slope of every station's season series.
+# All season pairs (i < j) are laid out once as index arrays, so the pairwise
+# differences of a block of stations come from one (stations, pairs) array;
+# missing seasons drop out of the pairs they belong to. Slopes are in cycles
+# per season. Results are cached per dataset version, so the test runs once
+# per change of the workbooks rather than at every load.
+import os
+import sys
+import math
+import numpy as np
+import pandas as pd
+import opened_data_loader
+from opened_data_loader import dataset_version
+from opened_station_panel import load_station_panel
+from opened_instrumentation import timed
+
+TRENDS_CACHE_FILE = 'station_trends.npz'
+
+# Part of the trends cache key with the parameters below; bump it whenever
+# the computation or the output columns change
+TRENDS_FORMAT_VERSION = 1
+
+TREND_ALPHA = 0.05
+
+# Stations with fewer seasons than this get no test result
+TREND_MIN_SEASONS = 4
+
+# Upper bound on the number of pairwise values held in memory at once
+TREND_BLOCK = 4_000_000
+
+_erfc = np.frompyfunc(math.erfc, 1, 1)
+
+def trend_directions(p_values, slopes, alpha=TREND_ALPHA):
+    """'Increasing', 'Decreasing' or 'No trend' per station ('' without a result)"""
+    p_values = np.asarray(p_values, dtype=float)
+    significant = p_values < alpha
+    return np.where(np.isnan(p_values), '',
+                    np.where(significant & (slopes > 0), 'Increasing',
+                             np.where(significant & (slopes < 0), 'Decreasing', 'No trend')))
+
+def _mann_kendall_block(values, earlier, later):
+    """S, its tie-corrected variance and Sen's slope of each row of a block of stations"""
+    differences = values[:, later] - values[:, earlier]
+    s = np.nansum(np.sign(differences), axis=1)
+
+    # Tie groups: each value counted once per member of its group (t values
+    # of size t), so summing (t - 1)(2t + 5) per value gives sum t(t - 1)(2t + 5)
+    n = (~np.isnan(values)).sum(axis=1)
+    tie_sizes = (values[:, :, None] == values[:, None, :]).sum(axis=2)
+    ties = np.where(~np.isnan(values), (tie_sizes - 1) * (2 * tie_sizes + 5), 0).sum(axis=1)
+    var_s = (n * (n - 1) * (2 * n + 5) - ties) / 18
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = differences / (later - earlier)
+        has_pair = ~np.isnan(slopes).all(axis=1)
+        sen_slope = np.full(len(values), np.nan)
+        if has_pair.any():
+            sen_slope[has_pair] = np.nanmedian(slopes[has_pair], axis=1)
+    return s, var_s, sen_slope
+
+def mann_kendall(values, alpha=TREND_ALPHA, block_size=TREND_BLOCK):
+    """
+    Mann-Kendall test and Sen's slope of each row of a (stations, seasons)
+    array, NaN marking missing seasons
+
+    Parameters:
+    - values: (stations, seasons) array
+    - alpha: Significance level of the trend direction
+    - block_size: Maximum number of pairwise values per NumPy pass
+
+    Returns:
+    - Dictionary of (stations,) arrays: 'n' (seasons with data), 's' (the
+      Mann-Kendall S), 'var_s' (its variance with the tie correction), 'z',
+      'p_value' (two-sided, normal approximation), 'sen_slope' (median of
+      the pairwise slopes) and 'trend'; NaN for rows with fewer than
+      TREND_MIN_SEASONS seasons
+    """
+    values = np.asarray(values, dtype=float)
+    n_stations, n_seasons = values.shape
+    n = (~np.isnan(values)).sum(axis=1)
+    earlier, later = np.triu_indices(n_seasons, k=1)
+
+    s = np.zeros(n_stations)
+    var_s = np.zeros(n_stations)
+    sen_slope = np.full(n_stations, np.nan)
+    step = max(1, block_size // max(n_seasons * n_seasons, 1))
+    for start in range(0, n_stations, step):
+        block = slice(start, start + step)
+        s[block], var_s[block], sen_slope[block] = _mann_kendall_block(values[block], earlier, later)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(var_s > 0, (s - np.sign(s)) / np.sqrt(np.where(var_s > 0, var_s, 1)), 0.0)
+        p_value = _erfc(np.abs(z) / math.sqrt(2)).astype(float)
+
+    enough = n >= TREND_MIN_SEASONS
+    results = {
+        'n': n,
+        's': np.where(enough, s, np.nan),
+        'var_s': np.where(enough, var_s, np.nan),
+        'z': np.where(enough, z, np.nan),
+        'p_value': np.where(enough, p_value, np.nan),
+        'sen_slope': np.where(enough, sen_slope, np.nan)
+    }
+    results['trend'] = trend_directions(results['p_value'], results['sen_slope'], alpha)
+    return results
+
+@timed('trends')
+def compute_station_trends(panel, alpha=TREND_ALPHA):
+    """
+    Trend of Total and Damaging cycles at every station
+
+    Returns:
+    - DataFrame indexed by station ID with State, County, Latitude,
+      Longitude, years_available and, for total and damaging, the
+      '{m}_mk_s', '{m}_mk_z', '{m}_p_value', '{m}_sen_slope' and '{m}_trend'
+      columns
+    """
+    trends = pd.DataFrame({
+        'State': panel['State'],
+        'County': panel['County'],
+        'Latitude': panel['Latitude'],
+        'Longitude': panel['Longitude'],
+        'years_available': (~np.isnan(panel['total'])).sum(axis=1)
+    })
+    trends.index.name = 'station_id'
+
+    for measure in ['total', 'damaging']:
+        results = mann_kendall(panel[measure], alpha)
+        trends[f'{measure}_mk_s'] = results['s']
+        trends[f'{measure}_mk_z'] = results['z']
+        trends[f'{measure}_p_value'] = results['p_value']
+        trends[f'{measure}_sen_slope'] = results['sen_slope']
+        trends[f'{measure}_trend'] = results['trend']
+
+    return trends
+
+def load_station_trends(seasons=None, panel=None):
+    """
+    compute_station_trends of the current season workbooks, persisted as
+    CACHE_DIR/station_trends.npz and recomputed only when a workbook,
+    TRENDS_FORMAT_VERSION, TREND_MIN_SEASONS or TREND_ALPHA changes
+
+    Parameters:
+    - seasons: Seasons to include (default: all available)
+    - panel: Station x season panel of those seasons (default: load_station_panel)
+    """
+    if seasons is None:
+        seasons = opened_data_loader.get_available_seasons()
+    signature = (f'{dataset_version(seasons)}|format={TRENDS_FORMAT_VERSION}|'
+                 f'min_seasons={TREND_MIN_SEASONS}|alpha={TREND_ALPHA}')
+    trends_path = os.path.join(opened_data_loader.CACHE_DIR, TRENDS_CACHE_FILE)
+
+    try:
+        with np.load(trends_path, allow_pickle=False) as cached:
+            if str(cached['signature']) == signature:
+                columns = {name: cached[name] for name in cached.files if name not in ['signature', 'station_id']}
+                return pd.DataFrame(columns, index=pd.Index(cached['station_id'], name='station_id'))
+    except (OSError, KeyError, ValueError):
+        pass
+
+    if panel is None:
+        panel = load_station_panel(seasons)
+    trends = compute_station_trends(panel)
+    columns = {}
+    for name in trends.columns:
+        values = trends[name].to_numpy()
+        columns[name] = values.astype(str) if values.dtype == object else values
+    try:
+        os.makedirs(opened_data_loader.CACHE_DIR, exist_ok=True)
+        temp_path = f'{trends_path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, signature=np.array(signature), station_id=trends.index.to_numpy(), **columns)
+        os.replace(temp_path, trends_path)
+    except OSError as e:
+        print(f"Warning: Could not write station trends cache: {str(e)}")
+    return trends
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python opened_trend_analysis.py OUTPUT_CSV")
+        sys.exit(1)
+
+    trends = compute_station_trends(load_station_panel())
+    trends.to_csv(sys.argv[1])
+    for measure in ['total', 'damaging']:
+        counts = trends[f'{measure}_trend'].value_counts()
+        print(f"{measure}: {counts.get('Increasing', 0)} increasing, {counts.get('Decreasing', 0)} decreasing, "
+              f"{counts.get('No trend', 0)} without a significant trend")
+    print(f"Wrote {len(trends)} stations to {sys.argv[1]}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
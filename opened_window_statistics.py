@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 18:04:37 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# Statistics over any contiguous range of seasons, for every station at once.
+# Per-station cumulative counts, sums and sums of squares along the season
+# axis turn each window into a difference of two columns, so a query costs
+# O(1) per station whatever the window length.
+import numpy as np
+import pandas as pd
+from opened_station_panel import variability_categories
+from opened_instrumentation import timed
+
+def build_season_prefix_sums(panel):
+    """
+    Prefix sums of a station x season panel
+
+    Returns:
+    - Dictionary with 'seasons' and, for total and damaging, '{m}_count',
+      '{m}_sum' and '{m}_sum_sq' arrays of shape (stations, seasons + 1);
+      column j covers seasons 0 .. j-1 and missing seasons add nothing
+    """
+    prefix = {'seasons': np.asarray(panel['seasons'], dtype=str)}
+    for measure in ['total', 'damaging']:
+        values = np.asarray(panel[measure], dtype=float)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        leading = np.zeros((len(values), 1))
+        prefix[f'{measure}_count'] = np.concatenate([leading, np.cumsum(present, axis=1)], axis=1).astype(np.int32)
+        prefix[f'{measure}_sum'] = np.concatenate([leading, np.cumsum(filled, axis=1)], axis=1)
+        prefix[f'{measure}_sum_sq'] = np.concatenate([leading, np.cumsum(filled ** 2, axis=1)], axis=1)
+    return prefix
+
+def season_position(prefix, season):
+    """Index of a season label in the panel, raising ValueError if it is not there"""
+    positions = np.flatnonzero(prefix['seasons'] == season)
+    if len(positions) == 0:
+        raise ValueError(f"Season {season} is not in the data")
+    return int(positions[0])
+
+def window_moments(prefix, measure, start, end):
+    """
+    Count, mean, standard deviation and COV (%) of a measure over seasons
+    start .. end-1, with the conventions of station_statistics (population
+    std; mean and std 0 without data; COV 0 for fewer than 2 values or a
+    zero mean). start and end may be integers or arrays of window bounds;
+    results have shape (stations,) or (stations, windows).
+    """
+    def window(name):
+        values = prefix[f'{measure}_{name}']
+        return values[:, end] - values[:, start]
+
+    counts = window('count')
+    safe_counts = np.maximum(counts, 1)
+    average = window('sum') / safe_counts
+    std = np.sqrt(np.maximum(window('sum_sq') / safe_counts - average ** 2, 0))
+    cov = np.where((counts > 1) & (average > 0), std / np.where(average > 0, average, 1) * 100, 0.0)
+    return counts, np.where(counts > 0, average, 0.0), np.where(counts > 0, std, 0.0), cov
+
+@timed('window_statistics')
+def season_window_statistics(panel, first_season, last_season, prefix=None):
+    """
+    Statistics of every station over seasons first_season .. last_season
+    (inclusive, e.g. '2010-2011' to '2019-2020')
+
+    Parameters:
+    - panel: Station x season panel
+    - first_season, last_season: Season labels bounding the window
+    - prefix: build_season_prefix_sums(panel), if already computed
+
+    Returns:
+    - DataFrame indexed by station ID with State, County, Latitude,
+      Longitude, years_in_window and, for total and damaging, the avg, std,
+      cov and variability columns (e.g. 'total_cov')
+    """
+    if prefix is None:
+        prefix = build_season_prefix_sums(panel)
+
+    start = season_position(prefix, first_season)
+    end = season_position(prefix, last_season) + 1
+    if end <= start:
+        raise ValueError(f"Season window {first_season} to {last_season} is empty")
+
+    statistics = pd.DataFrame({
+        'State': panel['State'],
+        'County': panel['County'],
+        'Latitude': panel['Latitude'],
+        'Longitude': panel['Longitude']
+    })
+    statistics.index.name = 'station_id'
+
+    for measure in ['total', 'damaging']:
+        counts, average, std, cov = window_moments(prefix, measure, start, end)
+        statistics['years_in_window'] = counts
+        statistics[f'{measure}_avg'] = average
+        statistics[f'{measure}_std'] = std
+        statistics[f'{measure}_cov'] = cov
+        statistics[f'{measure}_variability'] = variability_categories(cov)
+
+    return statistics
+
+@timed('rolling_statistics')
+def rolling_window_statistics(panel, window_years, prefix=None):
+    """
+    Statistics of every station over every run of window_years consecutive
+    seasons
+
+    Returns:
+    - Dictionary with 'end_seasons' (last season of each window), 'counts'
+      (seasons with data per station and window) and, for total and
+      damaging, '{m}_avg', '{m}_std' and '{m}_cov' arrays of shape
+      (stations, windows)
+    """
+    if prefix is None:
+        prefix = build_season_prefix_sums(panel)
+
+    n_seasons = len(prefix['seasons'])
+    if not 1 <= window_years <= n_seasons:
+        raise ValueError(f"Window of {window_years} seasons does not fit {n_seasons} seasons")
+
+    starts = np.arange(n_seasons - window_years + 1)
+    rolling = {'end_seasons': prefix['seasons'][starts + window_years - 1]}
+    for measure in ['total', 'damaging']:
+        counts, average, std, cov = window_moments(prefix, measure, starts, starts + window_years)
+        rolling['counts'] = counts
+        rolling[f'{measure}_avg'] = average
+        rolling[f'{measure}_std'] = std
+        rolling[f'{measure}_cov'] = cov
+
+    return rolling
\ No newline at end of file
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:12:31 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+# The modules live at the top of the repository and read the season
+# workbooks (and the cache directory) relative to the working directory.
+import os
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+@pytest.fixture
+def repo_dir(monkeypatch):
+    """Run the test from the repository root, where the season workbooks are"""
+    monkeypatch.chdir(REPO_DIR)
+    return REPO_DIR
\ No newline at end of file
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 09:14:02 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import numpy as np
+import pandas as pd
+import pytest
+from opened_batch_analysis import OUTPUT_COLUMNS, run_batch
+
+def _sites(tmp_path):
+    """3000 Colorado sites; the last 1000 (at 0, 0) have no station in range"""
+    rng = np.random.default_rng(0)
+    sites = pd.DataFrame({
+        'site_id': np.arange(3000),
+        'state': 'Colorado',
+        'lat': np.r_[rng.uniform(37, 41, 2000), np.zeros(1000)],
+        'lon': np.r_[rng.uniform(-108, -102, 2000), np.zeros(1000)]
+    })
+    input_path = tmp_path / 'sites.csv'
+    sites.to_csv(input_path, index=False)
+    return str(input_path)
+
+def test_parquet_output_with_an_unmatched_chunk(repo_dir, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    output_path = str(tmp_path / 'results.parquet')
+
+    assert run_batch(_sites(tmp_path), output_path, workers=1, chunk_size=1000) == 3000
+
+    schema = pq.read_schema(output_path)
+    assert schema.names == OUTPUT_COLUMNS
+    assert str(schema.field('station_state').type) == 'string'
+    assert str(schema.field('years_available').type) == 'int64'
+    results = pq.read_table(output_path).to_pandas()
+    assert results['station_state'].iloc[:2000].notna().any()
+    assert results['station_state'].iloc[2000:].isna().all()
+
+def test_csv_years_available_is_an_integer(repo_dir, tmp_path):
+    output_path = str(tmp_path / 'results.csv')
+
+    run_batch(_sites(tmp_path), output_path, workers=1, chunk_size=1000)
+
+    years = pd.read_csv(output_path, dtype={'years_available': str})['years_available']
+    assert years.iloc[:2000].dropna().str.fullmatch(r'\d+').all()
+    assert years.iloc[2000:].isna().all()
\ No newline at end of file
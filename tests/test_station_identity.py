@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 10:02:47 2026
+
+@author: bahaa
+"""
+
+################## Stastical Analysis
+import numpy as np
+import pandas as pd
+from opened_station_identity import resolve_station_ids, duplicate_station_rows, DUPLICATE_STATION_REASON
+from opened_station_panel import build_panel_from_frames, append_season
+
+def _season(rows, index=None):
+    """Season DataFrame of (latitude, longitude, total) rows, all in one county"""
+    latitudes, longitudes, totals = (list(values) for values in zip(*rows))
+    return pd.DataFrame({
+        'State': 'Colorado',
+        'County': 'Denver',
+        'Latitude': latitudes,
+        'Longitude': longitudes,
+        'Total_Freeze_Thaw_Cycles': totals,
+        'Damaging_Freeze_Thaw_Cycles': [0.0] * len(rows)
+    }, index=index)
+
+def test_same_season_rows_of_one_station_keep_the_closest_to_the_centroid():
+    # The second season has two rows 0.005 degrees apart: the same station.
+    # The first of them sits on the station's centroid and must be the one kept.
+    frames = [_season([(40.0, -100.0, 10.0)]),
+              _season([(40.0, -100.0, 20.0), (40.005, -100.0, 30.0)], index=[0, 4])]
+
+    identity = resolve_station_ids(frames)
+    assert identity['row_station'].tolist() == [0, 0, 0]
+    assert identity['row_position'].tolist() == [[0, 0]]
+
+    panel = build_panel_from_frames(['2000-2001', '2001-2002'], frames)
+    assert panel['total'].tolist() == [[10.0, 20.0]]
+    assert panel['Latitude'].tolist() == [40.0]
+
+    rejects = duplicate_station_rows(panel['seasons'], identity['row_station'], identity['row_offsets'],
+                                     identity['row_position'], [0, 0, 4])
+    assert rejects.to_dict('records') == [{'season': '2001-2002', 'row': 4, 'reason': DUPLICATE_STATION_REASON}]
+
+def test_appended_season_keeps_the_row_closest_to_the_station():
+    panel = build_panel_from_frames(['2000-2001'], [_season([(40.0, -100.0, 10.0)])])
+
+    appended = append_season(panel, '2001-2002', _season([(40.0, -100.0, 20.0), (40.005, -100.0, 30.0)]))
+
+    assert appended['total'].tolist() == [[10.0, 20.0]]
+    assert appended['row_position'].tolist() == [[0, 0]]
+    assert np.array_equal(appended['Latitude'], [40.0])
\ No newline at end of file